@@ -0,0 +1,49 @@
+# -*-coding:utf-8-*-
+# Copyright (c) 2020 DJI.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License in the file LICENSE.txt or at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compares algo.crc16_calc against the original byte-by-byte table walk on v1 frame sizes.
+
+Usage: python crc_benchmark.py
+"""
+
+import os
+import timeit
+
+from robomaster import algo
+
+
+FRAME_SIZES = (13, 64, 256, 1024, 1500)
+
+
+def crc16_bytewise(data, crc=0x3692):
+    for t in range(0, len(data)):
+        crc = ((crc >> 8) & 0xff) ^ algo.crc16_table[((crc ^ data[t]) & 0xff)]
+    return crc
+
+
+def measure(fun, data, number):
+    return min(timeit.repeat(lambda: fun(data), number=number, repeat=5)) / number
+
+
+if __name__ == '__main__':
+    print("{0:>6} {1:>14} {2:>14} {3:>8}".format("bytes", "bytewise us", "crc16_calc us", "speedup"))
+    for size in FRAME_SIZES:
+        data = os.urandom(size)
+        assert crc16_bytewise(data) == algo.crc16_calc(data)
+        number = max(100, 200000 // size)
+        t_ref = measure(crc16_bytewise, data, number)
+        t_new = measure(algo.crc16_calc, data, number)
+        print("{0:>6} {1:>14.2f} {2:>14.2f} {3:>7.1f}x".format(size, t_ref * 1e6, t_new * 1e6, t_ref / t_new))
@@ -0,0 +1,293 @@
+# -*-coding:utf-8-*-
+# Copyright (c) 2020 DJI.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License in the file LICENSE.txt or at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Latency and throughput benchmarks for the control/telemetry path:
+Msg.pack, decode_msg, Msg.unpack_protocol, Client.send_sync_msg over loopback
+(against simulator.RobotSimulator), DDS dispatch versus subscriber count and
+ActionDispatcher._on_recv versus in-progress actions.
+
+p50/p99 are per-call latencies, every call is timed on its own; decode/*_x8 feeds
+8 frames per call and reports the time per frame. dds latency is push-to-callback
+with one push in flight, while its ops/s comes from a back-to-back burst.
+
+Usage:
+    python sdk_benchmark.py                          # run and print p50/p99/ops
+    python sdk_benchmark.py --save baseline.json     # store results as a baseline
+    python sdk_benchmark.py --compare baseline.json  # exit 1 if p50 regressed beyond --tolerance
+    python sdk_benchmark.py --filter dds             # only benchmarks whose name contains "dds"
+"""
+
+import sys
+import json
+import time
+import struct
+import argparse
+import threading
+
+from robomaster import protocol
+from robomaster import action
+from robomaster import chassis
+from robomaster import dds
+from robomaster import simulator
+
+
+class _StubClient(object):
+    hostbyte = protocol.host2byte(9, 6)
+
+    def add_handler(self, obj, name, f):
+        pass
+
+    def send_msg(self, msg):
+        msg.pack()
+
+
+class _StubRobot(object):
+    client = _StubClient()
+
+
+def _frame(proto, sender=0x03, receiver=0x09, is_ack=False):
+    msg = protocol.Msg(sender, receiver, proto)
+    msg._is_ack = is_ack
+    return bytes(msg.pack(is_ack))
+
+
+class _RawProto(object):
+    """ 以固定数据打包的协议，用于构造应答与推送帧 """
+
+    def __init__(self, proto, payload):
+        self._proto = proto
+        self._payload = payload
+
+    def pack_frame(self, is_ack):
+        self._proto.pack_req = lambda: self._payload
+        self._proto.pack_resp = lambda: self._payload
+        return _frame(self._proto, is_ack=is_ack)
+
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100.0))]
+
+
+def measure(fun, number):
+    """ 逐次调用计时，返回每次调用的耗时样本，单位秒，包含约 0.1us 的计时开销 """
+    samples = [0.0] * max(1, number)
+    clock = time.perf_counter
+    for i in range(len(samples)):
+        start = clock()
+        fun()
+        samples[i] = clock() - start
+    return samples
+
+
+def result(samples, count=None, elapsed=None):
+    if count is None:
+        ops = 1.0 / (sum(samples) / len(samples))
+    else:
+        ops = count / elapsed
+    return {"p50": percentile(samples, 50), "p99": percentile(samples, 99), "ops": ops}
+
+
+def bench_pack(number):
+    results = {}
+    protos = {"ProtoPositionMove": protocol.ProtoPositionMove, "ProtoGetSn": protocol.ProtoGetSn,
+              "ProtoSetRobotMode": protocol.ProtoSetRobotMode}
+    for name, cls in protos.items():
+        msg = protocol.Msg(0x09, 0x03, cls())
+        results["pack/" + name] = result(measure(msg.pack, number))
+    return results
+
+
+def bench_decode(number):
+    frame = _RawProto(protocol.ProtoPushPeriodMsg(), bytes([3, 21]) + struct.pack('<ffffff', *range(6))).pack_frame(False)
+    decoder = protocol.MsgDecoder()
+    batch = frame * 8
+    results = {
+        "decode/decode_msg": result(measure(lambda: protocol.decode_msg(frame), number)),
+        "decode/MsgDecoder.feed": result(measure(lambda: decoder.feed(frame), number)),
+    }
+    samples = measure(lambda: decoder.feed(batch), number // 8)
+    results["decode/MsgDecoder.feed_x8"] = result([s / 8 for s in samples])
+    return results
+
+
+def bench_unpack(number):
+    frames = {
+        "ProtoPushPeriodMsg": _RawProto(protocol.ProtoPushPeriodMsg(),
+                                        bytes([3, 21]) + struct.pack('<fff', 1, 2, 3)).pack_frame(False),
+        "ProtoPositionPush": _RawProto(protocol.ProtoPositionPush(),
+                                       bytes([1, 50, 0]) + struct.pack('<hhh', 1, 2, 3)).pack_frame(False),
+        "ProtoPositionMove": _RawProto(protocol.ProtoPositionMove(), b'\x00\x00').pack_frame(True),
+        "ProtoGetSn": _RawProto(protocol.ProtoGetSn(), b'\x00\x0e\x00' + b'3JKDH2T0011000').pack_frame(True),
+    }
+    results = {}
+    for name, frame in frames.items():
+        msg, _ = protocol.decode_msg(frame)
+        results["unpack/" + name] = result(measure(msg.unpack_protocol, number))
+    return results
+
+
+def bench_send_sync(number, proto_type="udp"):
+    sim = simulator.RobotSimulator(proto_type=proto_type)
+    sim.start()
+    cli = sim.create_client()
+    cli.start()
+    try:
+        msg = protocol.Msg(cli.hostbyte, protocol.host2byte(8, 1), protocol.ProtoGetSn())
+        cli.send_sync_msg(msg)
+        samples = []
+        start = time.perf_counter()
+        for _ in range(number):
+            t = time.perf_counter()
+            msg = protocol.Msg(cli.hostbyte, protocol.host2byte(8, 1), protocol.ProtoGetSn())
+            if cli.send_sync_msg(msg) is None:
+                raise RuntimeError("send_sync_msg timeout")
+            samples.append(time.perf_counter() - t)
+        elapsed = time.perf_counter() - start
+    finally:
+        cli.stop()
+        sim.stop()
+    return {"send_sync/" + proto_type: result(samples, number, elapsed)}
+
+
+def bench_dds(number, subscriber_counts=(1, 4, 16)):
+    subjects = [chassis.PositionSubject, chassis.AttiInfoSubject, chassis.ImuSubject, chassis.VelocitySubject,
+                chassis.EscSubject, chassis.SaStatusSubject, chassis.ChassisModeSubject, chassis.SbusSubject]
+    results = {}
+    for count in subscriber_counts:
+        sub = dds.Subscriber(_StubRobot())
+        sub._send_sync_proto = lambda proto, target: True
+        sub.start()
+        try:
+            received = threading.Semaphore(0)
+            latencies = []
+            sent = {}
+            target = None
+            # 订阅 count 个数据，只向第一个订阅推送，衡量订阅数对分发的影响
+            for i in range(count):
+                cls = subjects[i % len(subjects)]
+                subject = cls(1) if cls is chassis.PositionSubject else cls()
+                subject.name = "{0}_{1}".format(cls.name, i)
+                sub.set_delivery_policy(subject.name, dds.DDS_DELIVERY_ALL, 1024)
+                if i == 0:
+                    def callback(info):
+                        latencies.append(time.perf_counter() - sent[int(info[0])])
+                        received.release()
+                    sub.add_subject_info(subject, callback, (), {})
+                    target = subject
+                else:
+                    sub.add_subject_info(subject, lambda *a: None, (), {})
+            msgs = []
+            for i in range(number):
+                frame = _RawProto(protocol.ProtoPushPeriodMsg(),
+                                  bytes([3, target._subject_id]) + struct.pack('<fff', i, 0, 0)).pack_frame(False)
+                msg, _ = protocol.decode_msg(frame)
+                msg.unpack_protocol()
+                msgs.append(msg)
+            # 延迟：逐条推送并等待回调；吞吐：连续推送，直接阻塞写入分发队列，避免超过 DDS_MSG_QUEUE_SIZE 被丢弃
+            for i, msg in enumerate(msgs[:number // 10]):
+                sent[i] = time.perf_counter()
+                sub._msg_queue.put(msg)
+                received.acquire()
+            samples = list(latencies)
+            start = time.perf_counter()
+            for i, msg in enumerate(msgs):
+                sent[i] = time.perf_counter()
+                sub._msg_queue.put(msg)
+            for _ in range(number):
+                received.acquire()
+            elapsed = time.perf_counter() - start
+            results["dds/subscribers_{0}".format(count)] = result(samples, number, elapsed)
+        finally:
+            sub.stop()
+    return results
+
+
+def bench_action(number, action_counts=(1, 8, 32)):
+    results = {}
+    for count in action_counts:
+        dispatcher = action.ActionDispatcher(_StubClient())
+        dispatcher.initialize()
+        actions = []
+        for i in range(count):
+            act = chassis.ChassisMoveAction(x=0.1)
+            act._action_id = i + 1
+            act._state = action.ACTION_RUNNING
+            dispatcher._in_progress[act.make_action_key()] = act
+            actions.append(act)
+        # 推送对应最后一个动作，最坏情况下需要遍历所有进行中的动作
+        frame = _RawProto(protocol.ProtoPositionPush(),
+                          bytes([count, 50, 0]) + struct.pack('<hhh', 1, 2, 3)).pack_frame(False)
+        msg, _ = protocol.decode_msg(frame)
+        msg.unpack_protocol()
+        samples = measure(lambda: dispatcher._on_recv(dispatcher, msg), number)
+        results["action/in_progress_{0}".format(count)] = result(samples)
+    return results
+
+
+BENCHMARKS = [
+    ("pack", bench_pack, 20000),
+    ("decode", bench_decode, 20000),
+    ("unpack", bench_unpack, 20000),
+    ("send_sync", bench_send_sync, 2000),
+    ("dds", bench_dds, 5000),
+    ("action", bench_action, 20000),
+]
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, res in results.items():
+        base = baseline.get(name)
+        if base and res["p50"] > base["p50"] * (1 + tolerance):
+            regressions.append("{0}: p50 {1:.2f}us, baseline {2:.2f}us".format(name, res["p50"] * 1e6,
+                                                                               base["p50"] * 1e6))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="RoboMaster SDK control/telemetry path benchmarks")
+    parser.add_argument("--filter", default="", help="only run benchmarks whose name contains this string")
+    parser.add_argument("--scale", type=float, default=1.0, help="scale the iteration counts")
+    parser.add_argument("--save", help="write results to this baseline file")
+    parser.add_argument("--compare", help="compare p50 against this baseline file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed p50 slowdown, default 0.25")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for name, fun, number in BENCHMARKS:
+        if args.filter and args.filter not in name:
+            continue
+        results.update(fun(max(100, int(number * args.scale))))
+
+    print("{0:<32} {1:>10} {2:>10} {3:>12}".format("benchmark", "p50 us", "p99 us", "ops/s"))
+    for name, res in results.items():
+        print("{0:<32} {1:>10.2f} {2:>10.2f} {3:>12.0f}".format(name, res["p50"] * 1e6, res["p99"] * 1e6, res["ops"]))
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print("REGRESSION " + line)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
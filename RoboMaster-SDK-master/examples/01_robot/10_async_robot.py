@@ -0,0 +1,45 @@
+# -*-coding:utf-8-*-
+# Copyright (c) 2020 DJI.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License in the file LICENSE.txt or at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import asyncio
+from robomaster import aio
+from robomaster import chassis
+
+
+async def print_position(sub):
+    async for x, y, z in sub:
+        print("chassis position: x:{0}, y:{1}, z:{2}".format(x, y, z))
+
+
+async def main():
+    ep_robot = aio.AsyncRobot()
+    await ep_robot.initialize(conn_type="sta")
+    print("Robot Version: {0}".format(await ep_robot.get_version()))
+
+    # 订阅底盘位置信息
+    sub = await ep_robot.dds.subscribe(chassis.PositionSubject(0), freq=10)
+    printer = asyncio.ensure_future(print_position(sub))
+
+    move = ep_robot.action_dispatcher.send_action(chassis.ChassisMoveAction(x=0.5, y=0, z=90, spd_xy=0.7, spd_z=45))
+    await move.wait_for_completed()
+
+    await sub.close()
+    await printer
+    await ep_robot.close()
+
+
+if __name__ == '__main__':
+    asyncio.get_event_loop().run_until_complete(main())
@@ -0,0 +1,47 @@
+# -*-coding:utf-8-*-
+# Copyright (c) 2020 DJI.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License in the file LICENSE.txt or at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+
+import time
+from robomaster import robot
+from robomaster import telemetry
+from robomaster import chassis
+
+
+def sub_position_handler(position_info):
+    x, y, z = position_info
+    print("replay chassis position: x:{0}, y:{1}, z:{2}".format(x, y, z))
+
+
+if __name__ == '__main__':
+    ep_robot = robot.Robot()
+    ep_robot.initialize(conn_type="ap")
+
+    # 记录 10 秒的底盘位置推送
+    recorder = telemetry.TelemetryRecorder("chassis.rmtl")
+    recorder.attach(ep_robot.client, ep_robot.dds)
+    ep_robot.chassis.sub_position(freq=10)
+    time.sleep(10)
+    ep_robot.chassis.unsub_position()
+    recorder.close()
+    ep_robot.close()
+
+    # 不连接机器人，以 2 倍速回放
+    reader = telemetry.TelemetryReader("chassis.rmtl")
+    player = telemetry.SubjectPlayer(reader.names)
+    player.add_subject(chassis.PositionSubject(1), sub_position_handler)
+    reader.replay(player, speed=2)
+    reader.close()
@@ -0,0 +1,37 @@
+# -*-coding:utf-8-*-
+# Copyright (c) 2020 DJI.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License in the file LICENSE.txt or at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+
+from robomaster import robot
+from robomaster import simulator
+
+
+if __name__ == '__main__':
+    # 启动本地模拟机器人，动作以 5 倍速执行
+    sim = simulator.RobotSimulator(time_scale=5)
+    sim.start()
+
+    ep_robot = robot.Robot(cli=sim.create_client())
+    ep_robot.initialize()
+    print("Robot Version: {0}, SN: {1}".format(ep_robot.get_version(), ep_robot.get_sn()))
+
+    ep_robot.chassis.sub_position(freq=10, callback=lambda info: print("chassis position: {0}".format(info)))
+    ep_robot.chassis.move(x=0.5, y=0, z=90, xy_speed=0.7).wait_for_completed()
+    ep_robot.gimbal.moveto(pitch=10, yaw=30).wait_for_completed()
+    ep_robot.chassis.unsub_position()
+
+    ep_robot.close()
+    sim.stop()
@@ -20,5 +20,7 @@ PYBIND11_MODULE(libmedia_codec, m) {
     vd.doc() = "Class for H264 Decoder";
     vd.def(py::init<std::string, bool>(), py::arg("output_format") = "BGR", py::arg("verbose") = true);
     vd.def("decode", &PyH264Decoder::decode, "H264 decode function",py::arg("input"));
+    vd.def("set_skip_nonref", &PyH264Decoder::set_skip_nonref, "Skip decoding non-reference frames",
+           py::arg("skip"));
 
 }
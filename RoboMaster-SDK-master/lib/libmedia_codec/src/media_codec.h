@@ -17,6 +17,7 @@ extern "C" {
 #include <utility>
 #include <opus/opus.h>
 #include <pybind11/pybind11.h>
+#include <pybind11/numpy.h>
 
 #ifndef PIX_FMT_BGR24
 #define PIX_FMT_BGR24 AV_PIX_FMT_BGR24
@@ -109,6 +110,10 @@ public:
         return pkt->size > 0;
     }
 
+    void set_skip_nonref(bool skip) {
+        context->skip_frame = skip ? AVDISCARD_NONREF : AVDISCARD_DEFAULT;
+    }
+
     const AVFrame& decode_frame() {
         int got_picture = 0;
         int nread = avcodec_decode_video2(context, frame, &got_picture, pkt);
@@ -189,17 +194,18 @@ public:
         if (is_frame_available = decoder->is_frame_available()) {
             const auto &frame = decoder->decode_frame();
             int w, h; std::tie(w,h) = width_height(frame);
-            Py_ssize_t out_size = converter->predict_size(w,h);
 
+            // sws_scale writes straight into the numpy array handed back to python, no further copy.
+            // BGR24/RGB24 filled with alignment 1 is a contiguous (h, w, 3) buffer.
             py::gil_scoped_acquire decode_acquire;
-            py::object py_out_str = py::reinterpret_steal<py::object>(PYBIND11_BYTES_FROM_STRING_AND_SIZE(NULL, out_size));
-            char* out_buffer = PYBIND11_BYTES_AS_STRING(py_out_str.ptr());
+            py::array_t<ubyte> py_out_array({h, w, 3});
+            ubyte* out_buffer = py_out_array.mutable_data();
 
             py::gil_scoped_release convert_release;
-            const auto &out_frame = converter->convert(frame, (ubyte*)out_buffer);
+            const auto &out_frame = converter->convert(frame, out_buffer);
 
             py::gil_scoped_acquire convert_acquire;
-            return py::make_tuple(py_out_str, w, h, row_size(out_frame));
+            return py::make_tuple(py_out_array, w, h, row_size(out_frame));
         }
         else {
             py::gil_scoped_acquire decode_acquire;
@@ -226,6 +232,10 @@ public:
 
     ~PyH264Decoder() = default;
 
+    void set_skip_nonref(bool skip) {
+        decoder->set_skip_nonref(skip);
+    }
+
     py::list decode(const py::str &input) {
         ssize_t len = PYBIND11_BYTES_SIZE(input.ptr());
         const ubyte* data_in = (const ubyte*)(PYBIND11_BYTES_AS_STRING(input.ptr()));
@@ -24,11 +24,13 @@ from . import tool
 class RobotGroupBase(object):
     """robot group object"""
 
-    def __init__(self, robots_group_list, all_robots_dict):
+    def __init__(self, robots_group_list, all_robots_dict, executor=None):
         # Input checking should be done in MultiRobot.build_group()
         self._robots_id_in_group_list = robots_group_list  # robot id list
         self._all_robots_dict = all_robots_dict  # all robots in MultiRobot
         self._group_modules_dict = {}  # the modules of RobotGroup. {name:module-obj, ... }
+        self._executor = executor or tool.FleetExecutor()  # shared by all groups of a MultiRobot
+        self.command_deadline = None  # seconds, None to wait for all robots in execute_command
 
     def __del__(self):
         for module_name, module_obj in self._group_modules_dict.items():
@@ -147,25 +149,33 @@ class RobotGroupBase(object):
 
         :param command_name: which command need send
         :param args: the command params
-        :return:
+        :return: tool.ExecuteResult {robot_id: result, ... }
         """
-        start_time = time.time()
-        thread_dict = {}  # {robot_id: thread}
-        result_dict = {}  # {robot_id: result, ... }
+        commands = {}  # {robot_id: (command_name, args, kw)}
         for robot_id in self._robots_id_in_group_list:
+            commands[robot_id] = (command_name, input_args, input_kw)
+        return self.fan_out(commands, self.command_deadline)
+
+    def fan_out(self, commands, deadline=None):
+        """Execute different commands for the robots in the group in one batch
+
+        :param commands: {robot_id: (command_name, args, kw), ...}, or (function, args, kw) to call
+                         a function that takes the robot obj as the first param
+        :param deadline: seconds to wait, the robots that have not finished are reported in result.stragglers
+        :return: tool.ExecuteResult {robot_id: result, ... }
+        """
+        start_time = time.time()
+        calls = {}
+        for robot_id, (command, args, kw) in commands.items():
+            if robot_id not in self._robots_id_in_group_list:
+                raise Exception("Robot id {0} is not in group {1}".format(robot_id, self._robots_id_in_group_list))
             robot_obj = self.all_robots_dict[robot_id]
-            exec_cmd_thread = tool.TelloThread(target=getattr(robot_obj, command_name), *input_args, **input_kw)
-            thread_dict[robot_id] = exec_cmd_thread
-        second_time = time.time()
-        # start threads
-        for robot_id, thread_obj in thread_dict.items():
-            thread_obj.start()
-        logger.debug("send command start spend time {0}".format(time.time() - second_time))
-        for robot_id, exec_cmd_thread in thread_dict.items():
-            exec_cmd_thread.join()
-            result_dict[robot_id] = exec_cmd_thread.get_result()
-        spend_time = time.time() - start_time
-        logger.debug("send command spend time {0}".format(spend_time))
+            if callable(command):
+                calls[robot_id] = (command, (robot_obj,) + tuple(args), kw)
+            else:
+                calls[robot_id] = (getattr(robot_obj, command), args, kw)
+        result_dict = self._executor.fan_out(calls, deadline)
+        logger.debug("send command spend time {0}".format(time.time() - start_time))
         logger.debug("RobotGroupBase: execute_command, result {0}".format(result_dict))
         return result_dict
 
@@ -180,8 +190,8 @@ class RobotGroupBase(object):
 
 class RMGroup(RobotGroupBase):
 
-    def __init__(self, robots_group_list, all_robots_dict):
-        super().__init__(robots_group_list, all_robots_dict)
+    def __init__(self, robots_group_list, all_robots_dict, executor=None):
+        super().__init__(robots_group_list, all_robots_dict, executor)
 
     def _scan_group_module(self):
         _chassis = multi_module.MultiRmModule(self, 'Chassis')
@@ -290,7 +300,7 @@ class SingleDroneInGroup(multi_module.TelloAction):
         if self.event.isSet():
             logger.info("execute command：{}".format(command))
             proto = tool.TelloProtocol(command, self._robot_host)
-            self._client.send(proto)
+            self._dispatcher.send(proto)
             self.event.clear()
         else:
             self.event.set()
@@ -14,9 +14,8 @@
 # limitations under the License.
 
 
-import copy
-import time
 import threading
+from concurrent import futures
 from robomaster import action
 from robomaster import flight
 from robomaster import led
@@ -43,45 +42,35 @@ class MultiAction(object):
         if not self._robots_action_dict:
             logger.error("MultiAction: no action is waiting")
             return False
-        robot_id_executing = []  # dictionary can`t change size during iteration, so use list
-        start_time = time.time()
-        spent_time = 0
-        final_result = False
-        for robot_id in self._robots_action_dict.keys():
-            robot_id_executing.append(robot_id)
         logger.info(
             "MultiAction: Group action start waiting for completed, {0}".format(
-                self._robots_action_dict[robot_id_executing[0]]))
-        while spent_time < timeout:
-            cur_time = time.time()
-            spent_time = cur_time - start_time
-            if not robot_id_executing:
-                logger.info("MultiAction: wait_for_all_completed. All of robots are completed")
-                final_result = True
-                break
-            for robot_id, robot_action in self._robots_action_dict.items():
-                if self._robots_action_dict[robot_id].is_completed and (robot_id in robot_id_executing):
-                    action_key = self._robots_action_dict[robot_id].make_action_key()
-                    in_progress_list = self._robots_action_dict[robot_id]._obj._in_progress
-                    # make sure the action has been removed form _in_progress
-                    if action_key not in in_progress_list:
-                        robot_id_executing.remove(robot_id)
-                        logger.info(
-                            "MultiAction: wait_for_all_completed. Robot id ({0}) action is completed, "
-                            "action: {1}".format(robot_id, self._robots_action_dict[robot_id]))
-            time.sleep(0.05)
+                next(iter(self._robots_action_dict.values()))))
+        # each action resolves its own future when completed, wait for all of them at once
+        action_futures = {}
+        for robot_id, robot_action in self._robots_action_dict.items():
+            action_future = futures.Future()
+            action_futures[action_future] = robot_id
+            robot_action.add_done_callback(lambda act, f=action_future: f.set_result(act.state))
+        done, not_done = futures.wait(action_futures, timeout)
+        for action_future in done:
+            robot_id = action_futures[action_future]
+            logger.info(
+                "MultiAction: wait_for_all_completed. Robot id ({0}) action is completed, "
+                "action: {1}".format(robot_id, self._robots_action_dict[robot_id]))
         # timeout
-        if not final_result:
-            for robot_id, robot_action in self._robots_action_dict.items():
-                if not robot_action.is_completed:
-                    robot_action._changeto_state(action.ACTION_EXCEPTION)
-                    logger.warning(
-                        "MultiAction: wait_for_all_completed, timeout! Robot id {}, action {}".format(
-                            robot_id, self._robots_action_dict[robot_id]))
-        else:
-            # each robot has completed its action
-            logger.info("MultiAction: wait for all completed successfully, action {0}".format(self._robots_action_dict))
-        return final_result
+        for action_future in not_done:
+            robot_id = action_futures[action_future]
+            robot_action = self._robots_action_dict[robot_id]
+            if not robot_action.is_completed:
+                robot_action._changeto_state(action.ACTION_EXCEPTION)
+                logger.warning(
+                    "MultiAction: wait_for_all_completed, timeout! Robot id {}, action {}".format(
+                        robot_id, robot_action))
+        if not_done:
+            return False
+        # each robot has completed its action
+        logger.info("MultiAction: wait for all completed successfully, action {0}".format(self._robots_action_dict))
+        return True
 
 
 class TelloDispatcher(object):
@@ -91,6 +80,7 @@ class TelloDispatcher(object):
         self.event = event
         self._robot_host_dict = _robot_host_dict
         self._action_host_list = []
+        self._reply_futures = {}  # key host, value future of the reply
         self.cur_action = ""
         self.special = None
 
@@ -102,50 +92,42 @@ class TelloDispatcher(object):
     def action_host_list(self, value):
         self._action_host_list = value
 
+    def send(self, proto):
+        """ Register for the reply of proto.host, then send the command
+
+        The reply of the previous command is dropped if wait_for_completed was not called for it
+        """
+        stale_future = self._reply_futures.pop(proto.host, None)
+        if stale_future is not None:
+            self._client.cancel(proto.host, stale_future)
+        # drone bug: takeoff reply double ok, the client discards the extra one
+        extra_replies = 1 if proto.text == b"takeoff" else 0
+        self._reply_futures[proto.host] = self._client.expect(proto.host, extra_replies)
+        self._client.send(proto)
+
     def wait_for_completed(self, timeout=10):
-        _queue = self._client.queue
-        _action_host_list = copy.copy(self._action_host_list)
         tello_status = tool.TelloStatus(self.cur_action)
-        cur_time = time.time()
-        while len(_action_host_list) != 0:
-            if time.time()-cur_time > timeout:
-                logger.warning("action: {} ,timeout".format(self.cur_action))
-                break
-            qsize = _queue.qsize()
-            for i in range(qsize):
-                # todo 多group并行有可能会因为队列为空而出错，需要加锁
-                if _queue.empty():
-                    break
-                proto = _queue.get()
-                time.sleep(0.01)
-                # todo 需要补全 ERROR LIST
-                if proto.text in tello_status.FLIGHT_ACTION_SET:
-                    #  FLIGHT respond
-                    if proto.host in _action_host_list:
-                        tello_status.judge(proto)
-                        _action_host_list.remove(proto.host)
-                    else:
-                        _queue.put(proto)
-                elif proto.text in tello_status.EXT_ACTION_SET:
-                    # EXT respond
-                    if proto.host in _action_host_list:
-                        tello_status.judge(proto)
-                        _action_host_list.remove(proto.host)
-                    else:
-                        _queue.put(proto)
-                else:
-                    # DRONE respond
-                    if proto.host in _action_host_list:
-                        tello_status.judge(proto)
-                        _action_host_list.remove(proto.host)
-                        id_ = self._robot_host_dict[proto.host]
-                        logger.info("DRONE id: {}, reply: {}".format(id_, proto.text))
-                        print("DRONE id: {}, reply: {}".format(id_, proto.text))   # output to console
-                    else:
-                        _queue.put(proto)
-        if self.special == "takeoff":
-            while not _queue.empty():
-                _ = _queue.get()    # drone bug: takeoff reply double ok
+        reply_futures = {}
+        for host in self._action_host_list:
+            reply_future = self._reply_futures.pop(host, None)
+            if reply_future is None:
+                logger.warning("action: {}, no command was sent to host {}".format(self.cur_action, host))
+                continue
+            reply_futures[reply_future] = host
+        done, not_done = futures.wait(reply_futures, timeout)
+        for reply_future in not_done:
+            self._client.cancel(reply_futures[reply_future], reply_future)
+        if not_done:
+            logger.warning("action: {} ,timeout".format(self.cur_action))
+        for reply_future in done:
+            proto = reply_future.result()
+            # todo 需要补全 ERROR LIST
+            tello_status.judge(proto)
+            if proto.text not in tello_status.FLIGHT_ACTION_SET and proto.text not in tello_status.EXT_ACTION_SET:
+                # DRONE respond
+                id_ = self._robot_host_dict[proto.host]
+                logger.info("DRONE id: {}, reply: {}".format(id_, proto.text))
+                print("DRONE id: {}, reply: {}".format(id_, proto.text))   # output to console
         logger.info("wait_for_completed: finished")
         self.event.set()
         return self
@@ -186,27 +168,13 @@ class MultiModule(object):
 
         :param command_name: which command need send
         :param args: the command params
-        :return:
+        :return: tool.ExecuteResult {robot_id: result, ... }
         """
-        start_time = time.time()
-        thread_dict = {}  # {robot_id: thread}
-        result_dict = {}  # {robot_id: result, ... }
+        calls = {}  # {robot_id: (function, args, kw)}
         for robot_id in self._robot_group._robots_id_in_group_list:
             robot_module = self._robot_group.all_robots_dict[robot_id].get_module(self._module_name)
-            exec_cmd_thread = tool.TelloThread(getattr(robot_module, command_name), *input_args, **input_kw)
-            thread_dict[robot_id] = exec_cmd_thread
-        second_time = time.time()
-        # start threads
-        for robot_id, thread_obj in thread_dict.items():
-            thread_obj.start()
-        logger.debug("send command start spend time {0}".format(time.time() - second_time))
-        for robot_id, exec_cmd_thread in thread_dict.items():
-            exec_cmd_thread.join()
-            result_dict[robot_id] = exec_cmd_thread.get_result()
-        spend_time = time.time() - start_time
-        logger.debug("send command spend time {0}".format(spend_time))
-        logger.debug("RobotGroupBase: execute_command, result {0}".format(result_dict))
-        return result_dict
+            calls[robot_id] = (getattr(robot_module, command_name), input_args, input_kw)
+        return self._robot_group._executor.fan_out(calls, self._robot_group.command_deadline)
 
 
 class MultiRmModule(MultiModule):
@@ -349,7 +317,7 @@ class TelloAction(object):
             for host in self.robot_group_host_list:
                 logger.info("execute command：{}".format(command))
                 proto = tool.TelloProtocol(command, host)
-                self._client.send(proto)
+                self._dispatcher.send(proto)
             self.event.clear()
         else:
             self.event.set()
@@ -362,7 +330,7 @@ class TelloAction(object):
                 command, host = command_host
                 logger.info("execute command：{}".format(command))
                 proto = tool.TelloProtocol(command, host)
-                self._client.send(proto)
+                self._dispatcher.send(proto)
             self.event.clear()
         else:
             self.event.set()
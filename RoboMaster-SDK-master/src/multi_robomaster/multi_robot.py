@@ -18,6 +18,7 @@ import sys
 import time
 import random
 import threading
+from concurrent import futures
 from robomaster import protocol
 from robomaster import conn
 from robomaster import robot
@@ -36,6 +37,12 @@ GIMBAL_LEAD_MODE = 1
 FREE_MODE = 0
 
 
+def _wait_group_task(exec_future, robot_group):
+    exc = exec_future.exception()
+    if exc is not None:
+        logger.error("MultiRobot: run, group {0} task raised {1!r}".format(robot_group, exc))
+
+
 class MultiRobotBase(object):
 
     def __init__(self):
@@ -44,6 +51,13 @@ class MultiRobotBase(object):
         self._group_list = []  # [group1, group2, ...]
         self._robot_ip_list = []  # [robot1_ip, robot2_ip, ...]
         self._robots_dict = {}  # key:id, value: robot obj
+        self._executor = tool.FleetExecutor()  # shared by all groups for execute_command
+        self._bring_up_report = {}  # {ip: {"time": seconds, "error": exception}}
+        self._run_executor = None  # for group tasks, see _submit_group_tasks
+        self._run_workers = 0
+        self._run_inflight = {}  # key: thread pool, value: number of unfinished group tasks
+        self._run_retired = set()  # replaced thread pools that still run group tasks
+        self._run_mutex = threading.Lock()
 
     def __del__(self):
         pass
@@ -65,6 +79,59 @@ class MultiRobotBase(object):
     def close(self):
         for robot_obj in self._robots_list:
             robot_obj.close()
+        self._executor.shutdown(False)
+        with self._run_mutex:
+            pools = self._run_retired
+            if self._run_executor is not None:
+                pools.add(self._run_executor)
+            for pool in pools:
+                pool.shutdown(False)
+            self._run_executor = None
+            self._run_workers = 0
+            self._run_inflight = {}
+            self._run_retired = set()
+
+    def _submit_group_tasks(self, tasks):
+        """ Submit the tasks of one run, every group task needs its own thread because it runs until the group
+        has finished. The thread pool has one thread for each built group, so concurrent runs do not queue behind
+        each other. When groups are added a bigger pool replaces it, the old pool is shut down after its tasks
+        have finished.
+
+        :param tasks: [(group_task, arg), ...]
+        :return: list of concurrent.futures.Future, in the order of tasks
+        """
+        with self._run_mutex:
+            group_num = max(len(self._group_list), len(tasks), 1)
+            if self._run_executor is None or self._run_workers < group_num:
+                if self._run_executor is not None:
+                    self._retire_run_executor(self._run_executor)
+                self._run_executor = futures.ThreadPoolExecutor(max_workers=group_num,
+                                                                thread_name_prefix="MultiRobotRun")
+                self._run_workers = group_num
+            pool = self._run_executor
+            task_futures = [pool.submit(group_task, arg) for group_task, arg in tasks]
+            self._run_inflight[pool] = self._run_inflight.get(pool, 0) + len(task_futures)
+        for task_future in task_futures:
+            task_future.add_done_callback(lambda f, p=pool: self._on_group_task_done(p))
+        return task_futures
+
+    def _retire_run_executor(self, pool):
+        """ Called with _run_mutex held """
+        if self._run_inflight.get(pool, 0) == 0:
+            self._run_inflight.pop(pool, None)
+            pool.shutdown(False)
+        else:
+            self._run_retired.add(pool)
+
+    def _on_group_task_done(self, pool):
+        with self._run_mutex:
+            if pool not in self._run_inflight:
+                return
+            self._run_inflight[pool] -= 1
+            if pool in self._run_retired and self._run_inflight[pool] == 0:
+                self._run_retired.discard(pool)
+                del self._run_inflight[pool]
+                pool.shutdown(False)
 
     @property
     def all_robots(self):
@@ -138,7 +205,7 @@ class MultiRobotBase(object):
         :param exec_list: [robot_group, action_task]...
         :return:
         """
-        _groups_exec_dict = {}  # key: robot_group obj, value: execute thread
+        _groups_exec_dict = {}  # key: robot_group obj, value: execute future
         logger.info("MultiRobot: run exec_list: {0}".format(exec_list))
         if not type(exec_list) is tuple:
             tuple(exec_list)
@@ -147,13 +214,12 @@ class MultiRobotBase(object):
         for robot_group, group_task in exec_list:
             if robot_group not in self._group_list:
                 raise Exception('Input group', robot_group, 'is not built')
+        task_futures = self._submit_group_tasks([(group_task, robot_group) for robot_group, group_task in exec_list])
+        for (robot_group, _), exec_future in zip(exec_list, task_futures):
+            _groups_exec_dict[robot_group] = exec_future
 
-            exec_thread = threading.Thread(target=group_task, args=(robot_group,))
-            exec_thread.start()
-            _groups_exec_dict[robot_group] = exec_thread
-
-        for robot_group, exec_thread in _groups_exec_dict.items():
-            exec_thread.join()
+        for robot_group, exec_future in _groups_exec_dict.items():
+            _wait_group_task(exec_future, robot_group)
             logger.info("MultiRobotBase: run, Action is completed")
 
 
@@ -161,20 +227,113 @@ class MultiEP(MultiRobotBase):
     """ S1_EP"""
     def __init__(self):
         super().__init__()
+        self._bring_up_mutex = threading.Lock()
+        self._bring_up_robots = {}  # {ip: robot obj} ready before the deadline
+        self._bring_up_accepting = False
 
-    def initialize(self, proto_type=config.DEFAULT_PROTO_TYPE):
-        """scan all robots and init its
+    def initialize(self, proto_type=config.DEFAULT_PROTO_TYPE, timeout=None):
+        """scan all robots and init them concurrently
 
-        :param num:
-        :return:
+        A robot that fails or is not ready before timeout is reported and skipped, the others keep going.
+
+        :param proto_type: tcp, udp
+        :param timeout: seconds to wait for all robots, None to wait until every robot has finished
+        :return: dict: {ip: {"time": seconds or None, "error": exception or None}, ...} bring-up report
         """
-        self._robots_list = self._scan_multi_robot(proto_type)
+        ip_list = conn.scan_robot_ip_list(10)
+        with self._bring_up_mutex:
+            self._bring_up_report = {}
+            self._bring_up_robots = {}
+            self._bring_up_accepting = True
+        calls = {}  # {ip: (function, args, kw)}
+        for ip in ip_list:
+            calls[ip] = (self._bring_up_robot, (ip, proto_type), {})
+        result = self._executor.fan_out(calls, timeout)
+        # robots finishing after this point close themselves in _bring_up_robot
+        with self._bring_up_mutex:
+            self._bring_up_accepting = False
+            ready_robots = dict(self._bring_up_robots)
+        self._robots_list = []
+        for ip in ip_list:
+            report = self._bring_up_report.setdefault(ip, {"time": None, "error": None})
+            if ip in ready_robots:
+                self._robots_list.append(ready_robots[ip])
+            elif ip in result.exceptions:
+                report["error"] = result.exceptions[ip]
+            else:
+                report["error"] = TimeoutError("bring-up did not finish in {0}s".format(timeout))
+            if report["error"] is None:
+                logger.info("MultiEP: initialize, robot ip {0} is ready in {1:.2f}s".format(ip, report["time"]))
+            else:
+                logger.error("MultiEP: initialize, robot ip {0} failed, {1!r}".format(ip, report["error"]))
         if not self._robots_list:
             logger.error("MultiRobotBase: initialize. No robot was found!")
             raise Exception("No robot was found!")
         self._robots_num = len(self._robots_list)
-        for robot_obj in self._robots_list:
-            robot_obj.initialize(proto_type)
+        return self._bring_up_report
+
+    @property
+    def bring_up_report(self):
+        """ Bring-up report of the last initialize, {ip: {"time": seconds, "error": exception}, ...} """
+        return self._bring_up_report
+
+    def _bring_up_robot(self, ip, proto_type):
+        start_time = time.time()
+        rob = None
+        try:
+            rob = self._connect_robot(ip, proto_type)
+            if rob is None:
+                raise Exception("robot ip {0} rejected the connection".format(ip))
+            if not rob.initialize(proto_type=proto_type):
+                raise Exception("robot ip {0} initialize failed".format(ip))
+        except Exception:
+            self._close_robot(ip, rob)
+            raise
+        with self._bring_up_mutex:
+            if self._bring_up_accepting:
+                self._bring_up_robots[ip] = rob
+                self._bring_up_report[ip] = {"time": time.time() - start_time, "error": None}
+                return rob
+        # initialize has already returned and reported this robot as timed out
+        logger.warning("MultiEP: robot ip {0} is ready after the deadline, close it".format(ip))
+        self._close_robot(ip, rob)
+        return None
+
+    @staticmethod
+    def _close_robot(ip, rob):
+        if rob is None:
+            return
+        try:
+            rob.close()
+        except Exception as e:
+            logger.warning("MultiEP: close robot ip {0}, exception {1}".format(ip, e))
+
+    def _connect_robot(self, ip, proto_type=config.DEFAULT_PROTO_TYPE):
+        """ Switch the robot at ip to the sdk connection
+
+        :return: robot.Robot obj, None if the robot rejected
+        """
+        sdk_conn = conn.SdkConnection()
+        proxy_addr = (ip, config.ROBOT_PROXY_PORT)
+        proto = protocol.ProtoSetSdkConnection()
+        proto._connection = 1
+        proto._host = protocol.host2byte(9, 6)
+        if config.LOCAL_IP_STR:
+            proto._ip = config.LOCAL_IP_STR
+        else:
+            proto._ip = '0.0.0.0'
+        proto._port = random.randint(config.ROBOT_SDK_PORT_MIN, config.ROBOT_SDK_PORT_MAX)
+        msg = protocol.Msg(robot.ROBOT_DEFAULT_HOST, protocol.host2byte(9, 0), proto)
+        result, local_ip = sdk_conn.switch_remote_route(msg, proxy_addr)
+        proto._ip = local_ip
+        logger.info("request connection ip:{0} port:{1}".format(proto._ip, proto._port))
+        if not result:
+            return None
+        conn1 = conn.Connection((proto._ip, proto._port), (ip, config.ROBOT_DEVICE_PORT),
+                                protocol=proto_type)
+        logger.info("connection {0}".format(conn1))
+        cli = client.Client(9, 6, conn1)
+        return robot.Robot(cli)
 
     def _scan_multi_robot(self, proto_type=config.DEFAULT_PROTO_TYPE):
         """ Automatic scanning of robots in the network
@@ -183,27 +342,9 @@ class MultiEP(MultiRobotBase):
         """
         robot_list = []
         ip_list = conn.scan_robot_ip_list(10)
-        for i, ip in enumerate(ip_list):
-            sdk_conn = conn.SdkConnection()
-            proxy_addr = (ip, config.ROBOT_PROXY_PORT)
-            proto = protocol.ProtoSetSdkConnection()
-            proto._connection = 1
-            proto._host = protocol.host2byte(9, 6)
-            if config.LOCAL_IP_STR:
-                proto._ip = config.LOCAL_IP_STR
-            else:
-                proto._ip = '0.0.0.0'
-            proto._port = random.randint(config.ROBOT_SDK_PORT_MIN, config.ROBOT_SDK_PORT_MAX)
-            msg = protocol.Msg(robot.ROBOT_DEFAULT_HOST, protocol.host2byte(9, 0), proto)
-            result, local_ip = sdk_conn.switch_remote_route(msg, proxy_addr)
-            proto._ip = local_ip
-            logger.info("request connection ip:{0} port:{1}".format(proto._ip, proto._port))
-            if result:
-                conn1 = conn.Connection((proto._ip, proto._port), (ip, config.ROBOT_DEVICE_PORT),
-                                        protocol=proto_type)
-                logger.info("connection {0}".format(conn1))
-                cli = client.Client(9, 6, conn1)
-                rob = robot.Robot(cli)
+        for ip in ip_list:
+            rob = self._connect_robot(ip, proto_type)
+            if rob:
                 robot_list.append(rob)
         return robot_list
 
@@ -216,7 +357,7 @@ class MultiEP(MultiRobotBase):
         check_result, robot_id = tool.check_robots_id(robot_id_list, self._robots_dict)
         if not check_result:
             raise Exception("Robot Id %d is not exist" % robot_id)
-        robot_group = multi_group.RMGroup(robot_id_list, self._robots_dict)
+        robot_group = multi_group.RMGroup(robot_id_list, self._robots_dict, self._executor)
         robot_group.initialize()
         self._group_list.append(robot_group)
         logger.info("MultiRobot: build_group successfully, group.robots_in_group_list : {0}".format(
@@ -257,22 +398,23 @@ class MultiEP(MultiRobotBase):
 class MultiDrone(MultiRobotBase):
 
     def __init__(self):
+        super().__init__()
         self.robot_num = 0
         self._client = tool.TelloClient()
         self.tello_action = None
         self._robot_host_list = []
-        self._group_list = []
         self._robot_id_dict = {}
         self._robot_sn_dict = {}
         self._robot_host_dict = {}
 
-    def initialize(self, robot_num=0):
+    def initialize(self, robot_num=0, timeout=conn.TELLO_SCAN_TIMEOUT):
         self.robot_num = robot_num
         self._client.start()
-        self._robot_host_list = self._client.scan_multi_robot(robot_num)
+        self._robot_host_list = self._client.scan_multi_robot(robot_num, timeout)
 
     def close(self):
         self._client.close()
+        super().close()
 
     def _scan_multi_robot(self, num=0):
         self.initialize(num)
@@ -301,8 +443,7 @@ class MultiDrone(MultiRobotBase):
                 raise Exception('Input group', robot_group, 'is not built')
             self.tello_action = multi_module.TelloAction(self._client, self._robot_id_dict, self._robot_sn_dict,
                                                          self._robot_host_dict)
-            exec_thread = threading.Thread(target=group_task, args=(self.tello_action.action_group(robot_group),))
-            _groups_exec_dict[robot_group] = exec_thread
+            _groups_exec_dict[robot_group] = (group_task, self.tello_action.action_group(robot_group))
             robot_group_host_list.append(robot_group.robot_group_host_list)
 
         # don't allow the same drone run in different group
@@ -311,12 +452,13 @@ class MultiDrone(MultiRobotBase):
             # todo BUG: low probability to has same id in one single group in number_id_to_all_drone api
             raise Exception("different running groups has same id")
 
-        for robot_group, exec_thread in _groups_exec_dict.items():
-            # todo 多task同步待添加
-            exec_thread.start()
+        # todo 多task同步待添加
+        task_futures = self._submit_group_tasks(list(_groups_exec_dict.values()))
+        for robot_group, exec_future in zip(list(_groups_exec_dict), task_futures):
+            _groups_exec_dict[robot_group] = exec_future
 
-        for robot_group, exec_thread in _groups_exec_dict.items():
-            exec_thread.join()
+        for robot_group, exec_future in _groups_exec_dict.items():
+            _wait_group_task(exec_future, robot_group)
         logger.info("MultiRobotBase: run, Action is completed")
 
     def build_group(self, robot_id_group_list):
@@ -336,18 +478,24 @@ class MultiDrone(MultiRobotBase):
             self._client.send(proto)
 
     def _get_sn(self, timeout=0):
-        self.send_command("sn?")
-        cur_time = time.time()
-        while self._client.queue.qsize() < self.robot_num:
-            if time.time() - cur_time > timeout:
+        end_time = time.time() + timeout
+        sn_futures = {}
+        for host in self._robot_host_list:
+            # Tello BUG that reply ok in sn? command response, the client skips it and waits for the next reply
+            sn_futures[self._client.expect(host, ignore=("ok",))] = host
+            self._client.send(tool.TelloProtocol("sn?", host))
+        while sn_futures:
+            done, _ = futures.wait(sn_futures, max(0, end_time - time.time()), futures.FIRST_COMPLETED)
+            if not done:
+                for sn_future, host in sn_futures.items():
+                    self._client.cancel(host, sn_future)
                 raise Exception("get sn timeout")
-
-        while not self._client.queue.empty():
-            proto = self._client.queue.get()
-            if proto.text is None:
-                raise Exception("recv data is None")
-            self._robot_sn_dict[proto.text] = proto.host  # find host by sn
-            time.sleep(0.1)   # Tello BUG that reply ok in sn? command response
+            for sn_future in done:
+                sn_futures.pop(sn_future)
+                proto = sn_future.result()
+                if proto.text is None:
+                    raise Exception("recv data is None")
+                self._robot_sn_dict[proto.text] = proto.host  # find host by sn
 
         return self._robot_sn_dict
 
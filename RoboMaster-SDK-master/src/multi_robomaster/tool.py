@@ -18,14 +18,19 @@ import time
 import traceback
 import netifaces
 import netaddr
-from netaddr import IPNetwork
 import socket
 import queue
 import threading
+from concurrent import futures
 from . import logger
 from robomaster import conn
 from robomaster import config
 
+TELLO_QUEUE_SIZE = 64
+# 多余应答的有效时间，单位 s，超时未收到时不再丢弃，避免吞掉下一条命令的应答
+TELLO_EXTRA_REPLY_TIMEOUT = 3
+FLEET_MAX_WORKERS = 32
+
 
 def get_func_name():
     """
@@ -176,7 +181,7 @@ class TelloConnection(object):
         self.local_ip = local_ip
         self.local_port = local_port
         self._sock = None
-        self.client_recieve_thread_flag = False   # for client recieve
+        self.recv_ready = threading.Event()   # set after scanning, the client can receive from the socket
         self._robot_host_list = []    # for scan robot
 
     def start(self):
@@ -221,75 +226,28 @@ class TelloConnection(object):
             logger.warning("Connection: send, exception:{0}".format(e))
             raise
 
-    def _scan_host(self, num):
-        """Find avaliable ip list in server's subnets
+    def scan_multi_robot(self, num=0, timeout=conn.TELLO_SCAN_TIMEOUT):
+        """ Automatic scanning of robots in the network
 
         :param num: Number of Tello this method is expected to find
-        :return: None
+        :param timeout: seconds, return the Tello found so far after timeout
+        :return: [(ip, port), ...]
         """
         logger.info('[Start_Searching]Searching for %s available Tello...\n' % num)
-
         subnets, address = get_subnets()
-        possible_addr = []
-
-        for subnet, netmask in subnets:
-            for ip in IPNetwork('%s/%s' % (subnet, netmask)):
-                # skip local and broadcast
-                if str(ip).split('.')[3] == '0' or str(ip).split('.')[3] == '255':
-                    continue
-                possible_addr.append(str(ip))
-
-        while len(self._robot_host_list) < num:
-            logger.info('[Still_Searching]Trying to find Tello in subnets...\n')
-
-            # delete already fond Tello ip
-            for tello_host in self._robot_host_list:
-                if tello_host[0] in possible_addr:
-                    possible_addr.remove(tello_host[0])
-            # skip server itself
-            for ip in possible_addr:
-                if ip in address:
-                    continue
-                self._sock.sendto(b'command', (ip, self.local_port))
-            if len(self._robot_host_list) >= num:
-                break
+        self._robot_host_list = conn.scan_tello_hosts(self._sock, subnets, address, num, timeout, self.local_port)
+        self.recv_ready.set()
+        logger.info("FoundTello: has finished, found {0}".format(self._robot_host_list))
         return self._robot_host_list
 
-    def scan_multi_robot(self, num=0):
-        """ Automatic scanning of robots in the network
-
-        :param num:
-        :return:
-        """
-        receive_thread = threading.Thread(target=self._scan_receive_task, args=(num, ), daemon=True)
-        receive_thread.start()
-        robot_host_list = self._scan_host(num)
-        receive_thread.join()
-        return robot_host_list
-
-    def _scan_receive_task(self, num):
-        """Listen to responses from the Tello when scan the devices.
-
-        :param:num:
-        """
-        while len(self._robot_host_list) < num:
-            try:
-                resp, ip = self._sock.recvfrom(1024)
-                logger.info("FoundTello: from ip {1}_receive_task, recv msg: {0}".format(resp, ip))
-                ip = ''.join(str(ip[0]))
-                if resp.upper() == b'OK' and ip not in self._robot_host_list:
-                    logger.info('FoundTello: Found Tello.The Tello ip is:%s\n' % ip)
-                    self._robot_host_list.append((ip, self.local_port))
-            except socket.error as exc:
-                logger.error("[Exception_Error]Caught exception socket.error : {0}\n".format(exc))
-        self.client_recieve_thread_flag = True
-        logger.info("FoundTello: has finished, _scan_receive_task quit!")
-
 
 class TelloClient(object):
     def __init__(self):
         self._conn = TelloConnection()
-        self.queue = queue.Queue()
+        self.queue = queue.Queue(TELLO_QUEUE_SIZE)  # replies nobody is waiting for
+        self._waiters = {}  # key host, value (future of the next reply, number of extra replies, ignored replies)
+        self._skips = {}  # key host, value [number of extra "ok" replies to discard, deadline]
+        self._waiters_mutex = threading.Lock()
         self.receive_thread = threading.Thread(target=self.recv, daemon=True)
         self.receive_thread_flag = True
 
@@ -299,25 +257,82 @@ class TelloClient(object):
 
     def close(self):
         self.receive_thread_flag = False
-        self._conn.client_recieve_thread_flag = True
+        self._conn.recv_ready.set()
         if self._conn:
             self._conn.close()
         self.receive_thread.join(10)
+        # replies that will never arrive
+        with self._waiters_mutex:
+            waiters, self._waiters = self._waiters, {}
+            self._skips.clear()
+        for reply_future, _, _ in waiters.values():
+            reply_future.cancel()
 
     def recv(self):
-        while not self._conn.client_recieve_thread_flag:
-            pass
+        self._conn.recv_ready.wait()
         logger.info("recv thread start!")
         while self.receive_thread_flag:
             proto = self._conn.recv()
-            self.queue.put(proto)
+            self._dispatch(proto)
         logger.info("recv thread quit!")
 
+    def _dispatch(self, proto):
+        with self._waiters_mutex:
+            skip = self._skips.get(proto.host)
+            if skip is not None and proto.text == "ok":
+                if time.time() < skip[1]:
+                    skip[0] -= 1
+                    if skip[0] <= 0:
+                        del self._skips[proto.host]
+                    logger.debug("TelloClient: discard extra reply {0} from {1}".format(proto.text, proto.host))
+                    return
+                del self._skips[proto.host]
+            waiter = self._waiters.get(proto.host)
+            if waiter is not None and proto.text is not None and proto.text.strip() in waiter[2]:
+                # the waiter stays registered, so the real reply can not slip past it
+                logger.debug("TelloClient: ignore reply {0} from {1}".format(proto.text, proto.host))
+                return
+            if waiter is not None:
+                del self._waiters[proto.host]
+            if waiter is not None and waiter[1] > 0:
+                self._skips[proto.host] = [waiter[1], time.time() + TELLO_EXTRA_REPLY_TIMEOUT]
+        if waiter is not None:
+            waiter[0].set_result(proto)
+            return
+        logger.debug("TelloClient: no waiter for reply {0} from {1}".format(proto.text, proto.host))
+        try:
+            self.queue.put_nowait(proto)
+        except queue.Full:
+            self.queue.get_nowait()
+            self.queue.put_nowait(proto)
+
+    def expect(self, host, extra_replies=0, ignore=()):
+        """ Register for the next reply from host, must be called before sending the command
+
+        :param host: (ip, port) of the drone
+        :param extra_replies: number of extra "ok" replies the drone sends after the first one, e.g. takeoff
+            replies "ok" twice, they are discarded so that they do not resolve the next command
+        :param ignore: replies that do not resolve the future, e.g. the bogus "ok" to "sn?", compared after strip
+        :return: concurrent.futures.Future, the result is the TelloProtocol of the reply
+        """
+        reply_future = futures.Future()
+        with self._waiters_mutex:
+            self._waiters[host] = (reply_future, extra_replies, ignore)
+        return reply_future
+
+    def cancel(self, host, reply_future):
+        """ Stop waiting for the reply from host, e.g. after timeout """
+        with self._waiters_mutex:
+            waiter = self._waiters.get(host)
+            if waiter is not None and waiter[0] is reply_future:
+                del self._waiters[host]
+        reply_future.cancel()
+
     def send(self, proto):
         self._conn.send(proto)
 
-    def scan_multi_robot(self, num):
-        return self._conn.scan_multi_robot(num)
+    def scan_multi_robot(self, num, timeout=conn.TELLO_SCAN_TIMEOUT):
+        return self._conn.scan_multi_robot(num, timeout)
 
 
 class TelloStatus(object):
@@ -366,3 +381,61 @@ class TelloThread(threading.Thread):
             return self.result
         except Exception:
             return None
+
+
+class ExecuteResult(dict):
+    """ Results of a group command, {robot_id: result, ...}
+
+    Robots that raised or did not finish before the deadline have the result None,
+    the exceptions are in exceptions {robot_id: exception, ...}, the unfinished robot ids are in stragglers.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.exceptions = {}
+        self.stragglers = []
+
+    @property
+    def all_finished(self):
+        return not self.exceptions and not self.stragglers
+
+
+class FleetExecutor(object):
+    """ Bounded thread pool shared by the groups of one fleet, the worker threads are reused between commands """
+
+    def __init__(self, max_workers=FLEET_MAX_WORKERS):
+        self._pool = futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="FleetExecutor")
+
+    def submit(self, fn, *args, **kw):
+        return self._pool.submit(fn, *args, **kw)
+
+    def fan_out(self, calls, deadline=None):
+        """ Execute one call for each robot concurrently
+
+        :param calls: {robot_id: (function, args, kw), ...}
+        :param deadline: seconds to wait, robots that have not finished by then are reported in stragglers
+                         and keep running in background, None to wait for all robots
+        :return: ExecuteResult
+        """
+        future_dict = {}  # {robot_id: future}
+        for robot_id, (fn, args, kw) in calls.items():
+            future_dict[robot_id] = self._pool.submit(fn, *args, **kw)
+        futures.wait(future_dict.values(), deadline)
+        result = ExecuteResult()
+        for robot_id, robot_future in future_dict.items():
+            result[robot_id] = None
+            if not robot_future.done():
+                result.stragglers.append(robot_id)
+            elif robot_future.exception() is not None:
+                result.exceptions[robot_id] = robot_future.exception()
+                logger.warning("FleetExecutor: fan_out, robot id {0} raised {1!r}".format(
+                    robot_id, robot_future.exception()))
+            else:
+                result[robot_id] = robot_future.result()
+        if result.stragglers:
+            logger.warning("FleetExecutor: fan_out, robot ids {0} did not finish in {1}s".format(
+                result.stragglers, deadline))
+        return result
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait)
@@ -42,4 +42,5 @@ def enable_logging_to_file():
 
 __all__ = ['logger', 'protocol', 'config', 'version', 'action', 'conn', 'client', 'module',
            'robot', 'gimbal', 'chassis', 'gripper', 'blaster', 'camera', 'media', 'flight',
-           'led', 'robotic_arm', 'vision', 'sensor', 'ai_module']
+           'led', 'robotic_arm', 'vision', 'sensor', 'ai_module', 'aio', 'telemetry', 'simulator',
+           'scheduler', 'video_share', 'pipeline', 'audio']
@@ -91,6 +91,8 @@ class Action(metaclass=_AutoRegisterAction):
         self._event = threading.Event()
         self._obj = None
         self._on_state_changed = None
+        self._done_mutex = threading.Lock()
+        self._done_callbacks = []
 
     def _get_next_action_id(self):
         self.__class__._action_mutex.acquire()
@@ -173,6 +175,28 @@ class Action(metaclass=_AutoRegisterAction):
                 self._on_state_changed(self._obj, self, orgin, self._state)
             if self.is_completed:
                 self._event.set()
+                self._notify_done()
+
+    def add_done_callback(self, fn):
+        """ 添加动作完成时的回调函数，动作已完成时立即调用
+
+        :param fn: 回调函数，参数为 action 对象
+        """
+        with self._done_mutex:
+            if not self._event.isSet():
+                self._done_callbacks.append(fn)
+                return
+        fn(self)
+
+    def _notify_done(self):
+        with self._done_mutex:
+            callbacks = self._done_callbacks
+            self._done_callbacks = []
+        for fn in callbacks:
+            try:
+                fn(self)
+            except Exception as e:
+                logger.warning("Action: done callback, exception {0}".format(e))
 
     def wait_for_completed(self, timeout=None):
         """ 等待任务动作直到完成
@@ -201,6 +225,7 @@ class Action(metaclass=_AutoRegisterAction):
         """ 取消任务动作 """
         self._changeto_state(ACTION_ABORTED)
         self._event.set()
+        self._notify_done()
 
     def found_proto(self, proto):
         if proto.cmdset == self._action_proto_cls._cmdset \
@@ -347,15 +372,15 @@ class ActionDispatcher(object):
         action._action_id = action._get_next_action_id()
 
         if self.has_in_progress_actions:
-            self._in_progress_mutex.acquire()
-            for k in self._in_progress:
-                act = self._in_progress[k]
-                if action.target == act.target:
-                    action = list(self._in_progress.values())[0]
-                    logger.error("Robot is already performing {0} action(s) {1}".format(len(self._in_progress), action))
-                    raise Exception("Robot is already performing {0} action(s) {1}".format(
-                        len(self._in_progress), action))
-            self._in_progress_mutex.release()
+            with self._in_progress_mutex:
+                for k in self._in_progress:
+                    act = self._in_progress[k]
+                    if action.target == act.target:
+                        action = list(self._in_progress.values())[0]
+                        logger.error("Robot is already performing {0} action(s) {1}".format(
+                            len(self._in_progress), action))
+                        raise Exception("Robot is already performing {0} action(s) {1}".format(
+                            len(self._in_progress), action))
         if action.is_running:
             raise Exception("Action is already running")
 
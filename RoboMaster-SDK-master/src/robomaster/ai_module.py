@@ -92,7 +92,6 @@ class TelloAIInfoSubject(dds.Subject):
     def __init__(self):
         super().__init__()
         self._ai = 0
-        self._info_num = 1
         self._freq = protocol.TelloDdsProto.DDS_FREQ
 
     def percent(self):
@@ -102,28 +101,13 @@ class TelloAIInfoSubject(dds.Subject):
         return self._ai
 
     def decode(self, buf):
-        info_buf = buf.split(';')
-        ai_info = []
-        if len(info_buf) == 7:
-            for info in info_buf:
-                if ":" in info:
-                    if "x" in info:
-                        ai_info.append(int(info.split(':')[1]) / 320)
-                    elif "y" in info:
-                        ai_info.append(int(info.split(':')[1]) / 240)
-                    elif "w" in info:
-                        ai_info.append(int(info.split(':')[1]) / 320)
-                    elif "h" in info:
-                        ai_info.append(int(info.split(':')[1]) / 240)
-                    else:
-                        ai_info.append(info.split(':')[1])
-            self._ai = ai_info
-
-        if dds.IS_AI_FLAG in buf:
-            return True
-        else:
+        status = buf if isinstance(buf, protocol.TelloStatus) else protocol.TelloStatus.parse(buf)
+        if status.ai is None:
             logger.debug("TelloAIInfoSubject: decode, buf is not match")
             return False
+        if status.ai:
+            self._ai = status.ai
+        return True
 
 
 class TelloAI(object):
@@ -0,0 +1,534 @@
+# -*-coding:utf-8-*-
+# Copyright (c) 2020 DJI.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License in the file LICENSE.txt or at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import asyncio
+import binascii
+import collections
+from . import protocol
+from . import logger
+from . import event
+from . import config
+from . import conn
+from . import client
+from . import action
+from . import dds
+
+
+__all__ = ['AsyncClient', 'AsyncAction', 'AsyncActionDispatcher', 'AsyncSubscription', 'AsyncSubscriber',
+           'AsyncRobot']
+
+
+ROBOT_DEFAULT_HOST = protocol.host2byte(9, 6)
+HEART_BEAT_INTERVAL = 1
+
+
+def _set_future_result(fut, result):
+    if not fut.done():
+        fut.set_result(result)
+
+
+class _UdpProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self, cli):
+        self._client = cli
+
+    def datagram_received(self, data, addr):
+        self._client._on_data(data)
+
+    def error_received(self, exc):
+        logger.warning("AsyncClient: udp error_received, exception:{0}".format(exc))
+
+
+class AsyncClient(object):
+    """ 基于 asyncio 的 v1 协议客户端，不创建线程，所有收发都在事件循环中完成 """
+
+    # host is int, index is int.
+    def __init__(self, host=0, index=0, host_addr=None, target_addr=None, proto_type=conn.CONNECTION_PROTO_UDP):
+        self._host = host
+        self._index = index
+        self._host_addr = host_addr or config.ROBOT_DEFAULT_LOCAL_WIFI_ADDR
+        self._target_addr = target_addr or config.ROBOT_DEFAULT_WIFI_ADDR
+        self._proto_type = proto_type
+
+        self._loop = None
+        self._transport = None
+        self._writer = None
+        self._reader_task = None
+        self._decoder = protocol.MsgDecoder()
+
+        self._has_sent = 0
+        self._has_recv = 0
+        self._dispatcher = event.Dispatcher()
+        # ack ident -> future of the send_sync_msg waiting for it.
+        self._wait_ack_list = {}
+        self._running = False
+
+    @property
+    def remote_addr(self):
+        return self._target_addr
+
+    @property
+    def hostbyte(self):
+        return protocol.host2byte(self._host, self._index)
+
+    def add_handler(self, obj, name, f):
+        self._dispatcher.add_handler(obj, name, f)
+
+    def remove_handler(self, name):
+        self._dispatcher.remove_handler(name)
+
+    async def start(self):
+        self._loop = asyncio.get_event_loop()
+        if self._proto_type == conn.CONNECTION_PROTO_TCP:
+            reader, self._writer = await asyncio.open_connection(self._target_addr[0], self._target_addr[1],
+                                                                 local_addr=self._host_addr)
+            self._reader_task = self._loop.create_task(self._recv_task(reader))
+            logger.info("AsyncClient, tcp connect success {0}".format(self._host_addr))
+        else:
+            self._transport, _ = await self._loop.create_datagram_endpoint(lambda: _UdpProtocol(self),
+                                                                           local_addr=self._host_addr)
+            logger.info("AsyncClient, udp bind {0}".format(self._host_addr))
+        self._running = True
+        return True
+
+    async def stop(self):
+        self._running = False
+        for fut in self._wait_ack_list.values():
+            fut.cancel()
+        self._wait_ack_list.clear()
+        if self._reader_task:
+            self._reader_task.cancel()
+            self._reader_task = None
+        if self._writer:
+            self._writer.close()
+            self._writer = None
+        if self._transport:
+            self._transport.close()
+            self._transport = None
+
+    async def _recv_task(self, reader):
+        while self._running:
+            data = await reader.read(4096)
+            if not data:
+                logger.warning("AsyncClient: _recv_task, connection closed by remote.")
+                break
+            self._on_data(data)
+
+    def _on_data(self, data):
+        for msg in self._decoder.feed(data):
+            try:
+                if not msg.unpack_protocol():
+                    logger.warning("AsyncClient: recv, msg.unpack_protocol failed, msg:{0}".format(msg))
+            except Exception as e:
+                logger.warning("AsyncClient: recv, unpack_protocol exception {0}".format(e))
+                continue
+            self._has_recv += 1
+            if msg.is_ack:
+                fut = self._wait_ack_list.get(client.Client._make_ack_identify(msg))
+                if fut is not None:
+                    _set_future_result(fut, msg)
+            self._dispatcher.dispatch(msg)
+
+    def send(self, data):
+        try:
+            if self._writer:
+                self._writer.write(data)
+            elif self._transport:
+                self._transport.sendto(data, self._target_addr)
+        except Exception as e:
+            logger.warning("AsyncClient: send, exception {0}".format(str(e)))
+
+    def send_msg(self, msg):
+        data = msg.pack()
+        logger.debug("AsyncClient: send_msg, cmset:{0:2x}, cmdid:{1:2x}, {2}".format(msg.cmdset, msg.cmdid,
+                                                                                     binascii.hexlify(data)))
+        self._has_sent += 1
+        self.send(data)
+
+    def send_async_msg(self, msg):
+        if not self._running:
+            logger.error("AsyncClient: send_async_msg, client is not running.")
+            return None
+        msg._need_ack = 0
+        return self.send_msg(msg)
+
+    async def send_sync_msg(self, msg, callback=None, timeout=3.0):
+        """ 发送消息并等待 ack，不阻塞事件循环
+
+        :param msg: 待发送的 Msg
+        :param callback: 收到 ack 后的回调函数，参数为 ack 消息
+        :param timeout: 等待 ack 的超时时间，单位秒
+        :return: ack 消息，超时返回 None
+        """
+        if not self._running:
+            logger.error("AsyncClient: send_sync_msg, client is not running.")
+            return None
+        if msg._need_ack == 0:
+            self.send_msg(msg)
+            return None
+
+        ident = client.Client._make_ack_identify(msg)
+        if ident in self._wait_ack_list:
+            logger.error("AsyncClient: ack ident {0} is already waited.".format(ident))
+            return None
+        fut = self._loop.create_future()
+        self._wait_ack_list[ident] = fut
+        try:
+            self.send_msg(msg)
+            resp_msg = await asyncio.wait_for(fut, timeout)
+        except asyncio.TimeoutError:
+            logger.error("AsyncClient: send_sync_msg wait msg receiver:{0}, cmdset:0x{1:02x}, cmdid:0x{2:02x} "
+                         "timeout!".format(msg.receiver, msg.cmdset, msg.cmdid))
+            return None
+        finally:
+            self._wait_ack_list.pop(ident, None)
+        if callback:
+            callback(resp_msg)
+        return resp_msg
+
+    async def send_sync_proto(self, proto, target):
+        """ 发送协议并检查返回码
+
+        :return: bool: retcode 为 0 返回 True
+        """
+        msg = protocol.Msg(self.hostbyte, target, proto)
+        resp_msg = await self.send_sync_msg(msg)
+        if resp_msg is None:
+            return False
+        resp_proto = resp_msg.get_proto()
+        if resp_proto is None or resp_proto._retcode != 0:
+            logger.warning("AsyncClient: send_sync_proto, proto:{0} failed.".format(proto))
+            return False
+        return True
+
+
+class AsyncAction(object):
+    """ 任务动作的异步句柄，可 await 等待动作完成，其余属性与原 Action 相同 """
+
+    def __init__(self, act, future):
+        self._action = act
+        self._future = future
+
+    def __repr__(self):
+        return "<AsyncAction {0}>".format(self._action)
+
+    def __getattr__(self, name):
+        return getattr(self._action, name)
+
+    @property
+    def action(self):
+        return self._action
+
+    async def wait_for_completed(self, timeout=None):
+        """ 等待任务动作直到完成
+
+        :param timeout: 超时，在timeout前未完成任务动作，直接返回
+        :return: bool: 动作在指定时间内完成，返回True; 动作超时返回False
+        """
+        if self._action.is_completed:
+            return True
+        try:
+            await asyncio.wait_for(asyncio.shield(self._future), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("AsyncAction: wait_for_completed timeout.")
+            self._action._changeto_state(action.ACTION_EXCEPTION)
+            return False
+        return True
+
+
+class AsyncActionDispatcher(action.ActionDispatcher):
+    """ 复用 ActionDispatcher 的动作匹配逻辑，动作完成时唤醒对应的 future """
+
+    def __init__(self, client=None):
+        super().__init__(client)
+        self._loop = None
+        self._futures = {}
+
+    def send_action(self, act, action_type=action.ACTION_NOW):
+        """ 发送任务动作命令
+
+        :return: AsyncAction，可 await wait_for_completed()
+        """
+        self._loop = asyncio.get_event_loop()
+        fut = self._loop.create_future()
+        super().send_action(act, action_type)
+        self._futures[act.make_action_key()] = fut
+        return AsyncAction(act, fut)
+
+    @classmethod
+    def _on_action_state_changed(cls, self, act, orgin, target):
+        super()._on_action_state_changed(self, act, orgin, target)
+        if act.is_completed:
+            fut = self._futures.pop(act.make_action_key(), None)
+            if fut is not None:
+                self._loop.call_soon_threadsafe(_set_future_result, fut, act.state)
+
+
+class AsyncSubscription(object):
+    """ 单个 DDS subject 的订阅，异步迭代返回每次推送的 subject.data_info()
+
+    缓存最多 maxsize 条推送，消费跟不上时丢弃最旧的数据。
+    """
+
+    def __init__(self, subscriber, subject, maxsize=1):
+        self._subscriber = subscriber
+        self._subject = subject
+        self._items = collections.deque(maxlen=maxsize)
+        self._event = asyncio.Event()
+        self._closed = False
+        self._received = 0
+        self._dropped = 0
+
+    def __repr__(self):
+        return "<AsyncSubscription {0}, received:{1}, dropped:{2}>".format(
+            self._subject.name, self._received, self._dropped)
+
+    @property
+    def subject(self):
+        return self._subject
+
+    @property
+    def dropped(self):
+        return self._dropped
+
+    def _push(self, buf):
+        self._subject.decode(buf)
+        if len(self._items) == self._items.maxlen:
+            self._dropped += 1
+        self._items.append(self._subject.data_info())
+        self._received += 1
+        self._event.set()
+
+    def _close(self):
+        self._closed = True
+        self._event.set()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self._items:
+            if self._closed:
+                raise StopAsyncIteration
+            self._event.clear()
+            await self._event.wait()
+        return self._items.popleft()
+
+    async def close(self):
+        return await self._subscriber.unsubscribe(self)
+
+
+class AsyncSubscriber(object):
+    """ 异步 DDS 订阅，周期推送按 msg_id 路由，事件推送按 (cmdset, cmdid) 路由 """
+    _sub_msg_id = dds.SDK_FIRST_DDS_ID
+
+    def __init__(self, cli):
+        self._client = cli
+        self._period_subs = {}
+        self._event_subs = {}
+
+    def start(self):
+        self._client.add_handler(self, "AsyncSubscriber", self._msg_recv)
+
+    def get_next_subject_id(self):
+        if self._sub_msg_id > dds.SDK_LAST_DDS_ID:
+            self._sub_msg_id = dds.SDK_FIRST_DDS_ID
+        else:
+            self._sub_msg_id += 1
+        return self._sub_msg_id
+
+    @classmethod
+    def _msg_recv(cls, self, msg):
+        proto = msg.get_proto()
+        if proto is None:
+            return
+        if msg.cmdset == 0x48 and msg.cmdid == 0x08:
+            sub = self._period_subs.get(proto._msg_id)
+        else:
+            sub = self._event_subs.get((msg.cmdset, msg.cmdid))
+        if sub is not None:
+            sub._push(proto._data_buf)
+
+    async def subscribe(self, subject, freq=None, maxsize=1):
+        """ 订阅 subject
+
+        :param subject: dds.Subject 实例，如 chassis.PositionSubject(0)
+        :param freq: enum: (1, 5, 10, 20, 50) 周期推送频率，为 None 时使用 subject.freq
+        :param maxsize: 未被消费的推送最多缓存条数
+        :return: AsyncSubscription，订阅失败返回 None
+        """
+        sub = AsyncSubscription(self, subject, maxsize)
+        if subject.type == dds.DDS_SUB_TYPE_EVENT:
+            self._event_subs[(subject.cmdset, subject.cmdid)] = sub
+            return sub
+
+        if freq is not None:
+            subject.freq = freq
+        proto = protocol.ProtoAddSubMsg()
+        proto._node_id = self._client.hostbyte
+        proto._sub_freq = subject.freq
+        proto._sub_data_num = 1
+        proto._msg_id = self.get_next_subject_id()
+        proto._sub_uid_list.append(subject.uid)
+        subject._subject_id = proto._msg_id
+        self._period_subs[proto._msg_id] = sub
+        if not await self._client.send_sync_proto(proto, protocol.host2byte(9, 0)):
+            del self._period_subs[proto._msg_id]
+            return None
+        return sub
+
+    async def unsubscribe(self, sub):
+        """ 取消订阅，正在迭代的 async for 会在取完缓存后结束
+
+        :return: bool: 取消订阅结果
+        """
+        sub._close()
+        subject = sub.subject
+        if subject.type == dds.DDS_SUB_TYPE_EVENT:
+            self._event_subs.pop((subject.cmdset, subject.cmdid), None)
+            return True
+        if self._period_subs.pop(subject._subject_id, None) is None:
+            return False
+        proto = protocol.ProtoDelMsg()
+        proto._msg_id = subject._subject_id
+        proto._node_id = self._client.hostbyte
+        return await self._client.send_sync_proto(proto, protocol.host2byte(9, 0))
+
+
+class AsyncRobot(object):
+    """ RoboMaster EP 的 asyncio 版本，单个事件循环可以驱动多台机器人
+
+    心跳由事件循环定时器发送，不创建线程；模块功能通过 send_sync_msg、action_dispatcher 和 dds 使用。
+    """
+    _product = "EP"
+    _sdk_host = ROBOT_DEFAULT_HOST
+
+    def __init__(self):
+        self._client = None
+        self._sdk_conn = conn.SdkConnection()
+        self._action_dispatcher = None
+        self._dds = None
+        self._heart_beat_handle = None
+        self._initialized = False
+
+    @property
+    def client(self):
+        return self._client
+
+    @property
+    def action_dispatcher(self):
+        return self._action_dispatcher
+
+    @property
+    def dds(self):
+        return self._dds
+
+    @property
+    def is_initialized(self):
+        return self._initialized
+
+    async def initialize(self, conn_type=config.DEFAULT_CONN_TYPE, proto_type=config.DEFAULT_PROTO_TYPE, sn=None):
+        """ 初始化机器人
+
+        :param conn_type: 连接建立类型: ap表示使用热点直连；sta表示使用组网连接，rndis表示使用USB连接
+        :param proto_type: 通讯方式: tcp, udp
+        :return: bool: 初始化结果
+        """
+        loop = asyncio.get_event_loop()
+        # the connection handshake is a one-off blocking exchange, keep it off the event loop.
+        result, local_addr, remote_addr = await loop.run_in_executor(
+            None, self._sdk_conn.request_connection, self._sdk_host, conn_type, proto_type, sn)
+        if not result:
+            logger.error("AsyncRobot: Connection Failed, Please Check Hareware Connections!!! "
+                         "conn_type {0}, host {1}, target {2}.".format(conn_type, local_addr, remote_addr))
+            return False
+        self._client = AsyncClient(9, 6, local_addr, remote_addr, proto_type)
+        await self._client.start()
+
+        self._action_dispatcher = AsyncActionDispatcher(self._client)
+        self._action_dispatcher.initialize()
+        self._dds = AsyncSubscriber(self._client)
+        self._dds.start()
+
+        await self._enable_sdk(1)
+        await self.reset()
+
+        self._send_heart_beat_msg()
+        self._initialized = True
+        return True
+
+    async def close(self):
+        if self._heart_beat_handle:
+            self._heart_beat_handle.cancel()
+            self._heart_beat_handle = None
+        if self._initialized:
+            await self._enable_sdk(0)
+        if self._client:
+            await self._client.stop()
+        if self._sdk_conn:
+            self._sdk_conn.close()
+        self._initialized = False
+        logger.info("AsyncRobot close")
+
+    def _send_heart_beat_msg(self):
+        proto = protocol.ProtoSdkHeartBeat()
+        msg = protocol.Msg(self._client.hostbyte, protocol.host2byte(9, 0), proto)
+        self._client.send_msg(msg)
+        self._heart_beat_handle = asyncio.get_event_loop().call_later(HEART_BEAT_INTERVAL, self._send_heart_beat_msg)
+
+    async def _enable_sdk(self, enable=1):
+        proto = protocol.ProtoSetSdkMode()
+        proto._enable = enable
+        return await self._client.send_sync_proto(proto, protocol.host2byte(9, 0))
+
+    async def reset(self):
+        """ 重置 DDS 订阅节点并切换到自由模式 """
+        proto = protocol.ProtoSubNodeReset()
+        proto._node_id = self._client.hostbyte
+        await self._client.send_sync_proto(proto, protocol.host2byte(9, 0))
+        proto = protocol.ProtoSubscribeAddNode()
+        proto._node_id = self._client.hostbyte
+        await self._client.send_sync_proto(proto, protocol.host2byte(9, 0))
+        proto = protocol.ProtoSetRobotMode()
+        proto._mode = 0
+        return await self._client.send_sync_proto(proto, protocol.host2byte(9, 0))
+
+    async def send_sync_msg(self, msg, callback=None, timeout=3.0):
+        return await self._client.send_sync_msg(msg, callback, timeout)
+
+    async def get_version(self):
+        """ 获取机器人固件版本号信息
+
+        :return: 版本字符串，如："01.01.0305"
+        """
+        msg = protocol.Msg(self._client.hostbyte, protocol.host2byte(8, 1), protocol.ProtoGetProductVersion())
+        resp_msg = await self._client.send_sync_msg(msg)
+        if resp_msg is None:
+            logger.warning("AsyncRobot: get_version failed.")
+            return None
+        return resp_msg.get_proto()._version
+
+    async def get_sn(self):
+        """ 获取机器人硬件SN信息
+
+        :return: 硬件SN字符串，如："3JKDH2T0011000"
+        """
+        msg = protocol.Msg(self._client.hostbyte, protocol.host2byte(8, 1), protocol.ProtoGetSn())
+        resp_msg = await self._client.send_sync_msg(msg)
+        if resp_msg is None:
+            logger.warning("AsyncRobot: get_sn failed.")
+            return None
+        return resp_msg.get_proto()._sn
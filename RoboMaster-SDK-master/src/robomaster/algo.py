@@ -14,6 +14,9 @@
 # limitations under the License.
 
 
+import binascii
+
+
 crc8_table = [
     0x00, 0x5e, 0xbc, 0xe2, 0x61, 0x3f, 0xdd, 0x83, 0xc2, 0x9c, 0x7e, 0x20, 0xa3, 0xfd, 0x1f, 0x41,
     0x9d, 0xc3, 0x21, 0x7f, 0xfc, 0xa2, 0x40, 0x1e, 0x5f, 0x01, 0xe3, 0xbd, 0x3e, 0x60, 0x82, 0xdc,
@@ -69,16 +72,32 @@ crc16_table = [
 ]
 
 
+# 字节按位反转表，用于把反射型 crc16 转换为 binascii.crc_hqx 计算的非反射 CRC-CCITT
+_bit_reverse_table = bytes(int('{0:08b}'.format(i)[::-1], 2) for i in range(256))
+
+
+def _reverse16(value):
+    return _bit_reverse_table[value & 0xff] << 8 | _bit_reverse_table[(value >> 8) & 0xff]
+
+
 def crc8_calc(data, crc=0x77):
-    for t in range(0, len(data)):
-        crc = crc8_table[crc ^ data[t]]
+    for b in data:
+        crc = crc8_table[crc ^ b]
     return crc
 
 
 def crc16_calc(data, crc=0x3692):
-    for t in range(0, len(data)):
-        crc = ((crc >> 8) & 0xff) ^ crc16_table[((crc ^ data[t]) & 0xff)]
-    return crc
+    """ 计算 crc16，结果与逐字节查 crc16_table 相同
+
+    crc16_table 是多项式 0x8408 的反射型 CRC-CCITT，先把输入逐字节位反转 (bytes.translate)，
+    再交给 C 实现的 binascii.crc_hqx 整块计算，最后把结果位反转回来。
+
+    :param data: bytes/bytearray/memoryview，待校验数据
+    :param crc: 初始值
+    :return: int，crc16 校验值
+    """
+    buf = bytes(data).translate(_bit_reverse_table)
+    return _reverse16(binascii.crc_hqx(buf, _reverse16(crc)))
 
 
 def simple_encrypt(data):
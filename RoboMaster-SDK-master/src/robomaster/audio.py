@@ -0,0 +1,340 @@
+# -*-coding:utf-8-*-
+# Copyright (c) 2020 DJI.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License in the file LICENSE.txt or at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import math
+import time
+import wave
+import queue
+import asyncio
+import threading
+import numpy
+from . import logger
+
+
+__all__ = ['AudioRingBuffer', 'AudioRingReader', 'Resampler', 'AudioBlocks', 'WavRecorder', 'AUDIO_SAMPLE_RATE', 'AUDIO_BLOCK_SIZE']
+
+
+# 机器人音频流为 48kHz 单通道 16bit PCM，每个 opus 包解码为 20ms
+AUDIO_SAMPLE_RATE = 48000
+AUDIO_BLOCK_SIZE = 960
+# 环形缓冲区可以缓存的时长，单位 s，读取方跟不上时覆盖最老的数据
+AUDIO_RING_SECONDS = 2
+# 重采样滤波器每个相位的抽头数
+RESAMPLE_TAPS = 32
+
+
+class AudioRingBuffer(object):
+    """ 预分配的 PCM 环形缓冲区，解码线程写入，内存占用不随录制时长增长
+
+    写入方从不等待，每个读取方通过 reader() 获得自己的读取位置，互不影响，读取方跟不上时最老的数据被覆盖
+    """
+
+    def __init__(self, capacity=AUDIO_SAMPLE_RATE * AUDIO_RING_SECONDS):
+        """
+        :param capacity: int: 可缓存的采样数
+        """
+        self._buf = numpy.zeros(capacity, dtype=numpy.int16)
+        self._capacity = capacity
+        self._cond = threading.Condition()
+        # 累计写入的采样数，只增不减，包括因超过 capacity 未能存入的部分
+        self._write_pos = 0
+        self._overrun = 0
+        self._closed = False
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @property
+    def closed(self):
+        return self._closed
+
+    @property
+    def overrun(self):
+        """ 所有读取方因跟不上而未能读到的采样数之和 """
+        return self._overrun
+
+    def reader(self):
+        """ 创建读取方，从当前写入位置开始读取
+
+        :return: AudioRingReader
+        """
+        with self._cond:
+            return AudioRingReader(self, self._write_pos)
+
+    def open(self):
+        """ 重新开始接收，已创建的读取方继续从新的数据流读取 """
+        with self._cond:
+            self._overrun = 0
+            self._closed = False
+
+    def close(self):
+        """ 关闭缓存，正在等待的读取方读完剩余数据后抛出 queue.Empty """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def write(self, samples):
+        """ 写入采样，缓存满时覆盖最老的数据，超过 capacity 的部分只保留最后 capacity 个
+
+        :param samples: numpy.ndarray: int16 采样
+        """
+        n = len(samples)
+        stored = samples[-self._capacity:] if n > self._capacity else samples
+        m = len(stored)
+        with self._cond:
+            start = (self._write_pos + n - m) % self._capacity
+            first = min(m, self._capacity - start)
+            self._buf[start:start + first] = stored[:first]
+            self._buf[:m - first] = stored[first:]
+            self._write_pos += n
+            self._cond.notify_all()
+
+
+class AudioRingReader(object):
+    """ AudioRingBuffer 的一个读取方，记录自己的读取位置及被覆盖的采样数 """
+
+    def __init__(self, ring, pos):
+        self._ring = ring
+        self._read_pos = pos
+        self._overrun = 0
+
+    @property
+    def closed(self):
+        return self._ring.closed
+
+    @property
+    def capacity(self):
+        return self._ring.capacity
+
+    @property
+    def available(self):
+        """ 缓存中未读取的采样数 """
+        ring = self._ring
+        with ring._cond:
+            return min(ring._write_pos - self._read_pos, ring._capacity)
+
+    @property
+    def overrun(self):
+        """ 跟不上写入方时被覆盖的采样数 """
+        return self._overrun
+
+    def _skip_overrun(self):
+        """ 跳过已被覆盖的数据，调用方需持有 ring._cond """
+        ring = self._ring
+        lost = ring._write_pos - self._read_pos - ring._capacity
+        if lost > 0:
+            self._read_pos += lost
+            self._overrun += lost
+            ring._overrun += lost
+
+    def read(self, size, timeout=None, out=None):
+        """ 读取 size 个采样，数据不足时等待
+
+        缓存关闭后返回剩余的数据，可能不足 size 个，没有剩余数据时抛出 queue.Empty，可以通过 closed 区分超时
+
+        :param size: int: 采样数，不能超过 capacity
+        :param timeout: float: 等待超时时间，超时抛出 queue.Empty
+        :param out: numpy.ndarray: 可选的输出数组，避免每次分配
+        :return: numpy.ndarray: int16 采样
+        """
+        ring = self._ring
+        capacity = ring._capacity
+        if size > capacity:
+            raise ValueError("AudioRingReader: read, size {0} exceeds capacity {1}".format(size, capacity))
+        with ring._cond:
+            ring._cond.wait_for(lambda: ring._write_pos - self._read_pos >= size or ring._closed, timeout)
+            self._skip_overrun()
+            available = ring._write_pos - self._read_pos
+            if available < size:
+                if not ring._closed or available == 0:
+                    raise queue.Empty
+                size = available
+            if out is None:
+                out = numpy.empty(size, dtype=numpy.int16)
+            start = self._read_pos % capacity
+            first = min(size, capacity - start)
+            out[:first] = ring._buf[start:start + first]
+            out[first:size] = ring._buf[:size - first]
+            self._read_pos += size
+            return out[:size]
+
+
+class Resampler(object):
+    """ 多相 FIR 重采样，按块处理并保存滤波器状态，块与块之间连续
+
+    up/down 由输入输出采样率约分得到，每个输出采样只计算所在相位的 RESAMPLE_TAPS 个乘加，整块计算向量化
+    """
+
+    def __init__(self, src_rate, dst_rate, taps=RESAMPLE_TAPS):
+        """
+        :param src_rate: int: 输入采样率
+        :param dst_rate: int: 输出采样率
+        :param taps: int: 每个相位的滤波器抽头数，越大阻带衰减越好，计算量越大
+        """
+        g = math.gcd(src_rate, dst_rate)
+        self._up = dst_rate // g
+        self._down = src_rate // g
+        self._taps = taps
+        self._phases = self._design(self._up, self._down, taps)
+        self._tap_index = numpy.arange(taps)
+        # 输入的前 taps-1 个采样用零填充，_base 为 _history[0] 对应的输入采样序号
+        self._history = numpy.zeros(taps - 1, dtype=numpy.float32)
+        self._base = -(taps - 1)
+        self._out_index = 0
+
+    @staticmethod
+    def _design(up, down, taps):
+        """ 加 kaiser 窗的 sinc 低通，截止频率取输入输出中较低的奈奎斯特频率，按相位拆分为 (up, taps) """
+        length = up * taps
+        cutoff = 0.5 / max(up, down) * 0.95
+        n = numpy.arange(length) - (length - 1) / 2.0
+        h = 2 * cutoff * numpy.sinc(2 * cutoff * n) * numpy.kaiser(length, 8.0)
+        h *= up / h.sum()
+        # 第 p 个相位的第 j 个抽头为 h[p + j * up]，与 x[n - j] 相乘
+        return h.reshape(taps, up).T.astype(numpy.float32)
+
+    def process(self, samples):
+        """ 重采样一块数据
+
+        :param samples: numpy.ndarray: int16 采样
+        :return: numpy.ndarray: int16 采样，长度约为 len(samples) * dst_rate / src_rate
+        """
+        x = numpy.concatenate((self._history, samples.astype(numpy.float32)))
+        last = self._base + len(x) - 1
+        # 所需输入采样都已到达的输出采样
+        end = ((last + 1) * self._up + self._down - 1) // self._down
+        k = numpy.arange(self._out_index, end, dtype=numpy.int64)
+        pos = k * self._down
+        n = pos // self._up
+        phase = pos % self._up
+        idx = (n - self._base)[:, None] - self._tap_index[None, :]
+        y = numpy.einsum('ij,ij->i', x[idx], self._phases[phase])
+        self._out_index = end
+        self._history = x[len(x) - (self._taps - 1):]
+        self._base = last - (self._taps - 1) + 1
+        return numpy.clip(numpy.rint(y), -32768, 32767).astype(numpy.int16)
+
+
+class AudioBlocks(object):
+    """ 从 AudioRingBuffer 中按固定长度读取 PCM 块的迭代器，支持 for 和 async for
+
+    async for 时阻塞的读取在线程池中执行，不阻塞事件循环
+    """
+
+    def __init__(self, ring, block_size=AUDIO_BLOCK_SIZE, sample_rate=AUDIO_SAMPLE_RATE, timeout=1):
+        """
+        :param ring: AudioRingBuffer: 数据源，使用自己的读取位置，多个 AudioBlocks 各自读到完整的数据
+        :param block_size: int: 输出块的采样数
+        :param sample_rate: int: 输出采样率，与 AUDIO_SAMPLE_RATE 不同时分块重采样
+        :param timeout: float: 等待数据的超时时间，超时后迭代结束
+        """
+        self._reader = ring.reader()
+        self._block_size = block_size
+        self._timeout = timeout
+        self._resampler = None
+        if sample_rate != AUDIO_SAMPLE_RATE:
+            self._resampler = Resampler(AUDIO_SAMPLE_RATE, sample_rate)
+        self._pending = numpy.zeros(0, dtype=numpy.int16)
+        self._chunk = min(AUDIO_BLOCK_SIZE, ring.capacity)
+
+    @property
+    def closed(self):
+        """ 数据流是否已经结束 """
+        return self._reader.closed
+
+    @property
+    def overrun(self):
+        """ 读取不及时被覆盖的采样数，按输入采样率计 """
+        return self._reader.overrun
+
+    def read(self):
+        """ 读取一块数据
+
+        :return: numpy.ndarray: block_size 个 int16 采样，数据流结束时最后一块可能不足 block_size，
+                 超时或数据流结束后抛出 queue.Empty
+        """
+        while len(self._pending) < self._block_size:
+            try:
+                samples = self._reader.read(self._chunk, self._timeout)
+            except queue.Empty:
+                if not self._reader.closed or len(self._pending) == 0:
+                    raise
+                # 数据流已结束，输出剩余的数据
+                block, self._pending = self._pending, self._pending[:0]
+                return block
+            if self._resampler:
+                samples = self._resampler.process(samples)
+            self._pending = numpy.concatenate((self._pending, samples))
+        block = self._pending[:self._block_size]
+        self._pending = self._pending[self._block_size:]
+        return block
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return self.read()
+        except queue.Empty:
+            raise StopIteration
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await asyncio.get_event_loop().run_in_executor(None, self.read)
+        except queue.Empty:
+            raise StopAsyncIteration
+
+
+class WavRecorder(object):
+    """ 边接收边写入 wav 文件，单通道 16bit """
+
+    def __init__(self, ring, save_file, sample_rate=AUDIO_SAMPLE_RATE):
+        self._blocks = AudioBlocks(ring, AUDIO_BLOCK_SIZE, sample_rate)
+        self._save_file = save_file
+        self._sample_rate = sample_rate
+
+    def record(self, seconds):
+        """ 录制指定时长
+
+        :param seconds: float: 录制时长
+        :return: int: 写入的采样数
+        """
+        total = int(seconds * self._sample_rate)
+        written = 0
+        deadline = time.time() + seconds
+        wf = wave.open(self._save_file, 'wb')
+        try:
+            wf.setnchannels(1)
+            wf.setsampwidth(2)
+            wf.setframerate(self._sample_rate)
+            while written < total:
+                try:
+                    block = self._blocks.read()
+                except queue.Empty:
+                    if self._blocks.closed or time.time() >= deadline:
+                        break
+                    logger.warning("WavRecorder: record, no audio data received")
+                    continue
+                block = block[:total - written]
+                wf.writeframes(block.astype('<i2').tobytes())
+                written += len(block)
+        finally:
+            wf.close()
+        return written
@@ -28,7 +28,6 @@ class TelloBatInfoSubject(dds.Subject):
     def __init__(self):
         super().__init__()
         self._bat = 0
-        self._info_num = 1
         self._freq = protocol.TelloDdsProto.DDS_FREQ
 
     def percent(self):
@@ -38,18 +37,12 @@ class TelloBatInfoSubject(dds.Subject):
         return self._bat
 
     def decode(self, buf):
-        push_info = buf.split(';')
-        found_info_num = 0
-        for info in push_info:
-            if protocol.TelloDdsProto.DDS_BATTERY_FLAG in info:
-                self._bat = int(info.split(':')[1])
-                found_info_num += 1
-        if found_info_num == self._info_num:
-            return True
-        else:
-            logger.debug("TelloBatInfoSubject: decode, found_info_num {0} is not match self._info_num {1}".format(
-                found_info_num, self._info_num))
+        status = buf if isinstance(buf, protocol.TelloStatus) else protocol.TelloStatus.parse(buf)
+        if status.bat is None:
+            logger.debug("TelloBatInfoSubject: decode, battery not found in {0}".format(status))
             return False
+        self._bat = int(status.bat)
+        return True
 
     @property
     def freq(self):
@@ -15,14 +15,12 @@
 
 
 import numpy
-import audioop
-import wave
-import time
 from . import module
 from . import conn
 from . import protocol
 from . import logger
 from . import media
+from . import audio
 
 
 __all__ = ['Camera', 'EPCamera', 'TelloCamera', 'STREAM_360P', 'STREAM_540P', 'STREAM_720P']
@@ -57,6 +55,48 @@ class Camera(object):
         """
         return self._liveview.read_video_frame(timeout, strategy)
 
+    def read_video_frame_info(self, timeout=3, strategy="pipeline"):
+        """ 读取一帧视频流帧，同时返回帧序号和解码时间
+
+        :param timeout: float: (0, inf)，超时时间，超过指定timeout时间后函数返回
+        :param strategy: enum: ("pipeline", "newest") 读取帧策略，同 read_video_frame
+        :return: tuple: (frame, seq, timestamp)，seq 为帧序号，不连续说明中间的帧已被丢弃，timestamp 为解码完成的时间
+        """
+        return self._liveview.read_video_frame_info(timeout, strategy)
+
+    def peek_video_frame_info(self, last_seq=0, timeout=3):
+        """ 读取序号大于 last_seq 的最新一帧，不影响 read_video_frame 的读取
+
+        :param last_seq: int: 上一次读取到的帧序号，0 表示读取当前最新的一帧
+        :param timeout: float: (0, inf)，超时时间，超时抛出 queue.Empty
+        :return: tuple: (frame, seq, timestamp)，同 read_video_frame_info
+        """
+        return self._liveview.peek_video_frame_info(last_seq, timeout)
+
+    def start_video_share(self, name="robomaster_video", slot_num=4, max_frame_size=1280 * 720 * 3):
+        """ 将视频流帧发布到共享内存，本机的其他进程可以同时读取，视频流只需解码一次
+
+        其他进程中使用 robomaster.video_share.FrameSubscriber(name).read() 读取最新的帧
+
+        :param name: str: 共享内存名称
+        :param slot_num: int: 共享内存中缓存的帧数
+        :param max_frame_size: int: 单帧图像的最大字节数，默认为 720p BGR 图像的大小
+        :return: video_share.FramePublisher
+        """
+        return self._liveview.start_video_share(name, slot_num, max_frame_size)
+
+    def stop_video_share(self):
+        """ 停止发布视频流帧到共享内存，并删除共享内存 """
+        self._liveview.stop_video_share()
+
+    @property
+    def video_stats(self):
+        """ 视频流统计
+
+        :return: dict: decoded 已解码帧数，dropped 未被读取即被丢弃的帧数，skipping 是否正在跳过非参考帧
+        """
+        return self._liveview.video_stats
+
     def read_cv2_image(self, timeout=3, strategy="pipeline"):
         """ 读取一帧视频流帧
 
@@ -69,7 +109,7 @@ class Camera(object):
         frame = self.read_video_frame(timeout, strategy)
         if frame is None:
             return None
-        img = numpy.array(frame)
+        img = numpy.asarray(frame)
         return img
 
 
@@ -86,10 +126,12 @@ class TelloCamera(Camera):
     def conf(self):
         return self._robot.conf
 
-    def start_video_stream(self, display=True):
+    def start_video_stream(self, display=True, latest_only=False, skip_nonref=False):
         """ 开启视频流
 
         :param display: bool, 是否显示视频流
+        :param latest_only: bool, 只保留最新的一帧，来不及读取的帧直接丢弃，降低延迟
+        :param skip_nonref: bool, 来不及读取时解码器跳过非参考帧
         :return: bool: 调用结果
         """
         self._video_stream(1)
@@ -98,7 +140,9 @@ class TelloCamera(Camera):
         vs_proto = self.conf.video_stream_proto
         return self._liveview.start_video_stream(display,
                                                  addr=vs_addr,
-                                                 ip_proto=vs_proto)
+                                                 ip_proto=vs_proto,
+                                                 latest_only=latest_only,
+                                                 skip_nonref=skip_nonref)
 
     def stop_video_stream(self):
         flag = self._liveview.stop_video_stream()
@@ -273,11 +317,13 @@ class EPCamera(module.Module, Camera):
         :return: tuple:(ip, port)：机器人视频流地址 """
         return self._robot.ip, self.conf.video_stream_port
 
-    def start_video_stream(self, display=True, resolution="720p"):
+    def start_video_stream(self, display=True, resolution="720p", latest_only=False, skip_nonref=False):
         """ 开启视频流
 
         :param display: bool，是否显示视频流
         :param resolution: enum: ("360p", "540p", "720p")，设置图传分辨率尺寸
+        :param latest_only: bool，只保留最新的一帧，来不及读取的帧直接丢弃，适用于对延迟敏感的视觉闭环控制
+        :param skip_nonref: bool，来不及读取时解码器跳过非参考帧，降低解码耗时
         :return: bool：调用结果
         """
         result = self._stream_sdk(1, resolution)
@@ -291,7 +337,9 @@ class EPCamera(module.Module, Camera):
         self._video_enable = True
         return self._liveview.start_video_stream(display,
                                                  self.video_stream_addr,
-                                                 self.conf.video_stream_proto)
+                                                 self.conf.video_stream_proto,
+                                                 latest_only=latest_only,
+                                                 skip_nonref=skip_nonref)
 
     def stop_video_stream(self):
         """ 停止视频流
@@ -348,6 +396,27 @@ class EPCamera(module.Module, Camera):
         """
         return self._liveview.read_audio_frame(timeout)
 
+    def audio_blocks(self, block_size=audio.AUDIO_BLOCK_SIZE, sample_rate=audio.AUDIO_SAMPLE_RATE, timeout=1):
+        """ 按固定长度读取音频流，需先调用 start_audio_stream，多个读取方可以同时使用，各自读到完整的数据
+
+        示例：async for block in ep_camera.audio_blocks(1600, 16000): ...
+
+        :param block_size: int: 每块的采样数
+        :param sample_rate: int: 输出采样率，不为 48000 时分块重采样
+        :param timeout: float: 超过该时间没有收到音频时迭代结束
+        :return: 迭代器，每次返回 block_size 个 int16 单通道采样的 numpy.ndarray，支持 for 和 async for
+        """
+        return self._liveview.audio_blocks(block_size, sample_rate, timeout)
+
+    @property
+    def audio_stats(self):
+        """ 音频流统计
+
+        :return: dict: decoded 已解码帧数，dropped 未被 read_audio_frame 读取即被丢弃的帧数，
+                 overrun 各个 audio_blocks 读取方未能及时读取而被覆盖的采样数之和
+        """
+        return self._liveview.audio_stats
+
     def record_audio(self, save_file="output.wav", seconds=5, sample_rate=48000):
         """ 录制音频，保存到本地，支持wav格式，单通道
 
@@ -357,25 +426,8 @@ class EPCamera(module.Module, Camera):
         :return: bool: 调用结果
         """
         self.start_audio_stream()
-        start = time.time()
         try:
-            wf = wave.open(save_file, 'wb')
-            wf.setparams((1, 2, sample_rate, 0, 'NONE', 'Uncompressed'))
-            frames = []
-            while True:
-                if time.time() - start >= seconds:
-                    break
-                audio_frame = self.read_audio_frame()
-                if sample_rate == 48000:
-                    wf.writeframes(audio_frame)
-                else:
-                    frames.append(audio_frame)
-
-            if sample_rate != 48000:
-                data = b''.join(frames)
-                converted = audioop.ratecv(data, 2, 1, 48000, sample_rate, None)
-                wf.writeframes(converted[0])
-            wf.close()
+            self._liveview.record_audio(save_file, seconds, sample_rate)
         except Exception as e:
             logger.error("Camera: record_audio, exception {0}".format(e))
             return False
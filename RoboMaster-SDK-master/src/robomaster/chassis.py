@@ -15,13 +15,14 @@
 
 
 import struct
-import threading
+import numpy
 from . import module
 from . import protocol
 from . import action
 from . import logger
 from . import dds
 from . import util
+from . import scheduler
 
 
 __all__ = ['Chassis', 'ChassisMoveAction']
@@ -84,6 +85,10 @@ class PositionSubject(dds.Subject):
     name = dds.DDS_POSITION
     uid = dds.SUB_UID_MAP[name]
     type = dds.DDS_SUB_TYPE_PERIOD
+    # 批量解析不做 cs=0 的原点偏移
+    _batch_dtype = numpy.dtype([('x', '<f4'), ('y', '<f4'), ('z', '<f4')])
+    _batch_checkers = {'x': util.CHASSIS_POS_X_SUB_CHECKER, 'y': util.CHASSIS_POS_Y_SUB_CHECKER,
+                       'z': util.CHASSIS_POS_Z_SUB_CHECKER}
 
     def __init__(self, cs):
         self._position_x = 0
@@ -122,6 +127,9 @@ class AttiInfoSubject(dds.Subject):
     name = dds.DDS_ATTITUDE
     uid = dds.SUB_UID_MAP[name]
     type = dds.DDS_SUB_TYPE_PERIOD
+    _batch_dtype = numpy.dtype([('yaw', '<f4'), ('pitch', '<f4'), ('roll', '<f4')])
+    _batch_checkers = {'yaw': util.CHASSIS_YAW_CHECKER, 'pitch': util.CHASSIS_PITCH_CHECKER,
+                       'roll': util.CHASSIS_ROLL_CHECKER}
 
     def __init__(self):
         self._yaw = 0
@@ -186,6 +194,11 @@ class SbusSubject(dds.Subject):
 class VelocitySubject(dds.Subject):
     name = dds.DDS_VELOCITY
     uid = dds.SUB_UID_MAP[name]
+    _batch_dtype = numpy.dtype([('vgx', '<f4'), ('vgy', '<f4'), ('vgz', '<f4'),
+                                ('vbx', '<f4'), ('vby', '<f4'), ('vbz', '<f4')])
+    _batch_checkers = {'vgx': util.CHASSIS_SPD_X_CHECKER, 'vgy': util.CHASSIS_SPD_Y_CHECKER,
+                       'vgz': util.CHASSIS_SPD_Z_CHECKER, 'vbx': util.CHASSIS_SPD_X_CHECKER,
+                       'vby': util.CHASSIS_SPD_Y_CHECKER, 'vbz': util.CHASSIS_SPD_Z_CHECKER}
 
     def __init__(self):
         self._vgx = 0
@@ -216,6 +229,8 @@ class EscSubject(dds.Subject):
     name = dds.DDS_ESC
     uid = dds.SUB_UID_MAP[name]
     type = dds.DDS_SUB_TYPE_PERIOD
+    _batch_dtype = numpy.dtype([('speed', '<i2', (4,)), ('angle', '<i2', (4,)), ('timestamp', '<u4', (4,)),
+                                ('state', 'u1', (4,))])
 
     def __init__(self):
         self._speed = [0]*4
@@ -241,6 +256,11 @@ class ImuSubject(dds.Subject):
     name = dds.DDS_IMU
     uid = dds.SUB_UID_MAP[name]
     type = dds.DDS_SUB_TYPE_PERIOD
+    _batch_dtype = numpy.dtype([('acc_x', '<f4'), ('acc_y', '<f4'), ('acc_z', '<f4'),
+                                ('gyro_x', '<f4'), ('gyro_y', '<f4'), ('gyro_z', '<f4')])
+    _batch_checkers = {'acc_x': util.CHASSIS_ACC_CHECKER, 'acc_y': util.CHASSIS_ACC_CHECKER,
+                       'acc_z': util.CHASSIS_ACC_CHECKER, 'gyro_x': util.CHASSIS_GYRO_CHECKER,
+                       'gyro_y': util.CHASSIS_GYRO_CHECKER, 'gyro_z': util.CHASSIS_GYRO_CHECKER}
 
     def __init__(self):
         self._acc_x = 0
@@ -337,8 +357,8 @@ class Chassis(module.Module):
 
     def stop(self):
         if self._auto_timer:
-            if self._auto_timer.is_alive():
-                self._auto_timer.cancel()
+            self._auto_timer.cancel()
+            self._auto_timer = None
         super().stop()
 
     def _set_mode(self, mode):
@@ -375,10 +395,10 @@ class Chassis(module.Module):
         proto._w4_spd = util.WHEEL_SPD_CHECKER.val2proto(w4)
         if timeout:
             if self._auto_timer:
-                if self._auto_timer.is_alive():
-                    self._auto_timer.cancel()
-            self._auto_timer = threading.Timer(timeout, self._auto_stop_timer, args=("drive_wheels",))
-            self._auto_timer.start()
+                self._auto_timer.cancel()
+            # 自动停止会同步发送命令，交给调度器的工作线程执行，避免阻塞心跳
+            self._auto_timer = scheduler.get_scheduler().call_later(timeout, self._auto_stop_timer, "drive_wheels",
+                                                                    blocking=True)
             return self._send_sync_proto(proto)
         return self._send_sync_proto(proto)
 
@@ -407,10 +427,10 @@ class Chassis(module.Module):
         logger.info("x_spd:{0:f}, y_spd:{1:f}, z_spd:{2:f}".format(proto._x_spd, proto._y_spd, proto._z_spd))
         if timeout:
             if self._auto_timer:
-                if self._auto_timer.is_alive():
-                    self._auto_timer.cancel()
-            self._auto_timer = threading.Timer(timeout, self._auto_stop_timer, args=("drive_speed",))
-            self._auto_timer.start()
+                self._auto_timer.cancel()
+            # 自动停止会同步发送命令，交给调度器的工作线程执行，避免阻塞心跳
+            self._auto_timer = scheduler.get_scheduler().call_later(timeout, self._auto_stop_timer, "drive_speed",
+                                                                    blocking=True)
             return self._send_sync_proto(proto)
         return self._send_sync_proto(proto)
 
@@ -16,6 +16,7 @@
 
 import threading
 import binascii
+import collections
 from . import conn
 from . import protocol
 from . import logger
@@ -30,6 +31,7 @@ class EventIdentify(object):
     def __init__(self):
         self._valid = False
         self._ident = None
+        self._msg = None
         self._event = threading.Event()
 
 
@@ -77,9 +79,11 @@ class Client(object):
 
         self._handler_dict = {}
 
+        # ack ident -> EventIdentify of the send_sync_msg waiting for it.
         self._wait_ack_list = {}
         self._wait_ack_mutex = threading.Lock()
-        self._event_list = []
+        # idle EventIdentify pool, grows on demand when more calls are in flight.
+        self._event_list = collections.deque()
 
         self._thread = None
         self._running = False
@@ -105,8 +109,7 @@ class Client(object):
             logger.warning("Client: initialize, no connections, init connections first.")
             return False
         for i in range(0, CLIENT_MAX_EVENT_NUM):
-            ident = EventIdentify()
-            self._event_list.append(ident)
+            self._event_list.append(EventIdentify())
 
         try:
             self._conn.create()
@@ -159,30 +162,25 @@ class Client(object):
                 return None
             self.send_msg(msg)
             evt._event.wait(timeout)
-            if not evt._event.isSet():
+            resp_msg = self._ack_unregister_identify(evt)
+            if resp_msg is None:
                 logger.error("Client: send_sync_msg wait msg receiver:{0}, cmdset:0x{1:02x}, cmdid:0x{2:02x} \
 timeout!".format(msg.receiver, msg.cmdset, msg.cmdid))
-                evt._valid = False
                 return None
-            resp_msg = self._ack_unregister_identify(evt._ident)
-            evt._valid = False
-            if resp_msg is None:
-                logger.error("Client, send_sync_msg, get resp msg failed.")
-            else:
-                if isinstance(resp_msg, protocol.Msg):
-                    try:
-                        resp_msg.unpack_protocol()
-                        if callback:
-                            callback(resp_msg)
-                    except Exception as e:
-                        self._unpack_failed += 1
-                        logger.warning("Client: send_sync_msg, resp_msg {0:d} cmdset:0x{1:02x}, cmdid:0x{2:02x}, "
-                                       "e {3}".format(self._has_sent, resp_msg.cmdset, resp_msg.cmdid, format(e)))
-                        return None
-                else:
-                    logger.warning("Client: send_sync_msg, has_sent:{0} resp_msg:{1}.".format(
-                        self._has_sent, resp_msg))
+            if isinstance(resp_msg, protocol.Msg):
+                try:
+                    resp_msg.unpack_protocol()
+                    if callback:
+                        callback(resp_msg)
+                except Exception as e:
+                    self._unpack_failed += 1
+                    logger.warning("Client: send_sync_msg, resp_msg {0:d} cmdset:0x{1:02x}, cmdid:0x{2:02x}, "
+                                   "e {3}".format(self._has_sent, resp_msg.cmdset, resp_msg.cmdid, format(e)))
                     return None
+            else:
+                logger.warning("Client: send_sync_msg, has_sent:{0} resp_msg:{1}.".format(
+                    self._has_sent, resp_msg))
+                return None
 
             return resp_msg
         else:
@@ -232,19 +230,12 @@ timeout!".format(msg.receiver, msg.cmdset, msg.cmdid))
 
     def _dispatch_to_send_sync(self, msg):
         if msg.is_ack:
-            logger.debug("Client: dispatch_to_send_sync, {0} cmdset:{1} cmdid:{2}".format(
-                self._has_recv, hex(msg._cmdset), hex(msg._cmdid)))
             ident = self._make_ack_identify(msg)
-            self._wait_ack_mutex.acquire()
-            if ident in self._wait_ack_list.keys():
-                for i, evt in enumerate(self._event_list):
-                    if evt._ident == ident and evt._valid:
-                        self._wait_ack_list[ident] = msg
-                        evt._event.set()
-            else:
-                logger.debug("Client: dispatch_to_send_sync, ident:{0} is not in wait_ack_list {1}".format(
-                    ident, self._wait_ack_list))
-            self._wait_ack_mutex.release()
+            with self._wait_ack_mutex:
+                evt = self._wait_ack_list.get(ident)
+                if evt is not None:
+                    evt._msg = msg
+                    evt._event.set()
 
     def _dispatch_to_callback(self, msg):
         if msg._is_ack:
@@ -265,39 +256,41 @@ handler".format(msg.cmdset, msg.cmdid))
     @staticmethod
     def _make_ack_identify(msg):
         if msg.is_ack:
-            return str(msg._sender) + str(hex(msg.cmdset)) + str(hex(msg.cmdid)) + str(msg._seq_id)
+            return msg._sender, msg._cmdset, msg._cmdid, msg._seq_id
         else:
-            return str(msg._receiver) + str(hex(msg.cmdset)) + str(hex(msg.cmdid)) + str(msg._seq_id)
+            return msg._receiver, msg._cmdset, msg._cmdid, msg._seq_id
 
     def _ack_register_identify(self, msg):
-        self._wait_ack_mutex.acquire()
         ident = self._make_ack_identify(msg)
-        self._wait_ack_list[ident] = 1
-        self._wait_ack_mutex.release()
-        evt = None
-
-        for i, evt_ident in enumerate(self._event_list):
-            if not evt_ident._valid:
-                evt = evt_ident
-                break
-        if evt is None:
-            logger.error("Client: event list is run out.")
-            return None
-        evt._valid = True
-        evt._ident = ident
-        evt._event.clear()
+        with self._wait_ack_mutex:
+            if ident in self._wait_ack_list:
+                logger.error("Client: ack ident {0} is already waited.".format(ident))
+                return None
+            if self._event_list:
+                evt = self._event_list.pop()
+            else:
+                evt = EventIdentify()
+            evt._valid = True
+            evt._ident = ident
+            evt._msg = None
+            evt._event.clear()
+            self._wait_ack_list[ident] = evt
         return evt
 
-    def _ack_unregister_identify(self, identify):
-        try:
-            self._wait_ack_mutex.acquire()
-            if identify in self._wait_ack_list.keys():
-                return self._wait_ack_list.pop(identify)
-            else:
-                logger.warning("can not find ident:{0} in wait_ack_list.".format(identify))
-                return None
-        finally:
-            self._wait_ack_mutex.release()
+    def _ack_unregister_identify(self, evt):
+        """ 注销等待，并把 EventIdentify 放回空闲池
+
+        :param evt: _ack_register_identify 返回的 EventIdentify
+        :return: 收到的 ack 消息，超时未收到返回 None
+        """
+        with self._wait_ack_mutex:
+            self._wait_ack_list.pop(evt._ident, None)
+            resp_msg = evt._msg
+            evt._valid = False
+            evt._ident = None
+            evt._msg = None
+            self._event_list.append(evt)
+        return resp_msg
 
     def add_msg_handler(self, handler):
         key = handler.dict_key()
@@ -16,12 +16,15 @@
 
 import socket
 import binascii
+import collections
 import traceback
 import threading
 import queue
 import random
 import time
 import base64
+import ipaddress
+import selectors
 from ftplib import FTP
 from . import algo
 from . import protocol
@@ -35,6 +38,28 @@ CONNECTION_WIFI_STA = 'sta'
 CONNECTION_PROTO_TCP = 'tcp'
 CONNECTION_PROTO_UDP = 'udp'
 
+TELLO_SDK_PORT = 8889
+# 每批发送的探测包数量及批次间隔，限制扫描时的发包速率
+TELLO_SCAN_BATCH = 32
+TELLO_SCAN_INTERVAL = 0.02
+# 未应答地址的重新探测间隔，以及已应答地址重新查询 sn 的间隔
+TELLO_SCAN_RETRY_INTERVAL = 1.0
+TELLO_SCAN_TIMEOUT = 10.0
+
+# 视频流接收缓冲区大小，按 access unit 切分后放入队列
+STREAM_RECV_BUF_SIZE = 1 << 21
+# 单次 recv 至少预留的空间，不小于 UDP 最大报文长度
+STREAM_RECV_MIN_SPACE = 1 << 16
+STREAM_CHUNK_QUEUE_SIZE = 32
+STREAM_AU_QUEUE_SIZE = 32
+
+H264_NAL_SLICE = 1
+H264_NAL_IDR = 5
+H264_NAL_SEI = 6
+H264_NAL_SPS = 7
+H264_NAL_PPS = 8
+H264_NAL_AUD = 9
+
 __all__ = ['Connection']
 
 
@@ -141,10 +166,117 @@ def scan_robot_ip_list(timeout=3.0):
     return ip_list
 
 
+def _interleave_hosts(subnets, exclude):
+    """ 各子网的地址交替排列，使每一批探测覆盖所有子网 """
+    hosts_lists = []
+    for subnet, netmask in subnets:
+        network = ipaddress.ip_network("{0}/{1}".format(subnet, netmask), strict=False)
+        hosts_lists.append([str(ip) for ip in network.hosts() if str(ip) not in exclude])
+    hosts = []
+    for i in range(max([len(hosts_list) for hosts_list in hosts_lists] or [0])):
+        for hosts_list in hosts_lists:
+            if i < len(hosts_list):
+                hosts.append(hosts_list[i])
+    return hosts
+
+
+def _send_probe(sock, data, addr):
+    try:
+        sock.sendto(data, addr)
+    except OSError as e:
+        logger.debug("scan_tello_hosts: sendto {0}, exception {1}".format(addr, e))
+
+
+def scan_tello_hosts(sock, subnets, exclude=(), num=1, timeout=TELLO_SCAN_TIMEOUT, port=TELLO_SDK_PORT):
+    """ 扫描子网内的 Tello
+
+    分批向各子网的地址发送 command 探测包，应答 ok 的地址再查询 sn，按 sn 去重，找到 num 台或超时后返回
+
+    :param sock: 已绑定本地地址的 UDP socket，扫描期间由本函数独占接收
+    :param subnets: list，[(network, netmask), ...]，需要扫描的子网
+    :param exclude: 不需要探测的地址，如本机地址
+    :param num: 需要找到的 Tello 数量
+    :param timeout: 超时时间，单位秒
+    :param port: Tello 的 SDK 端口
+    :return: list，[(ip, port), ...] 按发现顺序排列
+    """
+    hosts = _interleave_hosts(subnets, set(exclude))
+    found = collections.OrderedDict()  # key sn, value (ip, port)
+    acked = {}  # 已应答 ok 但还未得到 sn 的地址，key ip, value 上次查询 sn 的时间
+    done = set()  # 已得到 sn 的地址
+    index = len(hosts)
+    pass_start = None
+    deadline = time.time() + timeout
+    sel = selectors.DefaultSelector()
+    sel.register(sock, selectors.EVENT_READ)
+    try:
+        while len(found) < num:
+            now = time.time()
+            if now >= deadline:
+                logger.warning("scan_tello_hosts: timeout, found {0} of {1} Tello".format(len(found), num))
+                break
+            # 一轮探测结束后，间隔 TELLO_SCAN_RETRY_INTERVAL 再探测未应答的地址
+            if index >= len(hosts) and (pass_start is None or now - pass_start >= TELLO_SCAN_RETRY_INTERVAL):
+                index = 0
+                pass_start = now
+            if index < len(hosts):
+                for ip in hosts[index:index + TELLO_SCAN_BATCH]:
+                    if ip not in acked and ip not in done:
+                        _send_probe(sock, b'command', (ip, port))
+                index += TELLO_SCAN_BATCH
+                wait_until = now + TELLO_SCAN_INTERVAL
+            else:
+                wait_until = pass_start + TELLO_SCAN_RETRY_INTERVAL
+            for ip, sent_time in acked.items():
+                if now - sent_time >= TELLO_SCAN_RETRY_INTERVAL:
+                    _send_probe(sock, b'sn?', (ip, port))
+                    acked[ip] = now
+            wait_until = min(wait_until, deadline)
+
+            while len(found) < num:
+                events = sel.select(max(0, wait_until - time.time()))
+                if not events:
+                    break
+                try:
+                    data, addr = sock.recvfrom(1024)
+                except OSError as e:
+                    logger.warning("scan_tello_hosts: recvfrom, exception {0}".format(e))
+                    break
+                ip = addr[0]
+                text = data.decode('utf-8', 'ignore').strip()
+                if ip in done:
+                    continue
+                if text.lower() == 'ok':
+                    if ip not in acked:
+                        logger.info("scan_tello_hosts: Tello replied from ip {0}".format(ip))
+                        _send_probe(sock, b'sn?', (ip, port))
+                        acked[ip] = time.time()
+                elif ip in acked and text and not text.startswith('error'):
+                    del acked[ip]
+                    done.add(ip)
+                    if text in found:
+                        logger.info("scan_tello_hosts: Tello sn {0} at ip {1} is already found at {2}".format(
+                            text, ip, found[text][0]))
+                        continue
+                    found[text] = (ip, port)
+                    logger.info("scan_tello_hosts: found Tello sn {0}, ip {1}".format(text, ip))
+    finally:
+        sel.close()
+
+    # 应答了 command 但没有应答 sn 的 Tello 以 ip 去重
+    for ip in acked:
+        if len(found) >= num:
+            break
+        found[ip] = (ip, port)
+    return list(found.values())
+
+
 class BaseConnection(object):
     def __init__(self):
         self._sock = None
         self._buf = bytearray()
+        self._decoder = protocol.MsgDecoder()
+        self._msgs = collections.deque()
         self._host_addr = None
         self._target_addr = None
         self._proto_type = None
@@ -160,6 +292,8 @@ class BaseConnection(object):
             elif self._proto_type == CONNECTION_PROTO_UDP:
                 self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
                 self._sock.bind(self._host_addr)
+                # 端口为 0 时由系统分配，记录实际地址供 send_self 使用
+                self._host_addr = self._sock.getsockname()
                 logger.info("UdpConnection, bind {0}".format(self._host_addr))
             else:
                 logger.error("Connection: {0} unexpected connection param set".format(self._proto_type))
@@ -172,6 +306,8 @@ class BaseConnection(object):
             self._sock.close()
 
     def recv(self):
+        if self._msgs:
+            return self._unpack_msg(self._msgs.popleft())
         try:
             if self._sock:
                 data, host = self._sock.recvfrom(2048)
@@ -181,6 +317,15 @@ class BaseConnection(object):
         if data is None:
             logger.warning("Connection: recv buff None.")
             return None
+
+        if self._proto == "v1":
+            # one datagram may carry several frames, keep the rest for the following calls.
+            self._msgs.extend(self._decoder.feed(data))
+            if not self._msgs:
+                logger.warning("Connection: protocol.decode_msg is None.")
+                return None
+            return self._unpack_msg(self._msgs.popleft())
+
         self._buf.extend(data)
         if len(self._buf) == 0:
             logger.warning("Connection: recv buff None.")
@@ -191,10 +336,14 @@ class BaseConnection(object):
             logger.warning("Connection: protocol.decode_msg is None.")
             return None
         else:
-            if isinstance(msg, protocol.MsgBase):
-                if not msg.unpack_protocol():
-                    logger.warning("Connection: recv, msg.unpack_protocol failed, msg:{0}".format(msg))
-            return msg
+            return self._unpack_msg(msg)
+
+    @staticmethod
+    def _unpack_msg(msg):
+        if isinstance(msg, protocol.MsgBase):
+            if not msg.unpack_protocol():
+                logger.warning("Connection: recv, msg.unpack_protocol failed, msg:{0}".format(msg))
+        return msg
 
     def send(self, buf):
         try:
@@ -215,14 +364,13 @@ class BaseConnection(object):
 
 class Connection(BaseConnection):
     def __init__(self, host_addr, target_addr, proto="v1", protocol=CONNECTION_PROTO_UDP):
+        # 参数 protocol 与模块同名，解码器等成员由 BaseConnection 初始化
+        super().__init__()
         self._host_addr = host_addr
         self._target_addr = target_addr
         self._proto = proto
         self._proto_type = protocol
 
-        self._sock = None
-        self._buf = bytearray()
-
     def __repr__(self):
         return "Connection, host:{0}, target:{1}".format(self._host_addr, self._target_addr)
 
@@ -344,14 +492,137 @@ class SdkConnection(BaseConnection):
             return False, local_addr, remote_addr
 
 
+class H264AccessUnitSplitter(object):
+    """ 将 H.264 Annex B 字节流按 access unit 切分
+
+    数据直接接收到预分配的缓冲区中，按起始码查找 NAL 边界，每个完整的 access unit 只拷贝一次
+    """
+
+    def __init__(self, size=STREAM_RECV_BUF_SIZE):
+        self._buf = bytearray(size)
+        self._view = memoryview(self._buf)
+        self._start = 0
+        self._scan = 0
+        self._end = 0
+        self._reset_au()
+
+    def _reset_au(self):
+        self._au_vcl = False
+        self._au_idr = False
+        self._au_ref = False
+
+    def recv_from(self, sock):
+        """ 从 socket 接收一次数据
+
+        :return: tuple: (nbytes, [(au, is_idr, is_ref), ...])，nbytes 为 0 表示连接已关闭
+        """
+        self._reserve(STREAM_RECV_MIN_SPACE)
+        nbytes = sock.recv_into(self._view[self._end:])
+        self._end += nbytes
+        return nbytes, self._split()
+
+    def feed(self, data):
+        """ 写入一段数据，返回其中已完整的 access unit 列表 """
+        self._reserve(len(data))
+        self._view[self._end:self._end + len(data)] = data
+        self._end += len(data)
+        return self._split()
+
+    def _reserve(self, space):
+        if len(self._buf) - self._end >= space:
+            return
+        # 当前未完成的 access unit 移到缓冲区头部，仍不够时扩大缓冲区
+        pending = self._end - self._start
+        if pending + space > len(self._buf):
+            buf = bytearray(max(len(self._buf) * 2, pending + space))
+            buf[:pending] = self._view[self._start:self._end]
+            self._view.release()
+            self._buf = buf
+            self._view = memoryview(buf)
+        else:
+            self._view[:pending] = self._view[self._start:self._end]
+        self._scan -= self._start
+        self._end = pending
+        self._start = 0
+
+    def _split(self):
+        aus = []
+        buf = self._buf
+        end = self._end
+        while True:
+            pos = buf.find(b'\x00\x00\x01', self._scan, end)
+            # 需要 NAL 头及其后一个字节判断 slice 是否为一帧的开始
+            if pos < 0 or pos + 4 >= end:
+                if pos < 0:
+                    self._scan = max(self._start, end - 2)
+                else:
+                    self._scan = pos
+                break
+            header = buf[pos + 3]
+            nal_type = header & 0x1f
+            is_vcl = nal_type in (H264_NAL_SLICE, H264_NAL_IDR)
+            if self._au_vcl:
+                # first_mb_in_slice 为 0 时 ue(v) 编码的第一个比特为 1
+                if nal_type in (H264_NAL_SEI, H264_NAL_SPS, H264_NAL_PPS, H264_NAL_AUD) or \
+                        (is_vcl and buf[pos + 4] & 0x80):
+                    nal_start = pos - 1 if pos > self._start and buf[pos - 1] == 0 else pos
+                    aus.append((bytes(self._view[self._start:nal_start]), self._au_idr, self._au_ref))
+                    self._start = nal_start
+                    self._reset_au()
+            if is_vcl:
+                self._au_vcl = True
+                self._au_idr = self._au_idr or nal_type == H264_NAL_IDR
+                self._au_ref = self._au_ref or (header & 0x60) != 0
+            self._scan = pos + 3
+        return aus
+
+
 class StreamConnection(object):
 
-    def __init__(self):
+    def __init__(self, h264=False):
+        """ 音视频流连接
+
+        :param h264: bool: 数据为 H.264 码流，按 access unit 切分，队列满时整帧丢弃，不会破坏码流
+        """
         self._sock = None
-        self._sock_queue = queue.Queue(32)
+        self._h264 = h264
+        self._sock_queue = queue.Queue(STREAM_AU_QUEUE_SIZE if h264 else STREAM_CHUNK_QUEUE_SIZE)
         self._sock_recv = None
         self._recv_count = 0
         self._receiving = False
+        self._drop_until_idr = False
+        self._stats_mutex = threading.Lock()
+        self._reset_stats()
+
+    def _reset_stats(self):
+        with self._stats_mutex:
+            self._recv_bytes = 0
+            self._dropped = 0
+            self._rate = 0
+            self._rate_bytes = 0
+            self._rate_time = time.time()
+
+    @property
+    def stats(self):
+        """ 接收统计
+
+        :return: dict: bytes 已接收字节数，bytes_per_sec 最近的接收速率，queue_depth 队列中待读取的数据数，
+                 dropped 因队列满被丢弃的数据数，h264 模式下为 access unit 数
+        """
+        with self._stats_mutex:
+            return {"bytes": self._recv_bytes, "bytes_per_sec": self._rate, "queue_depth": self._sock_queue.qsize(),
+                    "dropped": self._dropped}
+
+    def _update_stats(self, nbytes, dropped=0):
+        with self._stats_mutex:
+            self._recv_bytes += nbytes
+            self._dropped += dropped
+            self._rate_bytes += nbytes
+            now = time.time()
+            if now - self._rate_time >= 1:
+                self._rate = self._rate_bytes / (now - self._rate_time)
+                self._rate_bytes = 0
+                self._rate_time = now
 
     def __del__(self):
         if self._sock:
@@ -373,21 +644,79 @@ class StreamConnection(object):
         except Exception as e:
             logger.error("StreamConnection: connect addr {0}, exception {1}".format(addr, e))
             return False
-        self._sock_recv = threading.Thread(target=self._recv_task)
+        self._reset_stats()
+        self._drop_until_idr = False
+        if self._h264:
+            self._sock_recv = threading.Thread(target=self._recv_h264_task)
+        else:
+            self._sock_recv = threading.Thread(target=self._recv_task)
         self._sock_recv.start()
         logger.info("StreamConnection {0} successfully!".format(addr))
         return True
 
     def disconnect(self):
         self._receiving = False
-        self._sock_queue.put(None)
         if self._sock_recv:
             self._sock_recv.join()
         self._sock.close()
         self._sock_queue.queue.clear()
+        # 唤醒等待中的读取方
+        self._sock_queue.put(None)
         self._recv_count = 0
         logger.info("StreamConnection: disconnected")
 
+    def _put_au(self, au, is_idr, is_ref):
+        """ access unit 放入队列，队列满时整帧丢弃：优先丢弃非参考帧，否则丢弃到下一个 IDR 帧为止 """
+        if self._drop_until_idr and not is_idr:
+            return 1
+        dropped = 0
+        if self._sock_queue.full():
+            if not is_idr:
+                if is_ref:
+                    self._drop_until_idr = True
+                return 1
+            # IDR 帧不依赖之前的帧，清空队列
+            while True:
+                try:
+                    self._sock_queue.get_nowait()
+                    dropped += 1
+                except queue.Empty:
+                    break
+        self._drop_until_idr = False
+        self._sock_queue.put_nowait(au)
+        return dropped
+
+    def _recv_h264_task(self):
+        self._receiving = True
+        splitter = H264AccessUnitSplitter()
+        logger.info("StreamConnection: _recv_h264_task, Start to receiving Data...")
+        while self._receiving:
+            try:
+                if self._sock is None:
+                    break
+                nbytes, aus = splitter.recv_from(self._sock)
+                if not self._receiving:
+                    break
+                if nbytes == 0 and self._sock.type == socket.SOCK_STREAM:
+                    logger.warning("StreamConnection: _recv_h264_task, connection closed by peer.")
+                    self._receiving = False
+                    break
+                dropped = 0
+                for au, is_idr, is_ref in aus:
+                    self._recv_count += 1
+                    dropped += self._put_au(au, is_idr, is_ref)
+                if dropped:
+                    logger.warning("StreamConnection: _recv_h264_task, queue is full, dropped {0} access units.".format(
+                        dropped))
+                self._update_stats(nbytes, dropped)
+            except socket.timeout:
+                logger.warning("StreamConnection: _recv_h264_task, recv data timeout!")
+                continue
+            except Exception as e:
+                logger.error("StreamConnection: recv, exceptions:{0}".format(e))
+                self._receiving = False
+                return
+
     def _recv_task(self):
         self._receiving = True
         logger.info("StreamConnection: _recv_task, Start to receiving Data...")
@@ -399,13 +728,17 @@ class StreamConnection(object):
                 if not self._receiving:
                     break
                 self._recv_count += 1
+                dropped = 0
                 if self._sock_queue.full():
                     logger.warning("StreamConnection: _recv_task, sock_data_queue is full.")
-                    self._sock_queue.get()
-                else:
-                    logger.debug("StreamConnection: _recv_task, recv {0}, len:{1}, data:{2}".format(
-                                  self._recv_count, len(data), data))
-                    self._sock_queue.put(data)
+                    try:
+                        self._sock_queue.get_nowait()
+                        dropped = 1
+                    except queue.Empty:
+                        pass
+                logger.debug("StreamConnection: _recv_task, recv {0}, len:{1}".format(self._recv_count, len(data)))
+                self._sock_queue.put_nowait(data)
+                self._update_stats(len(data), dropped)
             except socket.timeout:
                 logger.warning("StreamConnection: _recv_task， recv data timeout!")
                 continue
@@ -422,6 +755,26 @@ class StreamConnection(object):
             logger.warning("StreamConnection: read_buf, exception {0}".format(e))
             return None
 
+    def read_bufs(self, max_num=STREAM_AU_QUEUE_SIZE, timeout=2):
+        """ 等待至少一段数据，然后取出队列中已有的所有数据，便于解码器批量解码
+
+        :param max_num: int: 最多取出的段数
+        :return: list: 数据段，超时或连接断开时为空
+        """
+        buf = self.read_buf(timeout)
+        if buf is None:
+            return []
+        bufs = [buf]
+        while len(bufs) < max_num:
+            try:
+                buf = self._sock_queue.get_nowait()
+            except queue.Empty:
+                break
+            if buf is None:
+                break
+            bufs.append(buf)
+        return bufs
+
 
 class ConnectionHelper:
     def __init__(self):
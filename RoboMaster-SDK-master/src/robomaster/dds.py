@@ -14,10 +14,10 @@
 # limitations under the License.
 
 
-import time
 import collections
 import threading
-from queue import Queue
+import numpy
+from queue import Queue, Empty, Full
 from abc import abstractmethod
 from . import logger
 from . import module
@@ -55,8 +55,7 @@ DDS_TELLO_IMU = "tello_imu"
 DDS_TELLO_TOF = "tello_tof"
 DDS_TELLO_DRONE = "tello_drone"
 DDS_TELLO_ALL = "tello_all"
-IS_AI_FLAG = ";degree:"
-TELLO_DDS_TIME_MAX = 666
+IS_AI_FLAG = protocol.TelloDdsProto.DDS_AI_FLAG
 
 SUB_UID_MAP = {
     DDS_BATTERY: 0x000200096862229f,
@@ -82,6 +81,13 @@ SUB_UID_MAP = {
 DDS_SUB_TYPE_EVENT = 1
 DDS_SUB_TYPE_PERIOD = 0
 
+# 订阅数据投递策略
+DDS_DELIVERY_LATEST = "latest"
+DDS_DELIVERY_QUEUE = "queue"
+DDS_DELIVERY_ALL = "all"
+DDS_MSG_QUEUE_SIZE = 256
+DDS_BATCH_CAPACITY = 4096
+
 registered_subjects = {}
 dds_cmd_filter = {(0x48, 0x08)}
 
@@ -108,6 +114,9 @@ class Subject(metaclass=_AutoRegisterSubject):
     type = DDS_SUB_TYPE_PERIOD
     uid = 0
     freq = 1
+    # 批量解析用：推送数据的 numpy 结构化类型，以及需要换算单位的字段
+    _batch_dtype = None
+    _batch_checkers = {}
 
     def __init__(self):
         self._task = None
@@ -128,14 +137,145 @@ class Subject(metaclass=_AutoRegisterSubject):
     def data_info(self):
         return None
 
-    def exec(self):
-        self._callback(self.data_info(), *self._cb_args, **self._cb_kw)
+    def exec(self, info=None):
+        """ 执行订阅回调
+
+        :param info: 要投递的数据，默认为当前的 data_info()
+        """
+        if info is None:
+            info = self.data_info()
+        self._callback(info, *self._cb_args, **self._cb_kw)
+
+    @classmethod
+    def decode_batch(cls, data):
+        """ 批量解析多条推送数据
+
+        :param data: 按顺序拼接的原始推送数据，或 dtype 为 _batch_dtype 的 numpy 数组
+        :return: numpy 结构化数组，每行对应一条推送，换算单位的字段为 float64
+        """
+        if cls._batch_dtype is None:
+            raise ValueError("{0} does not support batch decoding".format(cls.__name__))
+        if isinstance(data, numpy.ndarray):
+            raw = data
+        else:
+            raw = numpy.frombuffer(data, dtype=cls._batch_dtype)
+        out_dtype = [(name, numpy.float64, cls._batch_dtype[name].shape) if name in cls._batch_checkers
+                     else (name, cls._batch_dtype[name]) for name in cls._batch_dtype.names]
+        out = numpy.empty(len(raw), dtype=out_dtype)
+        for name in cls._batch_dtype.names:
+            checker = cls._batch_checkers.get(name)
+            out[name] = checker.proto2array(raw[name]) if checker else raw[name]
+        return out
+
+    def set_delivery(self, policy, maxsize):
+        """ 设置投递策略并清空统计计数
+
+        :param policy: 投递策略，DDS_DELIVERY_LATEST/DDS_DELIVERY_QUEUE/DDS_DELIVERY_ALL
+        :param maxsize: 待投递数据的最大缓存条数
+        """
+        self._delivery = policy
+        self._maxsize = maxsize
+        if policy == DDS_DELIVERY_ALL:
+            self._pending = collections.deque()
+        else:
+            self._pending = collections.deque(maxlen=maxsize)
+        self._pending_mutex = threading.Lock()
+        self._scheduled = False
+        self._received = 0
+        self._delivered = 0
+        self._dropped = 0
+        # 在 Subscriber 的接收队列中就被丢弃的推送数，只由连接接收线程累加
+        self._queue_dropped = 0
+
+    @property
+    def delivery(self):
+        return self._delivery
+
+    @property
+    def received(self):
+        """ 已接收的推送数 """
+        return self._received + self._queue_dropped
+
+    @property
+    def delivered(self):
+        """ 已交给回调函数的推送数 """
+        return self._delivered
+
+    @property
+    def dropped(self):
+        """ 因缓存已满被丢弃的推送数，包括 Subscriber 接收队列已满时丢弃的该订阅的推送 """
+        return self._dropped + self._queue_dropped
 
 
 class SubHandler(collections.namedtuple("SubHandler", ("obj subject f"))):
     __slots__ = ()
 
 
+class SubjectRecorder(object):
+    """ 订阅数据记录器，将原始推送数据按固定长度存入预分配的环形缓冲区，需要时再批量解析 """
+
+    def __init__(self, subject_cls, capacity=DDS_BATCH_CAPACITY):
+        if subject_cls._batch_dtype is None:
+            raise ValueError("{0} does not support batch decoding".format(subject_cls.__name__))
+        self._subject_cls = subject_cls
+        self._itemsize = subject_cls._batch_dtype.itemsize
+        self._capacity = capacity
+        self._buf = bytearray(capacity * self._itemsize)
+        self._count = 0
+        self._invalid = 0
+        self._mutex = threading.Lock()
+
+    def __len__(self):
+        return min(self._count, self._capacity)
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @property
+    def overwritten(self):
+        """ 缓冲区写满后被覆盖的推送数 """
+        return max(0, self._count - self._capacity)
+
+    @property
+    def invalid(self):
+        """ 长度与 _batch_dtype 不符被忽略的推送数 """
+        return self._invalid
+
+    def append(self, data):
+        if len(data) != self._itemsize:
+            self._invalid += 1
+            return False
+        with self._mutex:
+            pos = (self._count % self._capacity) * self._itemsize
+            self._buf[pos:pos + self._itemsize] = data
+            self._count += 1
+        return True
+
+    def clear(self):
+        with self._mutex:
+            self._count = 0
+
+    def raw(self):
+        """ 按接收顺序返回已记录的原始数据副本
+
+        :return: dtype 为 _batch_dtype 的 numpy 数组
+        """
+        with self._mutex:
+            items = numpy.frombuffer(self._buf, dtype=self._subject_cls._batch_dtype)
+            if self._count <= self._capacity:
+                return items[:self._count].copy()
+            start = self._count % self._capacity
+            return numpy.concatenate((items[start:], items[:start]))
+
+    def decode(self):
+        """ 批量解析已记录的数据
+
+        :return: numpy 结构化数组，参见 Subject.decode_batch
+        """
+        return self._subject_cls.decode_batch(self.raw())
+
+
 class Subscriber(module.Module):
     _host = protocol.host2byte(9, 0)
     _sub_msg_id = SDK_FIRST_DDS_ID
@@ -146,7 +286,14 @@ class Subscriber(module.Module):
 
         self.msg_sub_dict = {}
         self._publisher = collections.defaultdict(list)
-        self._msg_queue = Queue()
+        # 分发索引，只在订阅变更时整体替换，分发线程读取时无需加锁
+        self._period_routes = {}
+        self._event_routes = {}
+        self._dds_mutex = threading.Lock()
+        self._msg_queue = Queue(DDS_MSG_QUEUE_SIZE)
+        self._msg_dropped = 0
+        self._delivery_policies = {}
+        self._recorders = {}
         self._dispatcher_running = False
         self._dispatcher_thread = None
         self.excutor = ThreadPoolExecutor(max_workers=15)
@@ -162,7 +309,6 @@ class Subscriber(module.Module):
         return self._sub_msg_id
 
     def start(self):
-        self._dds_mutex = threading.Lock()
         self._client.add_handler(self, "Subscriber", self._msg_recv)
         self._dispatcher_thread = threading.Thread(target=self._dispatch_task)
         self._dispatcher_thread.start()
@@ -177,9 +323,173 @@ class Subscriber(module.Module):
 
     @classmethod
     def _msg_recv(cls, self, msg):
-        for cmd_set, cmd_id in list(dds_cmd_filter):
-            if msg.cmdset == cmd_set and msg.cmdid == cmd_id:
-                self._msg_queue.put(msg)
+        if (msg.cmdset, msg.cmdid) in dds_cmd_filter:
+            # 运行在连接接收线程中，不能阻塞，队列满时丢弃最旧的消息
+            while True:
+                try:
+                    self._msg_queue.put_nowait(msg)
+                    return
+                except Full:
+                    try:
+                        dropped_msg = self._msg_queue.get_nowait()
+                        self._msg_dropped += 1
+                        self._charge_dropped(dropped_msg)
+                    except Empty:
+                        pass
+
+    def _charge_dropped(self, msg):
+        """ 接收队列丢弃的消息计入所属订阅的丢弃统计 """
+        if msg is None:
+            return
+        if msg.cmdset == 0x48 and msg.cmdid == 0x08:
+            proto = msg.get_proto()
+            handler = self._period_routes.get(proto._msg_id) if proto is not None else None
+            handlers = (handler,) if handler is not None else ()
+        else:
+            handlers = self._event_routes.get((msg.cmdset, msg.cmdid), ())
+        for handler in handlers:
+            handler.subject._queue_dropped += 1
+
+    def _update_routes(self):
+        """ 根据 _publisher 重建分发索引，调用方需持有 _dds_mutex """
+        period_routes = {}
+        event_routes = {}
+        for handler in self._publisher.values():
+            subject = handler.subject
+            if subject.type == DDS_SUB_TYPE_PERIOD:
+                period_routes[subject._subject_id] = handler
+            elif subject.type == DDS_SUB_TYPE_EVENT:
+                key = (subject.cmdset, subject.cmdid)
+                event_routes[key] = event_routes.get(key, ()) + (handler,)
+        self._period_routes = period_routes
+        self._event_routes = event_routes
+
+    @staticmethod
+    def _snapshot(info):
+        """ 拷贝 data_info 中的列表，多数订阅数据的 decode 原地修改这些列表，排队的数据不能随之改变 """
+        if isinstance(info, list):
+            return [Subscriber._snapshot(i) for i in info]
+        if isinstance(info, tuple):
+            return tuple(Subscriber._snapshot(i) for i in info)
+        return info
+
+    def _publish(self, subject, proto):
+        if subject._recorder is not None:
+            subject._recorder.append(proto._data_buf)
+            if subject._callback is None:
+                subject._received += 1
+                return
+        subject.decode(proto._data_buf)
+        subject._received += 1
+        info = self._snapshot(subject.data_info())
+        with subject._pending_mutex:
+            if subject._delivery == DDS_DELIVERY_ALL:
+                # 分发线程为所有订阅共用，不等待回调，缓存满时丢弃新的数据，已缓存的数据保持连续
+                if len(subject._pending) >= subject._maxsize:
+                    subject._dropped += 1
+                    return
+            elif len(subject._pending) == subject._pending.maxlen:
+                subject._dropped += 1
+            subject._pending.append(info)
+            if subject._scheduled:
+                return
+            subject._scheduled = True
+        subject._task = self.excutor.submit(self._deliver, subject)
+
+    @staticmethod
+    def _deliver(subject):
+        while True:
+            with subject._pending_mutex:
+                if not subject._pending:
+                    subject._scheduled = False
+                    return
+                info = subject._pending.popleft()
+            try:
+                subject.exec(info)
+            except Exception as e:
+                logger.warning("Subscriber: _deliver, {0} callback exception {1}".format(subject.name, e))
+            subject._delivered += 1
+
+    def _apply_delivery(self, subject):
+        policy, maxsize = self._delivery_policies.get(subject.name, (DDS_DELIVERY_LATEST, 1))
+        subject.set_delivery(policy, maxsize)
+        subject._recorder = self._recorders.get(subject.name)
+
+    def _cancel_delivery(self, subject):
+        with subject._pending_mutex:
+            subject._pending.clear()
+        if subject._task is not None and subject._task.done() is False:
+            subject._task.cancel()
+
+    def set_delivery_policy(self, subject_name, policy=DDS_DELIVERY_LATEST, maxsize=1):
+        """ 设置订阅数据的投递策略，在下次订阅该数据时生效
+
+        :param subject_name: 订阅数据名称，如 dds.DDS_IMU
+        :param policy: 投递策略：
+                       DDS_DELIVERY_LATEST 回调未完成时只保留最新一条数据；
+                       DDS_DELIVERY_QUEUE 最多缓存 maxsize 条数据，满时丢弃最旧的数据；
+                       DDS_DELIVERY_ALL 按顺序投递全部数据，缓存满时丢弃新到的数据，不会阻塞其他订阅的分发，
+                       需要设置足够大的 maxsize 容纳回调处理不及时期间的推送；
+                       丢弃的数据均计入该订阅 get_delivery_stats 的 dropped，包括 Subscriber 接收队列已满时丢弃的推送
+        :param maxsize: 缓存条数，DDS_DELIVERY_LATEST 策略固定为 1
+        :return: bool: 设置结果
+        """
+        if policy not in (DDS_DELIVERY_LATEST, DDS_DELIVERY_QUEUE, DDS_DELIVERY_ALL):
+            logger.error("Subscriber: set_delivery_policy, unsupported policy {0}".format(policy))
+            return False
+        if policy == DDS_DELIVERY_LATEST:
+            maxsize = 1
+        if maxsize < 1:
+            logger.error("Subscriber: set_delivery_policy, invalid maxsize {0}".format(maxsize))
+            return False
+        self._delivery_policies[subject_name] = (policy, maxsize)
+        return True
+
+    def add_batch_recorder(self, subject_cls, capacity=DDS_BATCH_CAPACITY):
+        """ 为订阅数据添加记录器，原始推送数据存入环形缓冲区，由调用方批量解析
+
+        订阅时回调函数为 None 则只记录，不再逐条解析
+
+        :param subject_cls: 订阅数据类型，需定义 _batch_dtype，如 chassis.ImuSubject
+        :param capacity: 最多保存的推送条数
+        :return: SubjectRecorder: 记录器对象
+        """
+        recorder = SubjectRecorder(subject_cls, capacity)
+        self._recorders[subject_cls.name] = recorder
+        handler = self._publisher.get(subject_cls.name)
+        if handler:
+            handler.subject._recorder = recorder
+        return recorder
+
+    def del_batch_recorder(self, subject_name):
+        """ 删除订阅数据记录器
+
+        :param subject_name: 订阅数据名称
+        :return: SubjectRecorder: 被删除的记录器，不存在时返回 None
+        """
+        recorder = self._recorders.pop(subject_name, None)
+        handler = self._publisher.get(subject_name)
+        if handler:
+            handler.subject._recorder = None
+        return recorder
+
+    def get_delivery_stats(self, subject_name):
+        """ 获取订阅数据的投递统计
+
+        :param subject_name: 订阅数据名称
+        :return: dict: {'policy', 'received', 'delivered', 'dropped', 'pending'}，未订阅时返回 None
+        """
+        handler = self._publisher.get(subject_name)
+        if not handler:
+            return None
+        subject = handler.subject
+        return {'policy': subject.delivery, 'received': subject.received, 'delivered': subject.delivered,
+                'dropped': subject.dropped, 'pending': len(subject._pending)}
+
+    @property
+    def dropped(self):
+        """ 接收队列已满时丢弃的推送消息数 """
+        return self._msg_dropped
 
     def _dispatch_task(self):
         self._dispatcher_running = True
@@ -190,32 +500,24 @@ class Subscriber(module.Module):
                 if not self._dispatcher_running:
                     break
                 continue
-            self._dds_mutex.acquire()
-            for name in self._publisher:
-                handler = self._publisher[name]
-                logger.debug("Subscriber: msg: {0}".format(msg))
+            logger.debug("Subscriber: msg: {0}".format(msg))
+            if msg.cmdset == 0x48 and msg.cmdid == 0x08:
                 proto = msg.get_proto()
                 if proto is None:
                     logger.warning("Subscriber: _publish, msg.get_proto None, msg:{0}".format(msg))
                     continue
-                if handler.subject.type == DDS_SUB_TYPE_PERIOD and\
-                        msg.cmdset == 0x48 and msg.cmdid == 0x08:
-                    logger.debug("Subscriber: _publish: msg_id:{0}, subject_id:{1}".format(proto._msg_id,
-                                                                                           handler.subject._subject_id))
-                    if proto._msg_id == handler.subject._subject_id:
-                        handler.subject.decode(proto._data_buf)
-                        if handler.subject._task is None:
-                            handler.subject._task = self.excutor.submit(handler.subject.exec)
-                        if handler.subject._task.done() is True:
-                            handler.subject._task = self.excutor.submit(handler.subject.exec)
-                elif handler.subject.type == DDS_SUB_TYPE_EVENT:
-                    if handler.subject.cmdset == msg.cmdset and handler.subject.cmdid == msg.cmdid:
-                        handler.subject.decode(proto._data_buf)
-                        if handler.subject._task is None:
-                            handler.subject._task = self.excutor.submit(handler.subject.exec)
-                        if handler.subject._task.done() is True:
-                            handler.subject._task = self.excutor.submit(handler.subject.exec)
-            self._dds_mutex.release()
+                handler = self._period_routes.get(proto._msg_id)
+                if handler is not None:
+                    self._publish(handler.subject, proto)
+            else:
+                handlers = self._event_routes.get((msg.cmdset, msg.cmdid))
+                if handlers:
+                    proto = msg.get_proto()
+                    if proto is None:
+                        logger.warning("Subscriber: _publish, msg.get_proto None, msg:{0}".format(msg))
+                        continue
+                    for handler in handlers:
+                        self._publish(handler.subject, proto)
             logger.info("Subscriber: _publish, msg is {0}".format(msg))
 
     def add_cmd_filter(self, cmd_set, cmd_id):
@@ -234,9 +536,10 @@ class Subscriber(module.Module):
         subject.set_callback(callback, args[0], args[1])
         handler = SubHandler(self, subject, callback)
         subject._task = None
-        self._dds_mutex.acquire()
-        self._publisher[subject.name] = handler
-        self._dds_mutex.release()
+        self._apply_delivery(subject)
+        with self._dds_mutex:
+            self._publisher[subject.name] = handler
+            self._update_routes()
         self.add_cmd_filter(subject.cmdset, subject.cmdid)
         return True
 
@@ -248,10 +551,10 @@ class Subscriber(module.Module):
         :return: bool: 调用结果
         """
         # 删除事件订阅仅从 Filter 中删除
-        if self._publisher[subject.name].subject._task is None:
-            pass
-        elif self._publisher[subject.name].subject._task.done() is False:
-            self._publisher[subject.name].subject._task.cancel()
+        self._cancel_delivery(self._publisher[subject.name].subject)
+        with self._dds_mutex:
+            del self._publisher[subject.name]
+            self._update_routes()
         self.del_cmd_filter(subject.cmdset, subject.cmdid)
         return True
 
@@ -265,9 +568,6 @@ class Subscriber(module.Module):
         # add handler to publisher.
         subject.set_callback(callback, args[0], args[1])
         handler = SubHandler(self, subject, callback)
-        self._dds_mutex.acquire()
-        self._publisher[subject.name] = handler
-        self._dds_mutex.release()
         proto = protocol.ProtoAddSubMsg()
         proto._node_id = self.client.hostbyte
         proto._sub_freq = subject.freq
@@ -275,7 +575,11 @@ class Subscriber(module.Module):
         proto._msg_id = self.get_next_subject_id()
         subject._subject_id = proto._msg_id
         subject._task = None
+        self._apply_delivery(subject)
         proto._sub_uid_list.append(subject.uid)
+        with self._dds_mutex:
+            self._publisher[subject.name] = handler
+            self._update_routes()
         return self._send_sync_proto(proto, protocol.host2byte(9, 0))
 
     def del_subject_info(self, subject_name):
@@ -288,11 +592,10 @@ class Subscriber(module.Module):
                      self._publisher))
         if subject_name in self._publisher:
             subject_id = self._publisher[subject_name].subject._subject_id
-            if self._publisher[subject_name].subject._task.done() is False:
-                self._publisher[subject_name].subject._task.cancel()
-            self._dds_mutex.acquire()
-            del self._publisher[subject_name]
-            self._dds_mutex.release()
+            self._cancel_delivery(self._publisher[subject_name].subject)
+            with self._dds_mutex:
+                del self._publisher[subject_name]
+                self._update_routes()
             proto = protocol.ProtoDelMsg()
             proto._msg_id = subject_id
             proto._node_id = self.client.hostbyte
@@ -310,6 +613,8 @@ class TelloSubscriber(object):
         self._dispatcher_thread = None
         self._client = self._robot.client
         self._msg = None
+        self._msg_seq = 0
+        self._msg_cond = threading.Condition()
         self._freq = protocol.TelloDdsProto.DDS_FREQ
 
     def __del__(self):
@@ -317,11 +622,14 @@ class TelloSubscriber(object):
 
     def start(self):
         self._client.add_handler(self, "TelloSubscriber", self._msg_recv)
+        self._dispatcher_running = True
         self._dispatcher_thread = threading.Thread(target=self._dispatch_task)
         self._dispatcher_thread.start()
 
     def stop(self):
-        self._dispatcher_running = False
+        with self._msg_cond:
+            self._dispatcher_running = False
+            self._msg_cond.notify()
         if self._dispatcher_thread:
             self._dispatcher_thread.join()
             self._dispatcher_thread = None
@@ -332,35 +640,50 @@ class TelloSubscriber(object):
             '''
             此处判断两个标志位，满足任意一个进入条件
             '''
-            self._msg = msg
+            with self._msg_cond:
+                self._msg = msg
+                self._msg_seq += 1
+                self._msg_cond.notify()
 
     def _dispatch_task(self):
-        self._dispatcher_running = True
         logger.info("TelloSubscriber: dispatcher_task is running...")
-        interval = 1 / protocol.TelloDdsProto.DDS_FREQ
-        time_count = 0
-
-        while self._dispatcher_running:
-            msg = self._msg
-            if msg is None:
+        last_seq = 0
+        # key handler, value 下一次需要分发的推送序号
+        next_seq = {}
+        while True:
+            # 只在收到新的推送时唤醒，处理期间到达的多条推送只取最新的一条
+            with self._msg_cond:
+                while self._dispatcher_running and self._msg_seq == last_seq:
+                    self._msg_cond.wait()
                 if not self._dispatcher_running:
                     break
-                continue
+                msg = self._msg
+                last_seq = self._msg_seq
             proto = msg.get_proto()
             if proto is None:
                 logger.warning("TelloSubscirber: _publist, msg.get_proto None, msg: {0}".format(msg))
                 continue
-            for name in self._publisher:
-                handler = self._publisher[name]
-                need_time = protocol.TelloDdsProto.DDS_FREQ / handler.subject.freq
-                if time_count % need_time == 0:
-                    if handler.subject.decode(proto.resp):
-                        handler.subject.exec()
-            if time_count > TELLO_DDS_TIME_MAX:
-                time_count = 0
-            else:
-                time_count += 1
-            time.sleep(interval)
+            status = None
+            due_seq = {}
+            for handler in list(self._publisher.values()):
+                # 按推送序号分频，订阅频率为 freq 时每 DDS_FREQ / freq 条推送分发一次
+                # 推送被合并时序号会跳跃，到期后的第一条推送即分发，不会错过
+                due = next_seq.get(handler, last_seq)
+                if last_seq < due:
+                    due_seq[handler] = due
+                    continue
+                need_count = max(1, int(round(protocol.TelloDdsProto.DDS_FREQ / max(handler.subject.freq, 1))))
+                due += need_count
+                if due <= last_seq:
+                    due = last_seq + need_count
+                due_seq[handler] = due
+                # 每条推送只解析一次，所有订阅共用解析结果
+                if status is None:
+                    status = protocol.TelloStatus.parse(proto.resp)
+                if handler.subject.decode(status) and handler.subject._callback:
+                    handler.subject.exec()
+            # 只保留仍然订阅的 handler
+            next_seq = due_seq
 
     def add_subject_info(self, subject, callback=None, *args):
         """ 请求数据订阅底层接口
@@ -81,7 +81,6 @@ class TelloAttiInfoSubject(dds.Subject):
         self._yaw = 0
         self._pitch = 0
         self._roll = 0
-        self._info_num = 3
         self._freq = protocol.TelloDdsProto.DDS_FREQ
 
     def atti_info(self):
@@ -91,27 +90,14 @@ class TelloAttiInfoSubject(dds.Subject):
         return self._yaw, self._pitch, self._roll
 
     def decode(self, buf):
-        push_info = buf.split(';')
-        found_info_num = 0
-        for info in push_info:
-            if protocol.TelloDdsProto.DDS_YAW_FLAG in info:
-                yaw_info = info.split(':')[1]
-                self._yaw = int(yaw_info)
-                found_info_num += 1
-            elif protocol.TelloDdsProto.DDS_PITCH_FLAG in info:
-                pitch_info = info.split(':')[1]
-                self._pitch = int(pitch_info)
-                found_info_num += 1
-            elif protocol.TelloDdsProto.DDS_ROLL_FLAG in info:
-                roll_info = info.split(':')[1]
-                self._roll = int(roll_info)
-                found_info_num += 1
-        if found_info_num == self._info_num:
-            return True
-        else:
-            logger.warning("TelloAttiInfoSubject: decode, found_info_num {0} is not match self._info_num {1}".format(
-                found_info_num, self._info_num))
+        status = buf if isinstance(buf, protocol.TelloStatus) else protocol.TelloStatus.parse(buf)
+        if status.yaw is None or status.pitch is None or status.roll is None:
+            logger.warning("TelloAttiInfoSubject: decode, attitude not found in {0}".format(status))
             return False
+        self._yaw = int(status.yaw)
+        self._pitch = int(status.pitch)
+        self._roll = int(status.roll)
+        return True
 
     @property
     def freq(self):
@@ -133,7 +119,6 @@ class TelloImuInfoSubject(dds.Subject):
         self._agx = 0
         self._agy = 0
         self._agz = 0
-        self._info_num = 6
         self._freq = protocol.TelloDdsProto.DDS_FREQ
 
     def Imu_info(self):
@@ -143,40 +128,13 @@ class TelloImuInfoSubject(dds.Subject):
         return self._vgx, self._vgy, self._vgz, self._agx, self._agy, self._agz
 
     def decode(self, buf):
-        push_info = buf.split(';')
-        found_info_num = 0
-        for info in push_info:
-            if protocol.TelloDdsProto.DDS_VGX_FLAG in info:
-                vgx_str = info.split(':')[1]
-                self._vgx = float(vgx_str)
-                found_info_num += 1
-            elif protocol.TelloDdsProto.DDS_VGY_FLAG in info:
-                vgy_str = info.split(':')[1]
-                self._vgy = float(vgy_str)
-                found_info_num += 1
-            elif protocol.TelloDdsProto.DDS_VGZ_FLAG in info:
-                vgz_str = info.split(':')[1]
-                self._vgz = float(vgz_str)
-                found_info_num += 1
-            elif protocol.TelloDdsProto.DDS_AGX_FLAG in info:
-                agx_str = info.split(':')[1]
-                self._agx = float(agx_str)
-                found_info_num += 1
-            elif protocol.TelloDdsProto.DDS_AGY_FLAG in info:
-                agy_str = info.split(':')[1]
-                self._agy = float(agy_str)
-                found_info_num += 1
-            elif protocol.TelloDdsProto.DDS_AGZ_FLAG in info:
-                agz_str = info.split(':')[1]
-                self._agz = float(agz_str)
-                found_info_num += 1
-
-        if found_info_num == self._info_num:
-            return True
-        else:
-            logger.debug("TelloImuInfoSubject: decode, found_info_num {0} is not match self._info_num {1}".format(
-                found_info_num, self._info_num))
+        status = buf if isinstance(buf, protocol.TelloStatus) else protocol.TelloStatus.parse(buf)
+        values = (status.vgx, status.vgy, status.vgz, status.agx, status.agy, status.agz)
+        if None in values:
+            logger.debug("TelloImuInfoSubject: decode, imu info not found in {0}".format(status))
             return False
+        self._vgx, self._vgy, self._vgz, self._agx, self._agy, self._agz = values
+        return True
 
     @property
     def freq(self):
@@ -15,6 +15,7 @@
 
 
 import struct
+import numpy
 from . import module
 from . import protocol
 from . import action
@@ -132,6 +133,11 @@ class GimbalPosSubject(dds.Subject):
     name = dds.DDS_GIMBAL_POS
     uid = dds.SUB_UID_MAP[name]
     type = dds.DDS_SUB_TYPE_PERIOD
+    _batch_dtype = numpy.dtype([('yaw_ground_angle', '<i2'), ('pitch_ground_angle', '<i2'), ('yaw_angle', '<i2'),
+                                ('pitch_angle', '<i2'), ('res', 'u1')])
+    _batch_checkers = {'yaw_ground_angle': util.GIMBAL_ATTI_YAW_CHECKER,
+                       'pitch_ground_angle': util.GIMBAL_ATTI_PITCH_CHECKER,
+                       'yaw_angle': util.GIMBAL_ATTI_YAW_CHECKER, 'pitch_angle': util.GIMBAL_ATTI_PITCH_CHECKER}
 
     def __init__(self):
         self._yaw_angle = 0
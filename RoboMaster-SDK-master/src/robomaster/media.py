@@ -16,36 +16,149 @@
 
 from . import conn
 from . import logger
+from . import video_share
+from . import audio
 import threading
 import queue
-import libmedia_codec
 import numpy
 import cv2
 import time
 
+try:
+    # h264decoder 支持批量解码及直接输出 BGR 图像，构建时找到 libopus 才会同时提供 OpusDecoder
+    import h264decoder
+except ImportError:
+    h264decoder = None
+# 视频及音频分别选择解码器，只在 h264decoder 缺少对应解码器时使用 libmedia_codec
+if h264decoder is None:
+    import libmedia_codec
+elif not hasattr(h264decoder, "OpusDecoder"):
+    try:
+        import libmedia_codec
+    except ImportError:
+        # 视频可以正常解码，开启音频流时报错
+        libmedia_codec = None
+else:
+    libmedia_codec = None
+
+
+VIDEO_FRAME_QUEUE_SIZE = 64
+AUDIO_FRAME_QUEUE_SIZE = 32
+# 每次最多批量解码的数据段数
+DECODE_BATCH_SIZE = 16
+
+
+def _create_video_decoder():
+    if h264decoder:
+        return h264decoder.H264Decoder(pixel_format=h264decoder.PixelFormat.BGR24)
+    return libmedia_codec.H264Decoder()
+
+
+def _create_audio_decoder():
+    """ 没有可用的音频解码器时返回 None """
+    if hasattr(h264decoder, "OpusDecoder"):
+        return h264decoder.OpusDecoder()
+    if libmedia_codec:
+        return libmedia_codec.OpusDecoder()
+    logger.warning("LiveView: h264decoder is built without opus and libmedia_codec is not installed, "
+                   "audio stream is not available")
+    return None
+
+
+def _decode_many(decoder, bufs):
+    """ 批量解码，GIL 只释放一次；旧版 libmedia_codec 逐段解码 """
+    if hasattr(decoder, "decode_many"):
+        return decoder.decode_many(bufs)
+    frames = []
+    for buf in bufs:
+        frame = decoder.decode(buf)
+        if isinstance(frame, list):
+            frames.extend(frame)
+        else:
+            frames.append(frame)
+    return frames
+
+
+class _LatestFrame(object):
+    """ 只保存最新一帧的缓存，新的帧直接替换旧的帧，解码线程不会因读取方处理慢而阻塞 """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._item = None
+        self._seq = 0
+        self._consumed = True
+        self._closed = False
+
+    def put(self, item, seq):
+        """ 替换缓存的帧
+
+        :return: bool: 被替换的帧是否从未被读取过
+        """
+        with self._cond:
+            overwritten = not self._consumed
+            self._item = item
+            self._seq = seq
+            self._consumed = False
+            self._cond.notify_all()
+        return overwritten
+
+    def get(self, last_seq=0, timeout=None, consume=True):
+        """ 获取序号大于 last_seq 的最新一帧，超时或关闭时抛出 queue.Empty
+
+        :param consume: bool: 是否标记为已读取，为 False 时不影响丢帧统计
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq > last_seq or self._closed, timeout)
+            if self._seq <= last_seq:
+                raise queue.Empty
+            if consume:
+                self._consumed = True
+            return self._item
+
+    def open(self):
+        with self._cond:
+            self._item = None
+            self._seq = 0
+            self._consumed = True
+            self._closed = False
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
 
 class LiveView(object):
 
     def __init__(self, robot):
         self._robot = robot
-        self._video_stream_conn = conn.StreamConnection()
-        self._video_decoder = libmedia_codec.H264Decoder()
+        self._video_stream_conn = conn.StreamConnection(h264=True)
+        self._video_decoder = _create_video_decoder()
         # disable logging
         self._video_decoder_thread = None
         self._video_display_thread = None
-        self._video_frame_queue = queue.Queue(64)
+        self._video_frame_queue = queue.Queue(VIDEO_FRAME_QUEUE_SIZE)
+        self._video_latest_frame = _LatestFrame()
+        self._video_latest_only = False
+        self._video_skip_nonref = False
+        self._video_skipping = False
+        self._video_read_seq = 0
         self._video_streaming = False
         self._displaying = False
         self._video_frame_count = 0
+        self._video_frame_dropped = 0
+        self._video_publisher = None
 
         self._audio_stream_conn = conn.StreamConnection()
-        self._audio_decoder = libmedia_codec.OpusDecoder()
+        self._audio_decoder = _create_audio_decoder()
         self._audio_decoder_thread = None
         self._audio_playing_thread = None
-        self._audio_frame_queue = queue.Queue(32)
+        self._audio_frame_queue = queue.Queue(AUDIO_FRAME_QUEUE_SIZE)
+        self._audio_ring = audio.AudioRingBuffer()
         self._audio_streaming = False
         self._playing = False
         self._audio_frame_count = 0
+        self._audio_frame_dropped = 0
 
     def __del__(self):
         self.stop()
@@ -55,11 +168,40 @@ class LiveView(object):
             self.stop_video_stream()
         if self._audio_streaming:
             self.stop_audio_stream()
+        self.stop_video_share()
 
-    def start_video_stream(self, display=True, addr=None, ip_proto="tcp"):
+    def start_video_share(self, name, slot_num=video_share.SHARE_SLOT_NUM,
+                          max_frame_size=video_share.SHARE_MAX_FRAME_SIZE):
+        """ 将解码后的视频帧发布到共享内存，其他进程通过 video_share.FrameSubscriber(name) 读取
+
+        :return: video_share.FramePublisher
+        """
+        self.stop_video_share()
+        self._video_publisher = video_share.FramePublisher(name, slot_num, max_frame_size)
+        return self._video_publisher
+
+    def stop_video_share(self):
+        publisher = self._video_publisher
+        self._video_publisher = None
+        if publisher:
+            publisher.close()
+
+    def start_video_stream(self, display=True, addr=None, ip_proto="tcp", latest_only=False, skip_nonref=False):
+        """ 开启视频流
+
+        :param latest_only: bool: 只保留最新的一帧，读取方处理不及时的帧直接丢弃，适用于对延迟敏感的闭环控制
+        :param skip_nonref: bool: 读取方处理不及时的时候，解码器跳过非参考帧以降低解码耗时
+        """
         try:
             logger.info("Liveview: try to connect addr {0}, proto={1}".format(
                 addr, ip_proto))
+            self._video_latest_only = latest_only
+            self._video_skip_nonref = skip_nonref
+            self._video_read_seq = 0
+            self._video_frame_count = 0
+            self._video_frame_dropped = 0
+            self._video_frame_queue.queue.clear()
+            self._video_latest_frame.open()
             self._video_stream_conn.connect(addr, ip_proto)
             self._video_streaming = True
             self._video_decoder_thread = threading.Thread(target=self._video_decoder_task)
@@ -76,6 +218,7 @@ class LiveView(object):
         try:
             self._video_streaming = False
             self._displaying = False
+            self._video_latest_frame.close()
             if self._video_stream_conn:
                 self._video_stream_conn.disconnect()
             if self._displaying:
@@ -92,76 +235,182 @@ class LiveView(object):
         return True
 
     def read_video_frame(self, timeout=3, strategy="pipeline"):
-        if strategy == "pipeline":
-            return self._video_frame_queue.get(timeout=timeout)
-        elif strategy == "newest":
-            while self._video_frame_queue.qsize() > 1:
-                self._video_frame_queue.get(timeout=timeout)
-            return self._video_frame_queue.get(timeout=timeout)
+        info = self.read_video_frame_info(timeout, strategy)
+        if info is None:
+            return None
+        return info[0]
+
+    def read_video_frame_info(self, timeout=3, strategy="pipeline"):
+        """ 读取一帧视频流帧及其序号和解码时间
+
+        :return: tuple: (frame, seq, timestamp)，seq 从 1 开始递增，跳过的序号即被丢弃的帧，timestamp 为 time.time()
+        """
+        if strategy == "pipeline" and not self._video_latest_only:
+            info = self._video_frame_queue.get(timeout=timeout)
+        elif strategy in ("pipeline", "newest"):
+            info = self._video_latest_frame.get(self._video_read_seq, timeout)
+            if not self._video_latest_only:
+                # 与之前一致，读取最新帧会清空老的数据帧队列
+                self._video_frame_queue.queue.clear()
         else:
             logger.warning("LiveView: read_video_frame, unsupported strategy:{0}".format(strategy))
             return None
+        if info is not None:
+            self._video_read_seq = info[1]
+        return info
+
+    def peek_video_frame_info(self, last_seq=0, timeout=3):
+        """ 读取序号大于 last_seq 的最新一帧，不清空数据帧队列，也不影响 read_video_frame_info 的读取进度，
+        供与 read_video_frame 同时读取视频流的使用方自行记录读取进度
+
+        :return: tuple: (frame, seq, timestamp)，同 read_video_frame_info，超时抛出 queue.Empty
+        """
+        if last_seq > self._video_frame_count:
+            # 视频流重新开启后帧序号从 1 开始
+            last_seq = 0
+        return self._video_latest_frame.get(last_seq, timeout, consume=False)
+
+    @property
+    def video_stats(self):
+        """ 视频流统计
+
+        :return: dict: decoded 已解码帧数，dropped 未被读取即被丢弃的帧数，skipping 解码器当前是否在跳过非参考帧，
+                 stream 码流接收统计，见 StreamConnection.stats
+        """
+        return {"decoded": self._video_frame_count, "dropped": self._video_frame_dropped,
+                "skipping": self._video_skipping, "stream": self._video_stream_conn.stats}
+
+    def _set_video_skipping(self, skipping):
+        if skipping == self._video_skipping:
+            return
+        # 旧版 libmedia_codec 不支持跳帧
+        if hasattr(self._video_decoder, "set_skip_nonref"):
+            self._video_decoder.set_skip_nonref(skipping)
+            self._video_skipping = skipping
+            logger.info("LiveView: video decoder skip non-reference frames {0}".format(skipping))
 
-    def _h264_decode(self, data):
+    def _put_video_frame(self, frame):
+        self._video_frame_count += 1
+        info = (frame, self._video_frame_count, time.time())
+        publisher = self._video_publisher
+        if publisher:
+            publisher.publish(frame, info[2])
+        overwritten = self._video_latest_frame.put(info, self._video_frame_count)
+        if self._video_latest_only:
+            behind = overwritten
+        else:
+            behind = False
+            try:
+                self._video_frame_queue.put_nowait(info)
+            except queue.Full:
+                # 丢弃最老的一帧，不阻塞解码线程
+                behind = True
+                try:
+                    self._video_frame_queue.get_nowait()
+                except queue.Empty:
+                    pass
+                self._video_frame_queue.put_nowait(info)
+        if behind:
+            self._video_frame_dropped += 1
+        if self._video_skip_nonref:
+            self._set_video_skipping(behind)
+
+    def _h264_decode(self, bufs):
         res_frame_list = []
-        frames = self._video_decoder.decode(data)
+        frames = _decode_many(self._video_decoder, bufs)
         for frame_data in frames:
             (frame, width, height, ls) = frame_data
-            if frame:
-                frame = numpy.fromstring(frame, dtype=numpy.ubyte, count=len(frame), sep='')
-                frame = (frame.reshape((height, width, 3)))
+            if isinstance(frame, numpy.ndarray):
+                # 解码器直接输出到 numpy 数组，无需再拷贝
                 res_frame_list.append(frame)
+            elif frame:
+                # 兼容旧版 libmedia_codec 返回的 bytes，拷贝一次以得到可写的图像
+                frame = numpy.frombuffer(frame, dtype=numpy.ubyte, count=height * width * 3)
+                res_frame_list.append(frame.reshape((height, width, 3)).copy())
         return res_frame_list
 
     def _video_decoder_task(self):
         self._video_streaming = True
         logger.info("Liveview: _video_decoder_task, started!")
         while self._video_streaming:
-            data = b''
-            # 获取一帧h264 数据
-            buf = self._video_stream_conn.read_buf()
+            # 取出已收到的 h264 数据，StreamConnection 已按 access unit 切分
+            bufs = self._video_stream_conn.read_bufs(DECODE_BATCH_SIZE)
             if not self._video_streaming:
                 break
-            if buf:
-                data += buf
-                frames = self._h264_decode(data)
+            if bufs:
+                frames = self._h264_decode(bufs)
                 for frame in frames:
-                    try:
-                        self._video_frame_count += 1
-                        if self._video_frame_count % 30 == 1:
-                            logger.info("LiveView: video_decoder_task, get frame {0}.".format(self._video_frame_count))
-                        self._video_frame_queue.put(frame, timeout=2)
-                    except Exception as e:
-                        logger.warning("LiveView: _video_decoder_task, decoder queue is full, e {}.".format(e))
-                        continue
+                    self._put_video_frame(frame)
+                    if self._video_frame_count % 30 == 1:
+                        logger.info("LiveView: video_decoder_task, get frame {0}, dropped {1}.".format(
+                            self._video_frame_count, self._video_frame_dropped))
+        self._set_video_skipping(False)
         logger.info("LiveView: _video_decoder_task, quit.")
 
     def _video_display_task(self, name="RoboMaster LiveView"):
         self._displaying = True
         logger.info("Liveview: _video_display_task, started!")
+        last_seq = 0
         while self._displaying & self._video_streaming:
             try:
-                frame = self._video_frame_queue.get()
-                if frame is None:
-                    logger.warning("LiveView: _video_display_task, get frame None.")
-                    if not self._displaying:
-                        break
+                if self._video_latest_only:
+                    frame, last_seq, _ = self._video_latest_frame.get(last_seq, timeout=1)
+                else:
+                    info = self._video_frame_queue.get()
+                    if info is None:
+                        logger.warning("LiveView: _video_display_task, get frame None.")
+                        if not self._displaying:
+                            break
+                        continue
+                    frame = info[0]
             except Exception as e:
                 logger.warning("LiveView: display_task, video_frame_queue is empty, e {0}".format(e))
                 continue
-            img = numpy.array(frame)
-            cv2.imshow(name, img)
+            cv2.imshow(name, frame)
             cv2.waitKey(1)
         logger.info("LiveView: _video_display_task, quit.")
 
     def read_audio_frame(self, timeout=1):
         return self._audio_frame_queue.get(timeout=timeout)
 
+    def audio_blocks(self, block_size=audio.AUDIO_BLOCK_SIZE, sample_rate=audio.AUDIO_SAMPLE_RATE, timeout=1):
+        """ 按固定长度读取已解码的 PCM 数据，与 read_audio_frame 互不影响，
+        每个 audio_blocks 及 record_audio 有各自的读取位置，同时使用时都能读到完整的数据
+
+        :return: audio.AudioBlocks，支持 for 和 async for
+        """
+        return audio.AudioBlocks(self._audio_ring, block_size, sample_rate, timeout)
+
+    def record_audio(self, save_file, seconds, sample_rate=audio.AUDIO_SAMPLE_RATE):
+        """ 边接收边写入 wav 文件，内存占用与录制时长无关
+
+        :return: int: 写入的采样数
+        """
+        return audio.WavRecorder(self._audio_ring, save_file, sample_rate).record(seconds)
+
+    @property
+    def audio_stats(self):
+        """ 音频流统计
+
+        :return: dict: decoded 已解码帧数，dropped 未被 read_audio_frame 读取即被丢弃的帧数，
+                 overrun 各个 audio_blocks 及 record_audio 读取方未能及时读取而被覆盖的采样数之和
+        """
+        return {"decoded": self._audio_frame_count, "dropped": self._audio_frame_dropped,
+                "overrun": self._audio_ring.overrun}
+
     def start_audio_stream(self, addr=None, ip_proto="tcp"):
         try:
             logger.info("LiveView: try to connect addr:{0}, ip_proto:{1}".format(
                 addr, ip_proto))
+            if self._audio_decoder is None:
+                logger.error("LiveView: start_audio_stream, no opus decoder available")
+                return False
+            self._audio_frame_count = 0
+            self._audio_frame_dropped = 0
+            self._audio_frame_queue.queue.clear()
+            self._audio_ring.open()
             self._audio_stream_conn.connect(addr, ip_proto)
+            self._audio_streaming = True
             self._audio_decoder_thread = threading.Thread(
                 target=self._audio_decoder_task)
             self._audio_decoder_thread.start()
@@ -174,37 +423,49 @@ class LiveView(object):
         try:
             logger.info("LiveView: stop_audio_stream stopping...")
             self._audio_streaming = False
+            self._audio_ring.close()
             if self._audio_decoder_thread:
                 self._audio_decoder_thread.join()
             self._audio_stream_conn.disconnect()
-            self._video_frame_queue.queue.clear()
+            self._audio_frame_queue.queue.clear()
             # make sure the robot is disconnected
             time.sleep(0.5)
         except Exception as e:
             logger.error("LiveView: disconnect exception {0}".format(e))
             return False
-        logger.info("LiveView: stop_video_stream stopped.")
+        logger.info("LiveView: stop_audio_stream stopped.")
         return True
 
+    def _put_audio_frame(self, frame):
+        self._audio_frame_count += 1
+        if isinstance(frame, numpy.ndarray):
+            # h264decoder.OpusDecoder 输出 int16 数组，队列中仍然提供 bytes
+            self._audio_ring.write(frame)
+            frame = frame.tobytes()
+        else:
+            self._audio_ring.write(numpy.frombuffer(frame, dtype='<i2'))
+        try:
+            self._audio_frame_queue.put_nowait(frame)
+        except queue.Full:
+            # 丢弃最老的一帧，不阻塞解码线程
+            self._audio_frame_dropped += 1
+            try:
+                self._audio_frame_queue.get_nowait()
+            except queue.Empty:
+                pass
+            self._audio_frame_queue.put_nowait(frame)
+
     def _audio_decoder_task(self):
-        self._audio_streaming = True
+        logger.info("LiveView: _audio_decoder_task, started!")
         while self._audio_streaming:
-            data = b''
-
-            buf = self._audio_stream_conn.read_buf()
-            if buf:
-                data += buf
-
-                if len(data) != 0:
-                    frame = self._audio_decoder.decode(data)
-                    if frame:
-                        try:
-                            self._audio_frame_count += 1
-                            logger.info("LiveView: audio_decoder_task, get frame {0}.".format(self._audio_frame_count))
-                            self._audio_frame_queue.put(frame, timeout=1)
-                        except Exception as e:
-                            if not self._audio_streaming:
-                                break
-                            logger.warning("LiveView: _audio_decoder_task, audio_frame_queue full, e {0}!".format(e))
-                            continue
+            bufs = self._audio_stream_conn.read_bufs(DECODE_BATCH_SIZE)
+            if not self._audio_streaming:
+                break
+            for frame in _decode_many(self._audio_decoder, bufs):
+                if len(frame) == 0:
+                    continue
+                self._put_audio_frame(frame)
+                if self._audio_frame_count % 250 == 1:
+                    logger.info("LiveView: audio_decoder_task, get frame {0}, dropped {1}.".format(
+                        self._audio_frame_count, self._audio_frame_dropped))
         logger.info("LiveView: _audio_decoder_task, quit.")
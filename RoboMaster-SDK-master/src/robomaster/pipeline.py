@@ -0,0 +1,294 @@
+# -*-coding:utf-8-*-
+# Copyright (c) 2020 DJI.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License in the file LICENSE.txt or at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import queue
+import threading
+import collections
+from concurrent import futures
+from . import logger
+
+
+__all__ = ['FramePipeline', 'PipelineResult', 'Resize', 'CvtColor', 'PIPELINE_PROCESS', 'PIPELINE_THREAD']
+
+
+PIPELINE_PROCESS = "process"
+PIPELINE_THREAD = "thread"
+
+PIPELINE_RESULT_QUEUE_SIZE = 32
+
+
+class Resize(object):
+    """ 缩放图像的处理阶段，可在进程池中使用 """
+
+    def __init__(self, width, height, interpolation=None):
+        self._size = (width, height)
+        self._interpolation = interpolation
+
+    def __call__(self, frame):
+        import cv2
+        if self._interpolation is None:
+            return cv2.resize(frame, self._size)
+        return cv2.resize(frame, self._size, interpolation=self._interpolation)
+
+
+class CvtColor(object):
+    """ 颜色空间转换的处理阶段，如 CvtColor(cv2.COLOR_BGR2GRAY) """
+
+    def __init__(self, code):
+        self._code = code
+
+    def __call__(self, frame):
+        import cv2
+        return cv2.cvtColor(frame, self._code)
+
+
+class PipelineResult(object):
+    """ 一帧图像经过所有处理阶段后的结果 """
+
+    __slots__ = ('seq', 'timestamp', 'value', 'error')
+
+    def __init__(self, seq, timestamp, value=None, error=None):
+        self.seq = seq
+        self.timestamp = timestamp
+        self.value = value
+        self.error = error
+
+    def __repr__(self):
+        return "<PipelineResult seq:{0} timestamp:{1} error:{2}>".format(self.seq, self.timestamp, self.error)
+
+
+def _run_stages(stages, frame):
+    value = frame
+    for stage in stages:
+        value = stage(value)
+    return value
+
+
+# 进程池中每个工作进程只在启动时接收一次处理阶段，避免每帧重复序列化检测器等对象
+_worker_stages = None
+
+
+def _init_worker(stages):
+    global _worker_stages
+    _worker_stages = stages
+
+
+def _run_worker_stages(frame):
+    return _run_stages(_worker_stages, frame)
+
+
+class FramePipeline(object):
+    """ 视频帧处理流水线
+
+    从视频源读取最新的帧，按顺序执行注册的处理阶段，多帧在进程池或线程池中并行处理。
+    处理不过来时直接丢弃新的帧，结果带有帧序号及时间戳。
+
+    进程池可以绕开 GIL，但帧需要序列化传给工作进程，处理阶段必须可以被 pickle；
+    线程池没有额外拷贝，适用于 OpenCV 等会释放 GIL 的处理。
+    """
+
+    def __init__(self, source, mode=PIPELINE_PROCESS, workers=None, ordered=True, max_pending=None):
+        """
+        :param source: 视频源，EPCamera、TelloCamera 或 LiveView 对象，即有 peek_video_frame_info 方法的对象，
+            流水线自行记录读取进度，不影响同时使用 read_video_frame 的读取方
+        :param mode: enum: ("process", "thread")，处理阶段运行在进程池还是线程池中
+        :param workers: int: 工作进程或线程数，默认为 cpu 数
+        :param ordered: bool: 是否按帧序号顺序输出结果
+        :param max_pending: int: 同时处理的最大帧数，超过时丢弃新的帧，默认为 workers * 2
+        """
+        if mode not in (PIPELINE_PROCESS, PIPELINE_THREAD):
+            raise ValueError("FramePipeline: unsupported mode {0}".format(mode))
+        self._source = source
+        self._mode = mode
+        self._workers = workers or os.cpu_count() or 1
+        self._ordered = ordered
+        self._max_pending = max_pending or self._workers * 2
+        self._stages = []
+        self._executor = None
+        self._reader_thread = None
+        self._collector_thread = None
+        self._running = False
+        self._reading = False
+        self._cond = threading.Condition()
+        self._pending = collections.deque()
+        self._results = queue.Queue(PIPELINE_RESULT_QUEUE_SIZE)
+        self._callback = None
+        self._submitted = 0
+        self._skipped = 0
+        self._completed = 0
+        self._failed = 0
+        self._results_dropped = 0
+
+    def add_stage(self, stage):
+        """ 添加一个处理阶段
+
+        :param stage: callable: stage(value) 返回交给下一个阶段的值，第一个阶段的输入为图像帧
+        :return: FramePipeline，便于链式调用
+        """
+        if self._running:
+            raise RuntimeError("FramePipeline: add_stage, pipeline is running")
+        self._stages.append(stage)
+        return self
+
+    @property
+    def stats(self):
+        """ 处理统计
+
+        :return: dict: submitted 已提交处理的帧数，skipped 因来不及处理被丢弃的帧数，completed/failed 处理成功/失败的帧数，
+                 results_dropped 未被读取即被丢弃的结果数，pending 正在处理的帧数
+        """
+        with self._cond:
+            return {"submitted": self._submitted, "skipped": self._skipped, "completed": self._completed,
+                    "failed": self._failed, "results_dropped": self._results_dropped, "pending": len(self._pending)}
+
+    def start(self, callback=None):
+        """ 启动流水线
+
+        :param callback: 结果回调函数 callback(result)，在结果线程中执行；为 None 时通过 read_result 读取结果
+        """
+        if self._running:
+            return
+        self._callback = callback
+        if self._mode == PIPELINE_PROCESS:
+            self._executor = futures.ProcessPoolExecutor(max_workers=self._workers, initializer=_init_worker,
+                                                         initargs=(list(self._stages),))
+        else:
+            self._executor = futures.ThreadPoolExecutor(max_workers=self._workers,
+                                                        thread_name_prefix="FramePipelineWorker")
+        self._running = True
+        self._reading = True
+        self._reader_thread = threading.Thread(target=self._reader_task, name="FramePipelineReader")
+        self._collector_thread = threading.Thread(target=self._collector_task, name="FramePipelineCollector")
+        self._reader_thread.start()
+        self._collector_thread.start()
+
+    def stop(self):
+        """ 停止读取新的帧，等待正在处理的帧完成后退出 """
+        if not self._running:
+            return
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        self._reader_thread.join()
+        self._collector_thread.join()
+        self._executor.shutdown(wait=True)
+        self._executor = None
+
+    def read_result(self, timeout=3):
+        """ 读取一个处理结果
+
+        :param timeout: float: 超时时间，超时抛出 queue.Empty
+        :return: PipelineResult
+        """
+        return self._results.get(timeout=timeout)
+
+    def _submit(self, frame):
+        if self._mode == PIPELINE_PROCESS:
+            return self._executor.submit(_run_worker_stages, frame)
+        return self._executor.submit(_run_stages, self._stages, frame)
+
+    def _reader_task(self):
+        try:
+            self._read_frames()
+        finally:
+            with self._cond:
+                self._reading = False
+                self._cond.notify_all()
+
+    def _read_frames(self):
+        last_seq = 0
+        while self._running:
+            try:
+                frame, seq, timestamp = self._source.peek_video_frame_info(last_seq, timeout=1)
+            except queue.Empty:
+                continue
+            except Exception as e:
+                logger.warning("FramePipeline: _read_frames, read frame exception {0}".format(e))
+                continue
+            with self._cond:
+                if last_seq and seq > last_seq + 1:
+                    self._skipped += seq - last_seq - 1
+                last_seq = seq
+                if len(self._pending) >= self._max_pending:
+                    self._skipped += 1
+                    continue
+                self._submitted += 1
+            try:
+                future = self._submit(frame)
+            except RuntimeError as e:
+                logger.warning("FramePipeline: _read_frames, submit exception {0}".format(e))
+                break
+            with self._cond:
+                self._pending.append((seq, timestamp, future))
+            future.add_done_callback(self._on_done)
+
+    def _on_done(self, future):
+        with self._cond:
+            self._cond.notify_all()
+
+    def _pop_done(self):
+        """ 取出可以输出的结果，有序模式下只取队首 """
+        if self._ordered:
+            if self._pending and self._pending[0][2].done():
+                return self._pending.popleft()
+            return None
+        for item in self._pending:
+            if item[2].done():
+                self._pending.remove(item)
+                return item
+        return None
+
+    def _collector_task(self):
+        while True:
+            with self._cond:
+                item = self._pop_done()
+                while item is None:
+                    # 读取线程退出后不会再有新的帧提交
+                    if not self._reading and not self._pending:
+                        return
+                    self._cond.wait(0.5)
+                    item = self._pop_done()
+            seq, timestamp, future = item
+            try:
+                result = PipelineResult(seq, timestamp, value=future.result())
+            except Exception as e:
+                logger.warning("FramePipeline: frame {0}, stage exception {1}".format(seq, e))
+                result = PipelineResult(seq, timestamp, error=e)
+            with self._cond:
+                if result.error is None:
+                    self._completed += 1
+                else:
+                    self._failed += 1
+            self._deliver(result)
+
+    def _deliver(self, result):
+        if self._callback:
+            try:
+                self._callback(result)
+            except Exception as e:
+                logger.warning("FramePipeline: callback exception {0}".format(e))
+            return
+        try:
+            self._results.put_nowait(result)
+        except queue.Full:
+            # 丢弃最老的结果
+            try:
+                self._results.get_nowait()
+                self._results_dropped += 1
+            except queue.Empty:
+                pass
+            self._results.put_nowait(result)
@@ -12,6 +12,7 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import re
 import random
 import struct
 import binascii
@@ -42,7 +43,7 @@ p       char[]          string
 P       void*           long
 """
 
-__all__ = ['Msg', 'TextMsg']
+__all__ = ['Msg', 'TextMsg', 'MsgDecoder']
 
 # 默认的 ID 取值范围
 RM_SDK_FIRST_SEQ_ID = 10000
@@ -206,6 +207,8 @@ class Msg(MsgBase):
             if self._proto._cmdtype == DUSS_MB_TYPE_PUSH:
                 self._need_ack = 0
         self._buf = None
+        # 接收到的完整 v1 帧（含帧头与校验），仅解码得到的 Msg 有效
+        self._frame = None
 
     def __repr__(self):
         return "<Msg sender:0x{0:02x}, receiver:0x{1:02x}, cmdset:0x{2:02x}, cmdid:0x{3:02x}, len:{4:d}, \
@@ -356,6 +359,24 @@ class TextMsg(MsgBase):
         return self._buf
 
 
+def _unpack_v1_msg(buff, msg_len):
+    """ 从一帧完整的 v1 数据中解出 Msg，Msg._buf 与 buff 共享内存。
+    """
+    msg = Msg(buff[9], buff[10])
+    msg._len = msg_len
+    msg._seq_id = buff[7] * 256 + buff[6]
+    msg._attri = buff[8]
+    msg._sender = buff[4]
+    msg._receiver = buff[5]
+    msg._cmdset = int(buff[9])
+    msg._cmdid = int(buff[10])
+    msg._is_ack = msg._attri & 0x80 != 0
+    msg._need_ack = (msg._attri & 0x60) >> 5
+    msg._buf = buff[11:msg_len - 2]
+    msg._frame = buff[:msg_len]
+    return msg
+
+
 def decode_msg(buff, protocol="v1"):
     if protocol == "v1":
         if len(buff) < 4:
@@ -376,17 +397,7 @@ def decode_msg(buff, protocol="v1"):
             return None, buff
 
         # unpack from byte array.
-        msg = Msg(buff[9], buff[10])
-        msg._len = msg_len
-        msg._seq_id = buff[7] * 256 + buff[6]
-        msg._attri = buff[8]
-        msg._sender = buff[4]
-        msg._receiver = buff[5]
-        msg._cmdset = int(buff[9])
-        msg._cmdid = int(buff[10])
-        msg._is_ack = msg._attri & 0x80 != 0
-        msg._need_ack = (msg._attri & 0x60) >> 5
-        msg._buf = buff[11:msg._len - 2]
+        msg = _unpack_v1_msg(buff, msg_len)
         left_buf = buff[msg_len:]
         return msg, left_buf
 
@@ -403,6 +414,82 @@ def decode_msg(buff, protocol="v1"):
             return msg, bytearray()
 
 
+# v1 协议帧头与 crc16 的长度之和，即最短帧长
+MSG_MIN_LEN = 13
+
+
+class MsgDecoder(object):
+    """ v1 协议流式解码器
+
+    一次解出输入数据中的全部完整帧，帧头 magic、crc8 或 crc16 校验失败时向后查找下一个 magic 重新同步。
+    解出的 Msg._buf 是指向输入数据的 memoryview，不做拷贝；只有跨包的半帧才会被缓存并与下一包拼接。
+    """
+
+    def __init__(self):
+        self._pending = b''
+        self._dropped = 0
+
+    @property
+    def dropped(self):
+        """ 重新同步时丢弃的字节数 """
+        return self._dropped
+
+    def reset(self):
+        self._pending = b''
+
+    def feed(self, data):
+        """ 输入接收到的字节流，返回其中全部完整的消息
+
+        :param data: bytes，接收到的数据
+        :return: list，解出的 Msg 列表
+        """
+        if self._pending:
+            data = self._pending + data
+            self._pending = b''
+        elif not isinstance(data, bytes):
+            # views are handed out to Msg objects, they must not see later writes.
+            data = bytes(data)
+        view = memoryview(data)
+        size = len(data)
+        msgs = []
+        pos = 0
+        while size - pos >= 4:
+            if data[pos] != 0x55:
+                nxt = data.find(b'\x55', pos + 1)
+                if nxt < 0:
+                    nxt = size
+                self._dropped += nxt - pos
+                logger.warning("MsgDecoder: magic number is invalid, skip {0} bytes.".format(nxt - pos))
+                pos = nxt
+                continue
+            if algo.crc8_calc(view[pos:pos + 3]) != data[pos + 3]:
+                logger.warning("MsgDecoder: crc header check failed.")
+                self._dropped += 1
+                pos += 1
+                continue
+            msg_len = (data[pos + 2] & 0x3) * 256 + data[pos + 1]
+            if msg_len < MSG_MIN_LEN:
+                logger.warning("MsgDecoder: msg_len:{0} is invalid.".format(msg_len))
+                self._dropped += 1
+                pos += 1
+                continue
+            if size - pos < msg_len:
+                break
+            frame = view[pos:pos + msg_len]
+            if algo.crc16_calc(frame[:msg_len - 2]) != frame[msg_len - 2] | frame[msg_len - 1] << 8:
+                logger.warning("MsgDecoder: crc16 check failed, msg_len:{0}.".format(msg_len))
+                self._dropped += 1
+                pos += 1
+                continue
+            msgs.append(_unpack_v1_msg(frame, msg_len))
+            pos += msg_len
+
+        # 剩余的半帧不超过一帧的最大长度 1023 字节
+        if pos < size:
+            self._pending = bytes(view[pos:])
+        return msgs
+
+
 ################################################################################
 class ProtoGetVersion(ProtoData):
     _cmdset = 0
@@ -486,7 +573,7 @@ class ProtoGetSn(ProtoData):
         self._retcode = buf[offset]
         if self._retcode == 0:
             self._length = buf[offset + 1]
-            self._sn = buf[offset + 3:self._length + offset + 3].decode('utf-8', 'ignore')
+            self._sn = bytes(buf[offset + 3:self._length + offset + 3]).decode('utf-8', 'ignore')
             return True
         else:
             return False
@@ -2302,12 +2389,105 @@ class TelloDdsProto(object):
     DDS_AGX_FLAG = "agx"
     DDS_AGY_FLAG = "agy"
     DDS_AGZ_FLAG = "agz"
+    DDS_AI_FLAG = ";degree:"
     DDS_FREQ = 10
 
     def __init__(self):
         pass
 
 
+class TelloStatus(object):
+    """ Tello 文本状态推送的解析结果，每条推送只解析一次，各个 Tello 订阅数据共用同一个对象
+
+    属性名与 TelloDdsProto 中的状态名一致，mpry 为长度为3的 list，其余状态为 float，推送中缺少的状态为 None；
+    AI 模块推送解析后保存在 ai 中，格式不完整时为空 list，状态推送的 ai 为 None
+    """
+    FIELDS = ("mid", "x", "y", "z", "mpry", "pitch", "roll", "yaw", "vgx", "vgy", "vgz", "templ", "temph", "tof",
+              "h", "bat", "baro", "time", "agx", "agy", "agz")
+    __slots__ = FIELDS + ("ai",)
+
+    # 固件推送的状态顺序固定，整条匹配后一次取出所有数值；顺序不一致时按 "名称:数值" 逐项解析
+    _STATUS_RE = re.compile(
+        r"mid:([^;]*);x:([^;]*);y:([^;]*);z:([^;]*);mpry:([^;,]*),([^;,]*),([^;,]*);pitch:([^;]*);roll:([^;]*);"
+        r"yaw:([^;]*);vgx:([^;]*);vgy:([^;]*);vgz:([^;]*);templ:([^;]*);temph:([^;]*);tof:([^;]*);h:([^;]*);"
+        r"bat:([^;]*);baro:([^;]*);time:([^;]*);agx:([^;]*);agy:([^;]*);agz:([^;]*);")
+    _FIELD_RE = re.compile(r"([^:;\s]+):([^;]*)")
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, None)
+
+    def __repr__(self):
+        return "TelloStatus({0})".format(", ".join("{0}:{1}".format(name, getattr(self, name))
+                                                   for name in self.__slots__ if getattr(self, name) is not None))
+
+    def get(self, name, default=None):
+        value = getattr(self, name, None)
+        if value is None:
+            return default
+        return value
+
+    @classmethod
+    def parse(cls, buf):
+        """ 解析 Tello 的状态推送或 AI 模块推送
+
+        :param buf: 推送的明文字符串
+        :return: TelloStatus 对象
+        """
+        if TelloDdsProto.DDS_AI_FLAG in buf:
+            status = cls()
+            status.ai = cls._parse_ai(buf)
+            return status
+        m = cls._STATUS_RE.match(buf)
+        if m:
+            try:
+                values = [float(v) for v in m.groups()]
+            except ValueError:
+                values = None
+            if values:
+                # 所有状态都会被赋值，跳过 __init__ 的逐项初始化
+                status = cls.__new__(cls)
+                status.ai = None
+                status.mid, status.x, status.y, status.z = values[0:4]
+                status.mpry = values[4:7]
+                status.pitch, status.roll, status.yaw, status.vgx, status.vgy, status.vgz, status.templ, \
+                    status.temph, status.tof, status.h, status.bat, status.baro, status.time, status.agx, \
+                    status.agy, status.agz = values[7:]
+                return status
+        status = cls()
+        for name, data in cls._FIELD_RE.findall(buf):
+            if name not in cls.FIELDS:
+                continue
+            try:
+                if name == TelloDdsProto.DDS_PAD_MPRY_FLAG:
+                    status.mpry = [float(v) for v in data.split(',')[0:3]]
+                else:
+                    setattr(status, name, float(data))
+            except ValueError:
+                logger.debug("TelloStatus: parse, invalid value {0}:{1}".format(name, data))
+        return status
+
+    @staticmethod
+    def _parse_ai(buf):
+        info_buf = buf.split(';')
+        ai_info = []
+        if len(info_buf) != 7:
+            return ai_info
+        for info in info_buf:
+            if ":" in info:
+                if "x" in info:
+                    ai_info.append(int(info.split(':')[1]) / 320)
+                elif "y" in info:
+                    ai_info.append(int(info.split(':')[1]) / 240)
+                elif "w" in info:
+                    ai_info.append(int(info.split(':')[1]) / 320)
+                elif "h" in info:
+                    ai_info.append(int(info.split(':')[1]) / 240)
+                else:
+                    ai_info.append(info.split(':')[1])
+        return ai_info
+
+
 class STAConnInfo:
     def __init__(self):
         self._ssid = ""
@@ -15,12 +15,9 @@
 
 
 import os
-import threading
 import netifaces
 import socket
 import netaddr
-import time
-from netaddr import IPNetwork
 from . import protocol
 from . import logger
 from . import action
@@ -38,6 +35,7 @@ from . import led
 from . import battery
 from . import robotic_arm
 from . import sensor
+from . import scheduler
 from . import gripper
 from . import armor
 from . import flight
@@ -66,6 +64,9 @@ FREE = "free"
 GIMBAL_LEAD = "gimbal_lead"
 CHASSIS_LEAD = "chassis_lead"
 
+# 心跳发送周期，单位 s
+HEART_BEAT_INTERVAL = 1
+
 SOUND_ID_ATTACK = 0x101
 SOUND_ID_SHOOT = 0x102
 SOUND_ID_SCANNING = 0x103
@@ -148,7 +149,6 @@ class TelloTempInfoSubject(dds.Subject):
     def __init__(self):
         self._temp_l = 0
         self._temp_h = 0
-        self._info_num = 2
         self._freq = protocol.TelloDdsProto.DDS_FREQ
 
     def temp_info(self):
@@ -158,23 +158,13 @@ class TelloTempInfoSubject(dds.Subject):
         return self._temp_l, self._temp_h
 
     def decode(self, buf):
-        push_info = buf.split(';')
-        found_info_num = 0
-        for info in push_info:
-            if protocol.TelloDdsProto.DDS_TEMP_L_FLAG in info:
-                temp_l_str = info.split(':')[1]
-                self._temp_l = int(temp_l_str)
-                found_info_num += 1
-            elif protocol.TelloDdsProto.DDS_TEMP_H_FLAG in info:
-                temp_h_str = info.split(':')[1]
-                self._temp_h = int(temp_h_str)
-                found_info_num += 1
-        if found_info_num == self._info_num:
-            return True
-        else:
-            logger.debug("TelloTempInfoSubject: decode, found_info_num {0} is not match self._info_num {1}".format(
-                found_info_num, self._info_num))
+        status = buf if isinstance(buf, protocol.TelloStatus) else protocol.TelloStatus.parse(buf)
+        if status.templ is None or status.temph is None:
+            logger.debug("TelloTempInfoSubject: decode, temperature not found in {0}".format(status))
             return False
+        self._temp_l = int(status.templ)
+        self._temp_h = int(status.temph)
+        return True
 
 
 class TelloTofInfoSubject(dds.Subject):
@@ -182,7 +172,6 @@ class TelloTofInfoSubject(dds.Subject):
 
     def __init__(self):
         self._tof = 0
-        self._info_num = 1
         self._freq = protocol.TelloDdsProto.DDS_FREQ
 
     def tof_info(self):
@@ -192,19 +181,12 @@ class TelloTofInfoSubject(dds.Subject):
         return self._tof
 
     def decode(self, buf):
-        push_info = buf.split(';')
-        found_info_num = 0
-        for info in push_info:
-            if protocol.TelloDdsProto.DDS_TOF_FLAG in info:
-                tof_str = info.split(':')[1]
-                self._tof = int(tof_str)
-                found_info_num += 1
-        if found_info_num == self._info_num:
-            return True
-        else:
-            logger.debug("TelloTofInfoSubject: decode, found_info_num {0} is not match self._info_num {1}".format(
-                found_info_num, self._info_num))
+        status = buf if isinstance(buf, protocol.TelloStatus) else protocol.TelloStatus.parse(buf)
+        if status.tof is None:
+            logger.debug("TelloTofInfoSubject: decode, tof not found in {0}".format(status))
             return False
+        self._tof = int(status.tof)
+        return True
 
 
 class TelloDroneInfoSubject(dds.Subject):
@@ -214,7 +196,6 @@ class TelloDroneInfoSubject(dds.Subject):
         self._high = 0
         self._baro = 0
         self._time = 0
-        self._info_num = 3
         self._freq = protocol.TelloDdsProto.DDS_FREQ
 
     def drone_info(self):
@@ -224,28 +205,14 @@ class TelloDroneInfoSubject(dds.Subject):
         return self._high, self._baro, self._time
 
     def decode(self, buf):
-        push_info = buf.split(';')
-        found_info_num = 0
-        for info in push_info:
-            if info.startswith(protocol.TelloDdsProto.DDS_HIGH_FLAG):
-                high_str = info.split(':')[1]
-                self._high = int(high_str)
-                found_info_num += 1
-            elif protocol.TelloDdsProto.DDS_BARO_FLAG in info:
-                baro_str = info.split(':')[1]
-                self._baro = float(baro_str)
-                found_info_num += 1
-            elif protocol.TelloDdsProto.DDS_MOTOR_TIME_FLAG in info:
-                logger.debug("TelloDroneInfoSubject: time_info {0}".format(info))
-                time_str = info.split(':')[1]
-                self._time = int(time_str)
-                found_info_num += 1
-        if found_info_num == self._info_num:
-            return True
-        else:
-            logger.warning("TelloDroneInfoSubject: decode, found_info_num {0} is not match self._info_num {1}".format(
-                found_info_num, self._info_num))
+        status = buf if isinstance(buf, protocol.TelloStatus) else protocol.TelloStatus.parse(buf)
+        if status.h is None or status.baro is None or status.time is None:
+            logger.warning("TelloDroneInfoSubject: decode, drone info not found in {0}".format(status))
             return False
+        self._high = int(status.h)
+        self._baro = status.baro
+        self._time = int(status.time)
+        return True
 
 
 class TelloStatusSubject(dds.Subject):
@@ -259,7 +226,6 @@ class TelloStatusSubject(dds.Subject):
         self._pad_y = 0
         self._pad_z = 0
         self._pad_mpry = []
-        self._pad_mpry_num = 3
         self._pitch = 0
         self._roll = 0
         self._yaw = 0
@@ -298,23 +264,19 @@ class TelloStatusSubject(dds.Subject):
                              self._dds_proto.DDS_AGX_FLAG: self._agx,
                              self._dds_proto.DDS_AGY_FLAG: self._agy,
                              self._dds_proto.DDS_AGZ_FLAG: self._agz}
+        self._status = None
+
+    def data_info(self):
+        return self._status
 
     def decode(self, buf):
         """ 根据数据推送更新 drone 的状态数据
         """
-        if dds.IS_AI_FLAG not in buf:
-            push_data_list = buf.split(';')
-            for info in push_data_list:
-                if ':' not in info:
-                    continue
-                name, data = info.split(':')
-                if name == self._dds_proto.DDS_PAD_MPRY_FLAG:
-                    pad_mpry_info = data.split(',')
-                    self._status_dict[name].clear()
-                    for i in range(self._pad_mpry_num):
-                        self._status_dict[name].append(float(pad_mpry_info[i]))
-                else:
-                    self._status_dict[name] = float(data)
+        status = buf if isinstance(buf, protocol.TelloStatus) else protocol.TelloStatus.parse(buf)
+        if status.ai is not None:
+            return False
+        self._status = status
+        return True
 
     @property
     def freq(self):
@@ -326,12 +288,15 @@ class TelloStatusSubject(dds.Subject):
             self._freq = in_freq
 
     def pad_position(self):
-        return self._status_dict[self._dds_proto.DDS_PAD_X_FLAG], \
-               self._status_dict[self._dds_proto.DDS_PAD_Y_FLAG], \
-               self._status_dict[self._dds_proto.DDS_PAD_Z_FLAG]
+        return self.get_status(self._dds_proto.DDS_PAD_X_FLAG), \
+               self.get_status(self._dds_proto.DDS_PAD_Y_FLAG), \
+               self.get_status(self._dds_proto.DDS_PAD_Z_FLAG)
 
     def get_status(self, name):
-        return self._status_dict[name]
+        if self._status is None:
+            return self._status_dict[name]
+        # 推送中缺少的状态保持初始值
+        return self._status.get(name, self._status_dict[name])
 
 
 class RobotBase(object):
@@ -457,66 +422,25 @@ class Drone(RobotBase):
     def _scan_host(self, timeout=10):
         """Find avaliable ip list in server's subnets
 
-        :param num: Number of Tello this method is expected to find
-        :return: None
+        :param timeout: 扫描的超时时间，单位秒
+        :return: list: [(ip, port)]
         """
         logger.info('[Start_Searching]Searching for available Tello...\n')
 
         subnets, address = self.get_subnets()
-        possible_addr = []
-
-        for subnet, netmask in subnets:
-            for ip in IPNetwork('%s/%s' % (subnet, netmask)):
-                # skip local and broadcast
-                if str(ip).split('.')[3] == '0' or str(ip).split('.')[3] == '255':
-                    continue
-                possible_addr.append(str(ip))
-        last_time = time.time()
-        while len(self._robot_host_list) < 10:
-            # delete already fond Tello ip
-            for tello_host in self._robot_host_list:
-                if tello_host[0] in possible_addr:
-                    possible_addr.remove(tello_host[0])
-            # skip server itself
-            for ip in possible_addr:
-                if ip in address:
-                    continue
-                self._sock.sendto(b'command', (ip, 8889))
-            if len(self._robot_host_list) >= 1:
-                break
-            if timeout < time.time() - last_time:
-                raise logger.error("Drone: can not find the drone robot")
+        self._robot_host_list = [(host[0], self.local_port) for host in conn.scan_tello_hosts(
+            self._sock, subnets, address, num=1, timeout=timeout, port=conn.TELLO_SDK_PORT)]
+        if not self._robot_host_list:
+            logger.error("Drone: can not find the drone robot")
+            raise Exception("Drone: can not find the drone robot")
         return self._robot_host_list
 
     def scan_drone_robot(self):
         """ Automatic scanning of robots in the network
 
-        :param num:
-        :return:
+        :return: list: [(ip, port)]
         """
-        receive_thread = threading.Thread(target=self._scan_receive_task, daemon=True)
-        receive_thread.start()
-        robot_host_list = self._scan_host()
-        receive_thread.join()
-        return robot_host_list
-
-    def _scan_receive_task(self):
-        """Listen to responses from the Tello when scan the devices.
-
-        :param:num:
-        """
-        while len(self._robot_host_list) < 1:
-            try:
-                resp, ip = self._sock.recvfrom(1024)
-                logger.info("FoundTello: from ip {1}_receive_task, recv msg: {0}".format(resp, ip))
-                ip = ''.join(str(ip[0]))
-                if resp.upper() == b'OK' and ip not in self._robot_host_list:
-                    self._robot_host_list.append((ip, self.local_port))
-                    logger.info('FoundTello: Found Tello.The Tello ip is:%s\n' % ip)
-            except socket.error as exc:
-                logger.error("[Exception_Error]Caught exception socket.error : {0}\n".format(exc))
-        self.client_recieve_thread_flag = True
-        logger.info("FoundTello: has finished, _scan_receive_task quit!")
+        return self._scan_host()
 
     def start(self):
         try:
@@ -1106,6 +1030,7 @@ class Robot(RobotBase):
         super().__init__(cli)
         self._sdk_conn = conn.SdkConnection()
         self._send_heart_beat_timer = None
+        self._heart_beat_failed = 0
         self._running = False
         self._initialized = False
         self._conn_type = config.DEFAULT_CONN_TYPE
@@ -1126,7 +1051,9 @@ class Robot(RobotBase):
 
     def _start_heart_beat_timer(self):
         if self._running:
-            self._send_heart_beat_msg()
+            # 所有 Robot 的心跳共用一个调度线程
+            self._send_heart_beat_timer = scheduler.get_scheduler().call_periodic(
+                HEART_BEAT_INTERVAL, self._send_heart_beat_msg, delay=0)
 
     def _stop_heart_beat_timer(self):
         if self._send_heart_beat_timer:
@@ -1139,10 +1066,21 @@ class Robot(RobotBase):
         try:
             self.client.send_msg(msg)
         except Exception as e:
+            self._heart_beat_failed += 1
             logger.warning("Robot: send heart beat msg failed, exception {0}".format(e))
-        if self._running:
-            self._send_heart_beat_timer = threading.Timer(1, self._send_heart_beat_msg)
-            self._send_heart_beat_timer.start()
+
+    @property
+    def heart_beat_stats(self):
+        """ 心跳统计
+
+        :return: dict: fired 已发送次数，missed 因调度延迟错过的次数，failed 发送失败次数，
+                 last_lateness/max_lateness 最近/最大调度延迟，单位秒
+        """
+        stats = {"fired": 0, "missed": 0, "last_lateness": 0, "max_lateness": 0}
+        if self._send_heart_beat_timer:
+            stats = self._send_heart_beat_timer.stats
+        stats["failed"] = self._heart_beat_failed
+        return stats
 
     @property
     def conf(self):
@@ -1324,7 +1262,10 @@ class Robot(RobotBase):
         self._enable_sdk(1)
         self.reset()
 
-        self._ftp.connect(self.ip)
+        try:
+            self._ftp.connect(self.ip)
+        except Exception as e:
+            logger.warning("Robot: initialize, ftp connect failed, exception {0}".format(e))
 
         # start heart beat timer
         self._running = True
@@ -0,0 +1,207 @@
+# -*-coding:utf-8-*-
+# Copyright (c) 2020 DJI.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License in the file LICENSE.txt or at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import time
+import heapq
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from . import logger
+
+
+__all__ = ['Scheduler', 'TimerHandle', 'get_scheduler']
+
+
+# 执行可能阻塞的回调（如发送同步命令）的线程数，避免阻塞定时线程
+SCHEDULER_BLOCKING_WORKERS = 4
+
+
+class TimerHandle(object):
+    """ 定时任务句柄，用于取消任务及查看执行统计 """
+
+    __slots__ = ('_callback', '_args', '_interval', '_blocking', '_due', '_cancelled',
+                 'fired', 'missed', 'last_lateness', 'max_lateness')
+
+    def __init__(self, callback, args, due, interval=None, blocking=False):
+        self._callback = callback
+        self._args = args
+        self._interval = interval
+        self._blocking = blocking
+        self._due = due
+        self._cancelled = False
+        self.fired = 0
+        self.missed = 0
+        self.last_lateness = 0
+        self.max_lateness = 0
+
+    def __repr__(self):
+        return "<TimerHandle {0} interval:{1} fired:{2} missed:{3} cancelled:{4}>".format(
+            getattr(self._callback, '__name__', self._callback), self._interval, self.fired, self.missed,
+            self._cancelled)
+
+    def __lt__(self, other):
+        return self._due < other._due
+
+    def cancel(self):
+        """ 取消任务，可重复调用 """
+        self._cancelled = True
+        self._callback = None
+        self._args = None
+
+    @property
+    def cancelled(self):
+        return self._cancelled
+
+    @property
+    def interval(self):
+        return self._interval
+
+    @property
+    def stats(self):
+        """ 执行统计
+
+        :return: dict: fired 已执行次数，missed 因延迟过大跳过的周期数，last_lateness/max_lateness 最近/最大延迟，单位秒
+        """
+        return {"fired": self.fired, "missed": self.missed, "last_lateness": self.last_lateness,
+                "max_lateness": self.max_lateness}
+
+
+class Scheduler(object):
+    """ 定时任务调度器，所有周期及单次任务在同一个线程中按截止时间执行 """
+
+    def __init__(self, name="Scheduler"):
+        self._name = name
+        self._cond = threading.Condition()
+        self._timers = []
+        self._thread = None
+        self._running = False
+        self._workers = None
+
+    def _ensure_started(self):
+        if self._thread is None:
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name=self._name, daemon=True)
+            self._thread.start()
+
+    def call_later(self, delay, callback, *args, blocking=False):
+        """ 在 delay 秒后执行一次 callback(*args)
+
+        :param blocking: bool: 回调可能阻塞时设为 True，将交给工作线程执行
+        :return: TimerHandle
+        """
+        return self._add(TimerHandle(callback, args, time.monotonic() + delay, None, blocking))
+
+    def call_periodic(self, interval, callback, *args, delay=None, blocking=False):
+        """ 每隔 interval 秒执行一次 callback(*args)
+
+        按固定频率计算下一次的截止时间，单次执行的延迟不会累积；延迟超过一个周期时跳过错过的周期并计入 missed
+
+        :param delay: 第一次执行前的等待时间，默认为 interval
+        :return: TimerHandle
+        """
+        if delay is None:
+            delay = interval
+        return self._add(TimerHandle(callback, args, time.monotonic() + delay, interval, blocking))
+
+    def _add(self, handle):
+        with self._cond:
+            self._ensure_started()
+            heapq.heappush(self._timers, handle)
+            # 新任务成为最早截止的任务时唤醒定时线程
+            if self._timers[0] is handle:
+                self._cond.notify()
+        return handle
+
+    @property
+    def pending(self):
+        """ 未取消的任务数 """
+        with self._cond:
+            return len([handle for handle in self._timers if not handle.cancelled])
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._timers = []
+            self._cond.notify()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+        if self._workers:
+            self._workers.shutdown(False)
+            self._workers = None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running and (not self._timers or self._timers[0].cancelled):
+                    if self._timers:
+                        heapq.heappop(self._timers)
+                    else:
+                        self._cond.wait()
+                if not self._running:
+                    break
+                handle = self._timers[0]
+                now = time.monotonic()
+                if handle._due > now:
+                    self._cond.wait(handle._due - now)
+                    continue
+                heapq.heappop(self._timers)
+                lateness = now - handle._due
+                callback, args = handle._callback, handle._args
+                if handle._interval:
+                    # 固定频率，错过的周期直接跳过
+                    skipped = int(lateness // handle._interval)
+                    handle.missed += skipped
+                    handle._due += handle._interval * (skipped + 1)
+                    heapq.heappush(self._timers, handle)
+            handle.fired += 1
+            handle.last_lateness = lateness
+            if lateness > handle.max_lateness:
+                handle.max_lateness = lateness
+            if handle._blocking:
+                self._submit(callback, args)
+            else:
+                self._exec(callback, args)
+
+    def _submit(self, callback, args):
+        if self._workers is None:
+            self._workers = ThreadPoolExecutor(max_workers=SCHEDULER_BLOCKING_WORKERS,
+                                               thread_name_prefix=self._name + "Worker")
+        self._workers.submit(self._exec, callback, args)
+
+    @staticmethod
+    def _exec(callback, args):
+        if callback is None:
+            return
+        try:
+            callback(*args)
+        except Exception as e:
+            logger.warning("Scheduler: callback {0} exception {1}".format(callback, e))
+
+
+_scheduler = None
+_scheduler_mutex = threading.Lock()
+
+
+def get_scheduler():
+    """ 获取进程内共享的调度器，所有 Robot 的心跳及底盘自动停止定时均在此执行
+
+    :return: Scheduler
+    """
+    global _scheduler
+    with _scheduler_mutex:
+        if _scheduler is None:
+            _scheduler = Scheduler()
+        return _scheduler
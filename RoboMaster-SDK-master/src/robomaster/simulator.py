@@ -0,0 +1,458 @@
+# -*-coding:utf-8-*-
+# Copyright (c) 2020 DJI.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License in the file LICENSE.txt or at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import math
+import heapq
+import socket
+import struct
+import threading
+import time
+from . import algo
+from . import client
+from . import conn
+from . import dds
+from . import logger
+from . import protocol
+
+
+__all__ = ['RobotSimulator']
+
+
+# 动作推送频率编码，0 为 1Hz，1 为 5Hz，2 为 10Hz
+ACTION_PUSH_FREQ = {0: 1, 1: 5, 2: 10}
+
+SIM_SOCKET_TIMEOUT = 0.2
+
+
+def _pack_frame(sender, receiver, seq_id, attri, cmdset, cmdid, payload):
+    msg_len = 13 + len(payload)
+    buf = bytearray(msg_len)
+    buf[0] = 0x55
+    buf[1] = msg_len & 0xff
+    buf[2] = (msg_len >> 8) & 0x3 | 4
+    buf[3] = algo.crc8_calc(buf[0:3])
+    buf[4] = sender
+    buf[5] = receiver
+    struct.pack_into('<H', buf, 6, seq_id)
+    buf[8] = attri
+    buf[9] = cmdset
+    buf[10] = cmdid
+    buf[11:11 + len(payload)] = payload
+    struct.pack_into('<H', buf, msg_len - 2, algo.crc16_calc(buf[0:msg_len - 2]))
+    return bytes(buf)
+
+
+class _SimState(object):
+    """ 模拟机器人的运动状态 """
+
+    def __init__(self):
+        self.x = 0.0            # m
+        self.y = 0.0            # m
+        self.yaw = 0.0          # degree
+        self.gimbal_yaw = 0.0   # degree
+        self.gimbal_pitch = 0.0  # degree
+        self.battery = 100
+
+
+class RobotSimulator(object):
+    """ 本地模拟机器人，使用 v1 协议应答版本、SN 查询及各类命令，模拟底盘、云台动作推送及数据订阅推送
+
+    请求按 protocol.registered_protos 中的协议类分发，未单独处理的命令返回 retcode 为 0 的应答。
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, proto_type=conn.CONNECTION_PROTO_UDP, proxy_port=None,
+                 sn="3JKDH2T00SIM000", version=(1, 1, 305), push_freq=None, time_scale=1.0):
+        """
+        :param host: 监听地址
+        :param port: 监听端口，0 表示由系统分配
+        :param proto_type: 通讯方式: tcp, udp
+        :param proxy_port: 连接请求端口，设置后可应答 SdkConnection.request_connection，通常为 config.ROBOT_PROXY_PORT
+        :param sn: 返回的 SN
+        :param version: 返回的固件版本号 (aa, bb, cc)
+        :param push_freq: 数据订阅推送频率，单位 Hz，None 表示使用订阅请求中的频率
+        :param time_scale: 动作执行的加速倍数
+        """
+        self._host = host
+        self._port = port
+        self._proto_type = proto_type
+        self._proxy_port = proxy_port
+        self._sn = sn
+        self._version = version
+        self._push_freq = push_freq
+        self._time_scale = time_scale
+
+        self._state = _SimState()
+        self._sock = None
+        self._proxy_sock = None
+        self._threads = []
+        self._running = False
+        self._peer = None
+        self._send_mutex = threading.Lock()
+        self._timer_cond = threading.Condition()
+        self._timers = []
+        self._timer_seq = 0
+        self._push_seq = 0
+        self._subs = {}
+
+        self.recv_count = 0
+        self.ack_count = 0
+        self.push_count = 0
+        self.heart_beat_count = 0
+
+        self._handlers = {
+            protocol.ProtoSetSdkConnection: self._on_sdk_connection,
+            protocol.ProtoGetProductVersion: self._on_get_version,
+            protocol.ProtoGetVersion: self._on_get_module_version,
+            protocol.ProtoGetSn: self._on_get_sn,
+            protocol.ProtoSdkHeartBeat: self._on_heart_beat,
+            protocol.ProtoSubscribeAddNode: self._on_add_node,
+            protocol.ProtoSubNodeReset: self._on_node_reset,
+            protocol.ProtoAddSubMsg: self._on_add_sub,
+            protocol.ProtoDelMsg: self._on_del_sub,
+            protocol.ProtoPositionMove: self._on_position_move,
+            protocol.ProtoGimbalRotate: self._on_gimbal_rotate,
+        }
+        self._push_data = {
+            dds.SUB_UID_MAP[dds.DDS_POSITION]: self._position_data,
+            dds.SUB_UID_MAP[dds.DDS_ATTITUDE]: self._attitude_data,
+            dds.SUB_UID_MAP[dds.DDS_IMU]: self._imu_data,
+            dds.SUB_UID_MAP[dds.DDS_VELOCITY]: self._velocity_data,
+            dds.SUB_UID_MAP[dds.DDS_ESC]: self._esc_data,
+            dds.SUB_UID_MAP[dds.DDS_GIMBAL_POS]: self._gimbal_pos_data,
+            dds.SUB_UID_MAP[dds.DDS_BATTERY]: self._battery_data,
+        }
+
+    def __del__(self):
+        self.stop()
+
+    @property
+    def addr(self):
+        """ 命令端口地址，作为 conn.Connection 的 target_addr """
+        return self._host, self._port
+
+    @property
+    def proxy_addr(self):
+        return self._host, self._proxy_port
+
+    @property
+    def state(self):
+        return self._state
+
+    def start(self):
+        if self._proto_type == conn.CONNECTION_PROTO_TCP:
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self._sock.bind((self._host, self._port))
+            self._sock.listen(1)
+            recv_task = self._accept_task
+        else:
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._sock.bind((self._host, self._port))
+            recv_task = self._udp_task
+        self._sock.settimeout(SIM_SOCKET_TIMEOUT)
+        self._port = self._sock.getsockname()[1]
+        self._running = True
+        self._threads = [threading.Thread(target=recv_task, args=(self._sock,)),
+                         threading.Thread(target=self._timer_task)]
+        if self._proxy_port is not None:
+            self._proxy_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._proxy_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self._proxy_sock.bind((self._host, self._proxy_port))
+            self._proxy_sock.settimeout(SIM_SOCKET_TIMEOUT)
+            self._proxy_port = self._proxy_sock.getsockname()[1]
+            self._threads.append(threading.Thread(target=self._udp_task, args=(self._proxy_sock, False)))
+        for t in self._threads:
+            t.daemon = True
+            t.start()
+        logger.info("RobotSimulator: start, addr {0}, proxy port {1}".format(self.addr, self._proxy_port))
+
+    def stop(self):
+        if not self._running:
+            return
+        self._running = False
+        with self._timer_cond:
+            self._timer_cond.notify()
+        for t in self._threads:
+            t.join()
+        self._threads = []
+        for sock in (self._sock, self._proxy_sock):
+            if sock:
+                sock.close()
+        self._sock = None
+        self._proxy_sock = None
+
+    def create_client(self, host=9, index=6):
+        """ 创建连接本模拟机器人的 client.Client，可用于 robot.Robot(cli) """
+        connection = conn.Connection((self._host, 0), self.addr, protocol=self._proto_type)
+        return client.Client(host, index, connection)
+
+    # 收发
+    def _udp_task(self, sock, is_cmd_port=True):
+        decoder = protocol.MsgDecoder()
+        while self._running:
+            try:
+                data, addr = sock.recvfrom(2048)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+
+            def reply(buf, _sock=sock, _addr=addr):
+                _sock.sendto(buf, _addr)
+            if is_cmd_port:
+                self._peer = reply
+            for msg in decoder.feed(data):
+                self._on_msg(msg, reply)
+
+    def _accept_task(self, sock):
+        while self._running:
+            try:
+                cli_sock, addr = sock.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            logger.info("RobotSimulator: accept {0}".format(addr))
+            cli_sock.settimeout(SIM_SOCKET_TIMEOUT)
+            self._tcp_recv(cli_sock)
+            cli_sock.close()
+
+    def _tcp_recv(self, sock):
+        decoder = protocol.MsgDecoder()
+
+        def reply(buf):
+            with self._send_mutex:
+                sock.sendall(buf)
+        self._peer = reply
+        while self._running:
+            try:
+                data = sock.recv(4096)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            if not data:
+                break
+            for msg in decoder.feed(data):
+                self._on_msg(msg, reply)
+        self._peer = None
+
+    def _send(self, buf, reply=None):
+        reply = reply or self._peer
+        if reply is None:
+            return False
+        try:
+            reply(buf)
+            return True
+        except OSError as e:
+            logger.warning("RobotSimulator: _send, exception {0}".format(e))
+            return False
+
+    def _push(self, sender, receiver, cmdset, cmdid, payload):
+        self._push_seq = (self._push_seq + 1) & 0xffff
+        self.push_count += 1
+        return self._send(_pack_frame(sender, receiver, self._push_seq, 0, cmdset, cmdid, payload))
+
+    def _on_msg(self, msg, reply):
+        self.recv_count += 1
+        if msg.is_ack:
+            return
+        key = protocol.make_proto_cls_key(msg.cmdset, msg.cmdid)
+        proto_cls = protocol.registered_protos.get(key)
+        if proto_cls is None:
+            logger.warning("RobotSimulator: unknown cmdset:0x{0:02x}, cmdid:0x{1:02x}".format(msg.cmdset, msg.cmdid))
+            return
+        handler = self._handlers.get(proto_cls, self._on_default)
+        payload = handler(msg, bytes(msg._buf))
+        if payload is None or msg._need_ack == 0:
+            return
+        self.ack_count += 1
+        frame = _pack_frame(msg._receiver, msg._sender, msg._seq_id, 0x80, msg.cmdset, msg.cmdid, payload)
+        self._send(frame, reply)
+
+    # 定时器，推送数据及动作进度都在同一线程中执行
+    def _schedule(self, delay, callback):
+        with self._timer_cond:
+            self._timer_seq += 1
+            heapq.heappush(self._timers, (time.monotonic() + delay, self._timer_seq, callback))
+            self._timer_cond.notify()
+
+    def _timer_task(self):
+        while self._running:
+            with self._timer_cond:
+                if not self._timers:
+                    self._timer_cond.wait()
+                    continue
+                due, _, callback = self._timers[0]
+                delay = due - time.monotonic()
+                if delay > 0:
+                    self._timer_cond.wait(delay)
+                    continue
+                heapq.heappop(self._timers)
+            try:
+                callback()
+            except Exception as e:
+                logger.warning("RobotSimulator: timer callback exception {0}".format(e))
+
+    # 命令处理，返回应答数据，None 表示不应答
+    @staticmethod
+    def _on_default(msg, buf):
+        proto_cls = protocol.registered_protos[protocol.make_proto_cls_key(msg.cmdset, msg.cmdid)]
+        return bytes(max(proto_cls._resp_size, 16))
+
+    def _on_sdk_connection(self, msg, buf):
+        ip = socket.inet_aton(self._host)
+        return bytes([0, 2]) + ip
+
+    def _on_get_version(self, msg, buf):
+        aa, bb, cc = self._version
+        resp = bytearray(13)
+        struct.pack_into("<HBB", resp, 9, cc, bb, aa)
+        return bytes(resp)
+
+    @staticmethod
+    def _on_get_module_version(msg, buf):
+        return bytes(protocol.ProtoGetVersion._resp_size)
+
+    def _on_get_sn(self, msg, buf):
+        sn = self._sn.encode()
+        return bytes([0, len(sn), 0]) + sn
+
+    def _on_heart_beat(self, msg, buf):
+        self.heart_beat_count += 1
+        return b'\x00'
+
+    @staticmethod
+    def _on_add_node(msg, buf):
+        return bytes([0, buf[0]])
+
+    def _on_node_reset(self, msg, buf):
+        self._subs.clear()
+        return b'\x00'
+
+    def _on_add_sub(self, msg, buf):
+        node_id, msg_id, _, sub_mode, num = buf[0:5]
+        uids = struct.unpack_from("<{0}Q".format(num), buf, 5)
+        freq, = struct.unpack_from("<H", buf, 5 + 8 * num)
+        freq = self._push_freq or freq or 1
+        token = object()
+        self._subs[msg_id] = token
+        self._schedule(1.0 / freq, lambda: self._period_push(token, msg._sender, msg._receiver, msg_id,
+                                                             sub_mode, uids, 1.0 / freq))
+        return bytes([0, node_id, sub_mode, msg_id, 0, 0, 0, 0])
+
+    def _on_del_sub(self, msg, buf):
+        self._subs.pop(buf[2], None)
+        return b'\x00'
+
+    def _period_push(self, token, receiver, sender, msg_id, sub_mode, uids, interval):
+        if self._subs.get(msg_id) is not token:
+            return
+        payload = bytearray([sub_mode, msg_id])
+        for uid in uids:
+            data = self._push_data.get(uid)
+            if data is not None:
+                payload += data()
+        self._push(sender, receiver, protocol.ProtoPushPeriodMsg._cmdset, protocol.ProtoPushPeriodMsg._cmdid,
+                   payload)
+        self._schedule(interval, lambda: self._period_push(token, receiver, sender, msg_id, sub_mode, uids,
+                                                           interval))
+
+    def _on_position_move(self, msg, buf):
+        action_id = buf[0]
+        freq = ACTION_PUSH_FREQ.get(buf[1] >> 2, 10)
+        pos_x, pos_y, pos_z = struct.unpack_from('<hhh', buf, 4)
+        vel_xy_max = buf[10]
+        agl_omg_max, = struct.unpack_from('<h', buf, 11)
+        dx, dy, dz = pos_x / 100.0, pos_y / 100.0, pos_z / 10.0
+        spd_xy = max((vel_xy_max + 70) / 160.0, 0.1)
+        spd_z = max(agl_omg_max / 10.0, 1.0)
+        duration = max(math.hypot(dx, dy) / spd_xy, abs(dz) / spd_z, 0.1) / self._time_scale
+        state = self._state
+        start = (state.x, state.y, state.yaw)
+        rad = math.radians(state.yaw)
+        wx, wy = dx * math.cos(rad) - dy * math.sin(rad), dx * math.sin(rad) + dy * math.cos(rad)
+
+        def update(frac):
+            state.x = start[0] + wx * frac
+            state.y = start[1] + wy * frac
+            state.yaw = start[2] + dz * frac
+            return struct.pack('<hhh', int(dx * frac * 100), int(dy * frac * 100), int(dz * frac * 10))
+        self._run_action(msg, action_id, freq, duration, update, protocol.ProtoPositionPush)
+        return bytes([0, 0])
+
+    def _on_gimbal_rotate(self, msg, buf):
+        action_id = buf[0]
+        freq = ACTION_PUSH_FREQ.get(buf[1] >> 2, 10)
+        coordinate = buf[2] >> 3
+        yaw, roll, pitch = struct.unpack_from('<hhh', buf, 3)
+        _, yaw_speed, _, pitch_speed = struct.unpack_from('<HHHH', buf, 9)
+        state = self._state
+        start = (state.gimbal_yaw, state.gimbal_pitch)
+        if coordinate == 1:
+            target = (start[0] + yaw / 10.0, start[1] + pitch / 10.0)
+        else:
+            target = (yaw / 10.0, pitch / 10.0)
+        duration = max(abs(target[0] - start[0]) / max(yaw_speed, 1), abs(target[1] - start[1]) / max(pitch_speed, 1),
+                       0.1) / self._time_scale
+
+        def update(frac):
+            state.gimbal_yaw = start[0] + (target[0] - start[0]) * frac
+            state.gimbal_pitch = start[1] + (target[1] - start[1]) * frac
+            return struct.pack('<hhh', int(state.gimbal_yaw * 10), 0, int(state.gimbal_pitch * 10))
+        self._run_action(msg, action_id, freq, duration, update, protocol.ProtoGimbalActionPush)
+        return bytes([0, 0])
+
+    def _run_action(self, msg, action_id, freq, duration, update, push_cls):
+        begin = time.monotonic()
+        sender, receiver = msg._receiver, msg._sender
+
+        def step():
+            frac = min((time.monotonic() - begin) / duration, 1.0)
+            data = update(frac)
+            done = frac >= 1.0
+            payload = bytes([action_id, int(frac * 100), 1 if done else 0]) + data
+            self._push(sender, receiver, push_cls._cmdset, push_cls._cmdid, payload)
+            if not done:
+                self._schedule(min(1.0 / freq, begin + duration - time.monotonic()), step)
+        self._schedule(0, step)
+
+    # 订阅数据
+    def _position_data(self):
+        return struct.pack('<fff', self._state.x, self._state.y, self._state.yaw * 10)
+
+    def _attitude_data(self):
+        return struct.pack('<fff', self._state.yaw, 0, 0)
+
+    @staticmethod
+    def _imu_data():
+        return struct.pack('<ffffff', 0, 0, 1, 0, 0, 0)
+
+    @staticmethod
+    def _velocity_data():
+        return struct.pack('<ffffff', 0, 0, 0, 0, 0, 0)
+
+    @staticmethod
+    def _esc_data():
+        stamp = int(time.monotonic() * 1000) & 0xffffffff
+        return struct.pack('<hhhhhhhhIIIIBBBB', 0, 0, 0, 0, 0, 0, 0, 0, stamp, stamp, stamp, stamp, 0, 0, 0, 0)
+
+    def _gimbal_pos_data(self):
+        yaw, pitch = int(self._state.gimbal_yaw * 10), int(self._state.gimbal_pitch * 10)
+        return struct.pack('<hhhhB', yaw, pitch, yaw, pitch, 0)
+
+    def _battery_data(self):
+        return struct.pack('<HhiBB', 10000, 250, 1000, self._state.battery, 0)
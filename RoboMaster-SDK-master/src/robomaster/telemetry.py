@@ -0,0 +1,419 @@
+# -*-coding:utf-8-*-
+# Copyright (c) 2020 DJI.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License in the file LICENSE.txt or at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import mmap
+import json
+import time
+import bisect
+import struct
+import threading
+from . import protocol
+from . import dds
+from . import logger
+
+
+__all__ = ['TelemetryRecorder', 'TelemetryReader', 'SubjectPlayer']
+
+
+# 数据文件：文件头 + 若干条记录，每条记录为 时间戳(double, 秒) + 帧长度(uint16) + 完整 v1 帧
+# 索引文件：数据文件名 + ".idx"，每个分段一行 json，记录分段的偏移、时间范围、各话题的条数
+# 及分段内周期推送 msg_id 对应的订阅数据名称，msg_id 在取消订阅后会被复用，名称只在所在分段内有效
+LOG_MAGIC = b'RMTL'
+LOG_VERSION = 1
+LOG_HEADER = struct.Struct('<4sHHd')
+RECORD_HEADER = struct.Struct('<dH')
+LOG_SEGMENT_RECORDS = 1024
+
+PUSH_CMDSET = 0x48
+PUSH_CMDID = 0x08
+
+
+def _frame_topic(frame):
+    """ 话题标识，周期推送为 "cmdset:cmdid:msg_id"，其他消息为 "cmdset:cmdid" """
+    if frame[9] == PUSH_CMDSET and frame[10] == PUSH_CMDID and len(frame) > 13:
+        return "{0}:{1}:{2}".format(frame[9], frame[10], frame[12])
+    return "{0}:{1}".format(frame[9], frame[10])
+
+
+class TelemetryRecorder(object):
+    """ 遥测数据记录器，挂在 Client 的分发器上，以追加方式写入接收到的原始 v1 帧 """
+
+    def __init__(self, path, segment_records=LOG_SEGMENT_RECORDS):
+        self._path = path
+        self._segment_records = segment_records
+        self._file = open(path, 'wb')
+        self._index = open(path + '.idx', 'w')
+        self._mutex = threading.Lock()
+        self._client = None
+        self._subscriber = None
+        self._start = time.monotonic()
+        self._file.write(LOG_HEADER.pack(LOG_MAGIC, LOG_VERSION, 0, time.time()))
+        self._offset = LOG_HEADER.size
+        self._count = 0
+        # 最近一次解析到的 msg_id 对应的名称，订阅已取消时仍有推送到达，沿用该名称
+        self._names = {}
+        self._new_segment()
+
+    def __del__(self):
+        self.close()
+
+    @property
+    def count(self):
+        """ 已记录的帧数 """
+        return self._count
+
+    def attach(self, client, subscriber=None):
+        """ 开始记录 client 接收到的所有消息
+
+        :param client: 连接对应的 client.Client 对象
+        :param subscriber: 可选，dds.Subscriber 对象，用于在索引中记录周期推送 msg_id 对应的订阅数据名称
+        """
+        self._client = client
+        self._subscriber = subscriber
+        client.add_handler(self, "TelemetryRecorder", self._msg_recv)
+
+    def detach(self):
+        if self._client:
+            self._client.remove_handler("TelemetryRecorder")
+            self._client = None
+
+    @classmethod
+    def _msg_recv(cls, self, msg):
+        self.record(msg)
+
+    def record(self, msg, timestamp=None):
+        """ 记录一条消息
+
+        :param msg: 接收到的 protocol.Msg 对象
+        :param timestamp: 相对记录开始时刻的时间，单位秒，默认取当前时间
+        :return: bool: 是否写入
+        """
+        frame = msg._frame
+        if frame is None:
+            return False
+        if timestamp is None:
+            timestamp = time.monotonic() - self._start
+        with self._mutex:
+            if self._file is None:
+                return False
+            self._record_name(frame)
+            self._file.write(RECORD_HEADER.pack(timestamp, len(frame)))
+            self._file.write(frame)
+            if self._seg_count == 0:
+                self._seg_start = timestamp
+            self._seg_end = timestamp
+            topic = _frame_topic(frame)
+            self._seg_topics[topic] = self._seg_topics.get(topic, 0) + 1
+            self._seg_count += 1
+            self._seg_size += RECORD_HEADER.size + len(frame)
+            self._count += 1
+            if self._seg_count >= self._segment_records:
+                self._flush_segment()
+        return True
+
+    def _record_name(self, frame):
+        """ 记录周期推送时记下其 msg_id 对应的订阅数据名称，收到推送时订阅通常仍然有效，
+        msg_id 在分段内被另一个订阅复用时先结束当前分段，保证每个分段内的映射唯一
+        """
+        if frame[9] != PUSH_CMDSET or frame[10] != PUSH_CMDID or len(frame) <= 13:
+            return
+        msg_id = frame[12]
+        handler = self._subscriber._period_routes.get(msg_id) if self._subscriber else None
+        if handler is not None:
+            self._names[msg_id] = handler.subject.name
+        name = self._names.get(msg_id)
+        if name is None:
+            return
+        key = str(msg_id)
+        if self._seg_names.get(key, name) != name:
+            self._flush_segment()
+        self._seg_names[key] = name
+
+    def _new_segment(self):
+        self._seg_offset = self._offset
+        self._seg_size = 0
+        self._seg_count = 0
+        self._seg_start = 0
+        self._seg_end = 0
+        self._seg_topics = {}
+        self._seg_names = {}
+
+    def _flush_segment(self):
+        if self._seg_count == 0:
+            return
+        # 先落盘数据，再写索引，保证索引只指向完整的数据
+        self._file.flush()
+        entry = {"offset": self._seg_offset, "size": self._seg_size, "count": self._seg_count,
+                 "start": self._seg_start, "end": self._seg_end, "topics": self._seg_topics,
+                 "names": self._seg_names}
+        self._index.write(json.dumps(entry) + '\n')
+        self._index.flush()
+        self._offset += self._seg_size
+        self._new_segment()
+
+    def close(self):
+        self.detach()
+        with self._mutex:
+            if self._file is None:
+                return
+            self._flush_segment()
+            self._file.close()
+            self._index.close()
+            self._file = None
+            self._index = None
+
+
+class TelemetryReader(object):
+    """ 遥测数据读取器，通过 mmap 访问数据文件，借助分段索引按时间、话题定位 """
+
+    def __init__(self, path):
+        self._path = path
+        self._fd = None
+        self._mm = None
+        self._fd = open(path, 'rb')
+        self._mm = mmap.mmap(self._fd.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, self._wall_start = LOG_HEADER.unpack_from(self._mm, 0)
+        if magic != LOG_MAGIC or version != LOG_VERSION:
+            self.close()
+            raise ValueError("TelemetryReader: {0} is not a telemetry log".format(path))
+        self._segments = []
+        if os.path.exists(path + '.idx'):
+            with open(path + '.idx') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break
+                    self._segments.append(entry)
+        self._index_tail()
+        for seg in self._segments:
+            seg["names"] = {int(msg_id): name for msg_id, name in seg["names"].items()}
+        self._ends = [seg["end"] for seg in self._segments]
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        """ 关闭文件，records() 返回的 frame 仍被引用时，映射在这些引用释放后才真正关闭 """
+        mm, self._mm = self._mm, None
+        if mm is not None:
+            try:
+                mm.close()
+            except BufferError:
+                # 仍有指向 mmap 的 memoryview，由垃圾回收释放
+                pass
+        if self._fd is not None:
+            self._fd.close()
+            self._fd = None
+
+    def _index_tail(self):
+        """ 记录器异常退出时最后一段没有索引，扫描一次补上 """
+        offset = LOG_HEADER.size
+        if self._segments:
+            offset = self._segments[-1]["offset"] + self._segments[-1]["size"]
+        # 没有索引的分段沿用上一个分段的名称
+        names = dict(self._segments[-1]["names"]) if self._segments else {}
+        entry = {"offset": offset, "size": 0, "count": 0, "start": 0, "end": 0, "topics": {}, "names": names}
+        pos = offset
+        while pos + RECORD_HEADER.size <= len(self._mm):
+            ts, frame_len = RECORD_HEADER.unpack_from(self._mm, pos)
+            end = pos + RECORD_HEADER.size + frame_len
+            if end > len(self._mm):
+                break
+            topic = _frame_topic(self._mm[pos + RECORD_HEADER.size:end])
+            entry["topics"][topic] = entry["topics"].get(topic, 0) + 1
+            if entry["count"] == 0:
+                entry["start"] = ts
+            entry["end"] = ts
+            entry["count"] += 1
+            pos = end
+        if entry["count"]:
+            entry["size"] = pos - offset
+            self._segments.append(entry)
+
+    @property
+    def wall_start(self):
+        """ 开始记录时的系统时间 """
+        return self._wall_start
+
+    @property
+    def duration(self):
+        return self._segments[-1]["end"] if self._segments else 0
+
+    @property
+    def names(self):
+        """ 周期推送 msg_id 到订阅数据名称的映射，合并所有分段，msg_id 被复用时取最后的分段
+
+        replay 时按消息所在分段的映射分发，不依赖此合并结果
+        """
+        names = {}
+        for seg in self._segments:
+            names.update(seg["names"])
+        return names
+
+    @property
+    def topics(self):
+        """ 各话题的记录条数 """
+        topics = {}
+        for seg in self._segments:
+            for topic, count in seg["topics"].items():
+                topics[topic] = topics.get(topic, 0) + count
+        return topics
+
+    @staticmethod
+    def _resolve_topics(topics, names):
+        """ 话题列表转换为分段内的话题标识，订阅数据名称按该分段的 names 解析 """
+        if topics is None:
+            return None
+        keys = set()
+        for topic in topics:
+            if isinstance(topic, str):
+                keys.update("{0}:{1}:{2}".format(PUSH_CMDSET, PUSH_CMDID, msg_id)
+                            for msg_id, name in names.items() if name == topic)
+            else:
+                keys.add(":".join(str(x) for x in topic))
+        return keys
+
+    def records(self, start=None, end=None, topics=None):
+        """ 按时间顺序遍历记录
+
+        :param start: 起始时间，单位秒，相对记录开始时刻
+        :param end: 结束时间，单位秒
+        :param topics: 话题列表，元素为 (cmdset, cmdid)、(0x48, 0x08, msg_id) 或订阅数据名称如 dds.DDS_IMU
+        :return: 生成器，每项为 (timestamp, frame)，frame 为指向 mmap 的 memoryview
+        """
+        for _, ts, frame in self._records(start, end, topics):
+            yield ts, frame
+
+    def _records(self, start, end, topics):
+        """ 同 records，每项附带所在分段 (segment, timestamp, frame) """
+        first = 0 if start is None else bisect.bisect_left(self._ends, start)
+        view = memoryview(self._mm)
+        try:
+            for seg in self._segments[first:]:
+                if end is not None and seg["start"] > end:
+                    break
+                keys = self._resolve_topics(topics, seg["names"])
+                if keys is not None and not keys.intersection(seg["topics"]):
+                    continue
+                pos = seg["offset"]
+                seg_end = pos + seg["size"]
+                while pos < seg_end:
+                    ts, frame_len = RECORD_HEADER.unpack_from(self._mm, pos)
+                    pos += RECORD_HEADER.size
+                    frame = view[pos:pos + frame_len]
+                    pos += frame_len
+                    if start is not None and ts < start:
+                        continue
+                    if end is not None and ts > end:
+                        return
+                    if keys is not None and _frame_topic(frame) not in keys:
+                        continue
+                    yield seg, ts, frame
+        finally:
+            view.release()
+
+    def messages(self, start=None, end=None, topics=None):
+        """ 按时间顺序遍历记录并解码为 Msg
+
+        :return: 生成器，每项为 (timestamp, protocol.Msg)
+        """
+        for _, ts, msg in self._messages(start, end, topics):
+            yield ts, msg
+
+    def _messages(self, start, end, topics):
+        for seg, ts, frame in self._records(start, end, topics):
+            msg, _ = protocol.decode_msg(bytes(frame))
+            if msg is None:
+                continue
+            try:
+                msg.unpack_protocol()
+            except Exception as e:
+                logger.warning("TelemetryReader: messages, unpack_protocol failed {0}".format(e))
+            yield seg, ts, msg
+
+    def replay(self, dispatcher, speed=1.0, start=None, end=None, topics=None):
+        """ 回放记录，按原有时间间隔将消息交给 dispatcher
+
+        :param dispatcher: 具有 dispatch(msg) 方法的对象，如 event.Dispatcher 或 SubjectPlayer，
+            dispatcher 有 set_names 方法时，每进入一个分段传入该分段的 msg_id 名称映射
+        :param speed: 回放倍速，1 为原速，None 或 0 为不等待尽快回放
+        :param start: 起始时间，单位秒
+        :param end: 结束时间，单位秒
+        :param topics: 话题列表，参见 records
+        :return: int: 回放的消息条数
+        """
+        count = 0
+        base_ts = None
+        base_time = time.monotonic()
+        set_names = getattr(dispatcher, "set_names", None)
+        last_seg = None
+        for seg, ts, msg in self._messages(start, end, topics):
+            if set_names and seg is not last_seg:
+                set_names(seg["names"])
+                last_seg = seg
+            if speed:
+                if base_ts is None:
+                    base_ts = ts
+                delay = (ts - base_ts) / speed - (time.monotonic() - base_time)
+                if delay > 0:
+                    time.sleep(delay)
+            dispatcher.dispatch(msg)
+            count += 1
+        return count
+
+
+class SubjectPlayer(object):
+    """ 不连接机器人，按 Subscriber 相同的 Subject.decode/回调 路径分发回放的消息 """
+
+    def __init__(self, names=None):
+        """
+        :param names: 周期推送 msg_id 到订阅数据名称的映射，通常取 TelemetryReader.names
+        """
+        self._names = names or {}
+        self._period_subjects = {}
+        self._event_subjects = {}
+
+    def set_names(self, names):
+        """ 替换 msg_id 到订阅数据名称的映射，TelemetryReader.replay 在每个分段开始时调用 """
+        self._names = names
+
+    def add_subject(self, subject, callback=None, *args, **kw):
+        """ 添加回放的订阅数据
+
+        :param subject: dds.Subject 对象，如 chassis.PositionSubject(1)
+        :param callback: 回调函数，参数与对应的 sub_xxx 接口相同
+        """
+        subject.set_callback(callback, args, kw)
+        if subject.type == dds.DDS_SUB_TYPE_EVENT:
+            self._event_subjects[(subject.cmdset, subject.cmdid)] = subject
+        else:
+            self._period_subjects[subject.name] = subject
+
+    def dispatch(self, msg):
+        proto = msg.get_proto()
+        if proto is None:
+            return
+        if msg.cmdset == PUSH_CMDSET and msg.cmdid == PUSH_CMDID:
+            subject = self._period_subjects.get(self._names.get(proto._msg_id))
+        else:
+            subject = self._event_subjects.get((msg.cmdset, msg.cmdid))
+        if subject is None:
+            return
+        subject.decode(proto._data_buf)
+        if subject._callback:
+            subject.exec()
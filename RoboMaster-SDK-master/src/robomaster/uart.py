@@ -85,7 +85,7 @@ class Uart(module.Module):
     def serial_process_decode(self, msg):
         buf_len = msg._buf[2] << 8 | msg._buf[3]
         if msg._buf[1] == 1 and msg._len == (buf_len+3):
-            self._rec_data = msg._buf[4:]
+            self._rec_data = bytearray(msg._buf[4:])
 
     def sub_serial_msg(self, callback=None, *args):
         self._callback = callback
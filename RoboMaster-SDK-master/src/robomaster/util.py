@@ -15,6 +15,7 @@
 
 
 # read from config, localization, Use Metric or Inch.
+import numpy
 from . import logger
 
 UNIT_METRIC = 'Unit Metric'
@@ -85,6 +86,13 @@ class UnitChecker(object):
         val = self.check(val)
         return val
 
+    def proto2array(self, arr):
+        """ proto2val 的数组版本，对整列数据一次完成换算，超限时截断且不打印告警 """
+        arr = numpy.round(numpy.asarray(arr, dtype=numpy.float64) / self._scale, self._decimal or 0)
+        if self._start and self._end:
+            arr = numpy.clip(arr, self._start, self._end)
+        return arr
+
     def val2proto(self, val):
         val = self.check(val)
         val = val * self._scale
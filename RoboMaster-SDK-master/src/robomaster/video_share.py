@@ -0,0 +1,248 @@
+# -*-coding:utf-8-*-
+# Copyright (c) 2020 DJI.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License in the file LICENSE.txt or at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import mmap
+import time
+import queue
+import struct
+import threading
+import numpy
+from . import logger
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # python 3.8 以下不支持
+    shared_memory = None
+
+
+__all__ = ['FramePublisher', 'FrameSubscriber']
+
+
+# 共享内存布局：文件头 + slot_num 个帧槽，每个帧槽为 槽头 + 最大帧长度的图像数据
+# 发布方依次写入各帧槽，写入前将槽的序号清零，写完后再写入序号，读取方据此判断帧是否完整
+SHARE_MAGIC = b'RMVS'
+SHARE_VERSION = 1
+SHARE_HEADER = struct.Struct('<4sHHIQ')
+SLOT_HEADER = struct.Struct('<QdIII')
+SLOT_ALIGN = 64
+SHARE_SLOT_NUM = 4
+SHARE_MAX_FRAME_SIZE = 1280 * 720 * 3
+# 读取方等待新帧时的轮询间隔，单位 s
+SHARE_POLL_INTERVAL = 0.002
+
+
+def _check_support():
+    if shared_memory is None:
+        raise RuntimeError("video_share: multiprocessing.shared_memory requires python 3.8 or later")
+
+
+class _AttachedMemory(object):
+    """ 直接映射已存在的 POSIX 共享内存 """
+
+    def __init__(self, name):
+        import _posixshmem
+        fd = _posixshmem.shm_open("/" + name, os.O_RDWR, mode=0o600)
+        try:
+            self._mmap = mmap.mmap(fd, os.fstat(fd).st_size)
+        finally:
+            os.close(fd)
+        self.buf = memoryview(self._mmap)
+
+    def close(self):
+        self.buf.release()
+        self._mmap.close()
+
+
+def _attach(name):
+    """ 连接已存在的共享内存
+
+    读取方不能注册到 resource_tracker：与发布方无关的进程退出时会删除共享内存，同一 tracker 下注销又会与发布方冲突
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # python 3.13 以下没有 track 参数
+        pass
+    if os.name != 'posix':
+        # windows 下不使用 resource_tracker
+        return shared_memory.SharedMemory(name=name)
+    return _AttachedMemory(name)
+
+
+def _slot_stride(max_frame_size):
+    size = SLOT_HEADER.size + max_frame_size
+    return (size + SLOT_ALIGN - 1) // SLOT_ALIGN * SLOT_ALIGN
+
+
+class FramePublisher(object):
+    """ 将解码后的视频帧写入共享内存环形缓冲区，供同一台机器上任意数量的进程读取
+
+    发布方只有一个，通常由 LiveView 在解码线程中调用 publish。帧序号由发布方维护，只增不减，
+    视频流重新开启后读取方也能继续读到新的帧
+    """
+
+    def __init__(self, name, slot_num=SHARE_SLOT_NUM, max_frame_size=SHARE_MAX_FRAME_SIZE):
+        """
+        :param name: str: 共享内存名称，读取方使用同一名称连接
+        :param slot_num: int: 帧槽数量，读取方拿到的帧在之后 slot_num-1 帧内不会被覆盖
+        :param max_frame_size: int: 单帧图像数据的最大字节数
+        """
+        self._buf = None
+        self._mutex = threading.Lock()
+        _check_support()
+        self._name = name
+        self._slot_num = slot_num
+        self._max_frame_size = max_frame_size
+        self._slot_stride = _slot_stride(max_frame_size)
+        size = SLOT_ALIGN + slot_num * self._slot_stride
+        self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self._buf = self._shm.buf
+        self._seq = 0
+        SHARE_HEADER.pack_into(self._buf, 0, SHARE_MAGIC, SHARE_VERSION, slot_num, max_frame_size, 0)
+        logger.info("FramePublisher: created {0}, slots:{1}, size:{2}".format(name, slot_num, size))
+
+    def __del__(self):
+        self.close()
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def seq(self):
+        """ 最近一次发布的帧序号 """
+        return self._seq
+
+    def publish(self, frame, timestamp=None):
+        """ 发布一帧图像，帧序号在上一帧的基础上加 1
+
+        :param frame: numpy.ndarray: uint8 图像，(h, w) 或 (h, w, c)
+        :param timestamp: float: 帧时间戳，默认为当前时间
+        :return: bool: 已关闭或帧超过 max_frame_size 时返回 False
+        """
+        frame = numpy.ascontiguousarray(frame, dtype=numpy.uint8)
+        if frame.nbytes > self._max_frame_size:
+            logger.warning("FramePublisher: publish, frame size {0} exceeds {1}".format(
+                frame.nbytes, self._max_frame_size))
+            return False
+        if timestamp is None:
+            timestamp = time.time()
+        h, w = frame.shape[:2]
+        c = frame.shape[2] if frame.ndim == 3 else 1
+        # close 可能在其他线程中调用，写入期间不能释放共享内存
+        with self._mutex:
+            buf = self._buf
+            if buf is None:
+                return False
+            seq = self._seq + 1
+            offset = SLOT_ALIGN + (seq % self._slot_num) * self._slot_stride
+            data = offset + SLOT_HEADER.size
+            # 先清零序号，读取方看到 0 时忽略该帧槽
+            SLOT_HEADER.pack_into(buf, offset, 0, timestamp, w, h, c)
+            buf[data:data + frame.nbytes] = frame.reshape(-1).data
+            SLOT_HEADER.pack_into(buf, offset, seq, timestamp, w, h, c)
+            struct.pack_into('<Q', buf, SHARE_HEADER.size - 8, seq)
+            self._seq = seq
+        return True
+
+    def close(self):
+        """ 关闭并删除共享内存，已连接的读取方之后读不到新的帧 """
+        with self._mutex:
+            if self._buf is None:
+                return
+            self._buf = None
+            self._shm.close()
+        try:
+            self._shm.unlink()
+        except FileNotFoundError:
+            pass
+        logger.info("FramePublisher: closed {0}".format(self._name))
+
+
+class FrameSubscriber(object):
+    """ 连接 FramePublisher 创建的共享内存，读取最新的视频帧，不经过拷贝和序列化 """
+
+    def __init__(self, name):
+        self._buf = None
+        _check_support()
+        self._name = name
+        self._shm = _attach(name)
+        self._buf = self._shm.buf
+        magic, version, self._slot_num, self._max_frame_size, _ = SHARE_HEADER.unpack_from(self._buf, 0)
+        if magic != SHARE_MAGIC or version != SHARE_VERSION:
+            self.close()
+            raise ValueError("FrameSubscriber: {0} is not a frame share".format(name))
+        self._slot_stride = _slot_stride(self._max_frame_size)
+        self._last_seq = 0
+
+    def __del__(self):
+        self.close()
+
+    @property
+    def latest_seq(self):
+        """ 发布方最近一次发布的帧序号 """
+        return struct.unpack_from('<Q', self._buf, SHARE_HEADER.size - 8)[0]
+
+    def _slot_offset(self, seq):
+        return SLOT_ALIGN + (seq % self._slot_num) * self._slot_stride
+
+    def is_valid(self, seq):
+        """ 读到的帧是否仍未被发布方覆盖
+
+        :param seq: int: read 返回的帧序号
+        """
+        return SLOT_HEADER.unpack_from(self._buf, self._slot_offset(seq))[0] == seq
+
+    def read(self, timeout=3, last_seq=None):
+        """ 读取比 last_seq 更新的最新一帧
+
+        返回的图像直接指向共享内存，在之后的 slot_num-1 帧内有效，需要更久保存时请拷贝，或者用 is_valid 检查
+
+        :param timeout: float: 等待新帧的超时时间，超时抛出 queue.Empty
+        :param last_seq: int: 默认为本对象上一次读取到的帧序号
+        :return: tuple: (frame, seq, timestamp)
+        """
+        if last_seq is None:
+            last_seq = self._last_seq
+        deadline = time.time() + timeout
+        while True:
+            seq = self.latest_seq
+            if seq > last_seq:
+                offset = self._slot_offset(seq)
+                slot_seq, timestamp, w, h, c = SLOT_HEADER.unpack_from(self._buf, offset)
+                if slot_seq == seq:
+                    shape = (h, w, c) if c > 1 else (h, w)
+                    frame = numpy.ndarray(shape, dtype=numpy.uint8, buffer=self._buf,
+                                          offset=offset + SLOT_HEADER.size)
+                    # 发布方可能在创建视图期间开始覆盖该帧槽
+                    if self.is_valid(seq):
+                        self._last_seq = seq
+                        return frame, seq, timestamp
+            if time.time() > deadline:
+                raise queue.Empty
+            time.sleep(SHARE_POLL_INTERVAL)
+
+    def close(self):
+        if self._buf is None:
+            return
+        self._buf = None
+        try:
+            self._shm.close()
+        except BufferError:
+            # 仍有图像引用共享内存，由垃圾回收释放
+            pass
@@ -26,6 +26,13 @@ except ImportError:
 
 # 不再需要 h264decoder 和 numpy (numpy是cv2的依赖)
 
+import os
+import queue
+
+# 如果已有进程通过 SDK 的 camera.start_video_share() 发布视频帧，设置该环境变量为共享内存名称，
+# 界面直接读取共享内存中的帧，不再单独打开视频流重复解码
+VIDEO_SHARE_NAME = os.environ.get("ROBOMASTER_VIDEO_SHARE", "")
+
 class RoboMasterController(tk.Tk):
     """
     RoboMaster 图形化控制主窗口 (明文SDK - TCP模式)
@@ -343,14 +350,39 @@ class RoboMasterController(tk.Tk):
             self.video_label.image = None
 
 
+    def receive_shared_video_data(self):
+        """ 从共享内存读取其他进程已解码的视频帧 """
+        subscriber = None
+        try:
+            from robomaster import video_share
+            subscriber = video_share.FrameSubscriber(VIDEO_SHARE_NAME)
+            self.log(f"正在读取共享内存视频帧: {VIDEO_SHARE_NAME}")
+            while self.is_video_on:
+                try:
+                    frame, seq, ts = subscriber.read(timeout=1)
+                except queue.Empty:
+                    continue
+                # 帧直接指向共享内存，缩放后即不再引用
+                self.update_video_label(frame)
+        except Exception as e:
+            self.log(f"共享内存视频流错误: {e}")
+        finally:
+            if subscriber:
+                subscriber.close()
+            if self.is_video_on:
+                self.is_video_on = False
+                self.video_btn.config(text="开启视频")
+            self.log("视频流接收线程已退出。")
+
     def receive_video_data(self):
         """ 使用OpenCV VideoCapture直接处理TCP视频流 """
+        if VIDEO_SHARE_NAME:
+            return self.receive_shared_video_data()
         video_url = f"tcp://{self.robot_ip}:{self.video_port}"
         cap = None
         try:
             self.log(f"正在使用OpenCV连接视频流: {video_url}")
             # 设置OpenCV不进行缓冲，以降低延迟
-            import os
             os.environ["OPENCV_FFMPEG_CAPTURE_OPTIONS"] = "rtsp_transport;tcp"
             cap = cv2.VideoCapture(video_url, cv2.CAP_FFMPEG)
 
@@ -19,7 +19,7 @@ typedef unsigned char ubyte;
 #endif
 
 
-H264Decoder::H264Decoder()
+H264Decoder::H264Decoder(int thread_count, int thread_type)
   : pkt_{std::make_unique<AVPacket>()}
 {
 #if LIBAVCODEC_VERSION_INT < AV_VERSION_INT(58, 9, 100)
@@ -41,6 +41,9 @@ H264Decoder::H264Decoder()
   }
 #endif  
 
+  context->thread_count = thread_count;
+  context->thread_type = thread_type;
+
   int err = avcodec_open2(context, codec, nullptr);
   if (err < 0)
     throw H264InitFailure("cannot open context");
@@ -104,42 +107,81 @@ const AVFrame* H264Decoder::decode_frame()
 }
 
 
-ConverterRGB24::ConverterRGB24()
+const AVFrame* H264Decoder::drain()
+{
+#if (LIBAVCODEC_VERSION_MAJOR > 56)
+  if (!draining_)
+  {
+    // An empty packet puts the decoder into draining mode.
+    avcodec_send_packet(context, nullptr);
+    draining_ = true;
+  }
+  if (!avcodec_receive_frame(context, frame))
+    return frame;
+  avcodec_flush_buffers(context);
+  draining_ = false;
+#endif
+  return nullptr;
+}
+
+
+void H264Decoder::set_skip_nonref(bool skip)
+{
+  context->skip_frame = skip ? AVDISCARD_NONREF : AVDISCARD_DEFAULT;
+}
+
+
+static AVPixelFormat to_av_pix_fmt(PixelFormat format)
 {
-  framergb = av_frame_alloc();
-  if (!framergb)
+  switch (format)
+  {
+    case PixelFormat::BGR24: return AV_PIX_FMT_BGR24;
+    case PixelFormat::GRAY8: return AV_PIX_FMT_GRAY8;
+    case PixelFormat::YUV420P: return AV_PIX_FMT_YUV420P;
+    default: return AV_PIX_FMT_RGB24;
+  }
+}
+
+
+Converter::Converter(PixelFormat format)
+  : format_{format}
+{
+  frameout = av_frame_alloc();
+  if (!frameout)
     throw H264DecodeFailure("cannot allocate frame");
   context = nullptr;
 }
 
-ConverterRGB24::~ConverterRGB24()
+Converter::~Converter()
 {
   sws_freeContext(context);
-  av_frame_free(&framergb);
+  av_frame_free(&frameout);
 }
 
 
-const AVFrame& ConverterRGB24::convert(const AVFrame &frame, ubyte* out_rgb)
+const AVFrame& Converter::convert(const AVFrame &frame, ubyte* out)
 {
   int w = frame.width;
   int h = frame.height;
   int pix_fmt = frame.format;
+  AVPixelFormat out_fmt = to_av_pix_fmt(format_);
   
   context = sws_getCachedContext(context, 
                                  w, h, (AVPixelFormat)pix_fmt, 
-                                 w, h, AV_PIX_FMT_RGB24, SWS_BILINEAR,
+                                 w, h, out_fmt, SWS_BILINEAR,
                                  nullptr, nullptr, nullptr);
   if (!context)
     throw H264DecodeFailure("cannot allocate context");
   
-  // Setup framergb with out_rgb as external buffer. Also say that we want RGB24 output.
-  av_image_fill_arrays(framergb->data, framergb->linesize, out_rgb, AV_PIX_FMT_RGB24, w, h, 1);
+  // Setup frameout with out as external buffer in the requested output format.
+  av_image_fill_arrays(frameout->data, frameout->linesize, out, out_fmt, w, h, 1);
   // Do the conversion.
   sws_scale(context, frame.data, frame.linesize, 0, h,
-            framergb->data, framergb->linesize);
-  framergb->width = w;
-  framergb->height = h;
-  return *framergb;
+            frameout->data, frameout->linesize);
+  frameout->width = w;
+  frameout->height = h;
+  frameout->format = out_fmt;
+  return *frameout;
 }
 
 /*
@@ -150,9 +192,9 @@ to do this. However, avpicture_get_size returns the size of a compact
 representation, without padding bytes. Since we use av_image_fill_arrays to
 fill the buffer we should also use it to determine the required size.
 */
-int ConverterRGB24::predict_size(int w, int h)
+int Converter::predict_size(int w, int h)
 {
-  return av_image_fill_arrays(framergb->data, framergb->linesize, nullptr, AV_PIX_FMT_RGB24, w, h, 1);
+  return av_image_fill_arrays(frameout->data, frameout->linesize, nullptr, to_av_pix_fmt(format_), w, h, 1);
 }
 
 
@@ -167,6 +209,35 @@ int row_size(const AVFrame& f)
   return f.linesize[0];
 }
 
+const ubyte* plane_data(const AVFrame& f, int plane)
+{
+  return f.data[plane];
+}
+
+int plane_row_size(const AVFrame& f, int plane)
+{
+  return f.linesize[plane];
+}
+
+bool is_yuv420p(const AVFrame& f)
+{
+  // The full range variant only differs in the interpretation of the values.
+  return f.format == AV_PIX_FMT_YUV420P || f.format == AV_PIX_FMT_YUVJ420P;
+}
+
+AVFrame* frame_ref(const AVFrame& f)
+{
+  AVFrame* ref = av_frame_clone(&f);
+  if (!ref)
+    throw H264DecodeFailure("cannot reference frame");
+  return ref;
+}
+
+void free_frame_ref(AVFrame* f)
+{
+  av_frame_free(&f);
+}
+
 
 void disable_logging()
 {
@@ -49,6 +49,24 @@ public:
 };
 
 
+/* Mirrors FF_THREAD_FRAME and FF_THREAD_SLICE, so they can be or'ed together. */
+enum ThreadType
+{
+  THREAD_FRAME = 1,
+  THREAD_SLICE = 2
+};
+
+/* Output pixel formats of the converter. YUV420P means the planes of the
+decoded frame are handed out as they are, without running swscale. */
+enum class PixelFormat
+{
+  RGB24,
+  BGR24,
+  GRAY8,
+  YUV420P
+};
+
+
 struct ParseResult
 {
   ptrdiff_t num_bytes_consumed = 0;
@@ -69,11 +87,17 @@ to the encoded data, which must be kept around  between calls to
 parse- and decode frame. In release 11 it is put on the stack, too. 
   */
   std::unique_ptr<AVPacket> pkt_;
+  bool draining_ = false;
 
   const AVFrame* decode_frame();
 
 public:
-  H264Decoder();
+  /* thread_count = 1 decodes on the calling thread, 0 lets libav pick
+the number of threads from the cpu count. thread_type is a combination
+of ThreadType flags. Note that frame threading delays the output by
+thread_count-1 frames; use flush() at the end of a stream to get them.
+  */
+  H264Decoder(int thread_count = 1, int thread_type = THREAD_FRAME | THREAD_SLICE);
   ~H264Decoder();
   /* First, parse a continuous data stream, dividing it into 
 packets. When there is enough data to form a new frame, decode 
@@ -82,26 +106,43 @@ of consumed bytes of the input stream. It stops consuming
 bytes at frame boundaries.
   */
   ParseResult parse(const unsigned char* in_data, ptrdiff_t in_size);
+  /* Returns the frames still buffered in the decoder, one per call, after the
+end of the input. Returns nullptr when there is nothing left, at which point
+the decoder is reset and accepts new input again. */
+  const AVFrame* drain();
+  /* Skip decoding of frames no other frame refers to, which saves time when the
+consumer cannot keep up. Takes effect with the next packet. */
+  void set_skip_nonref(bool skip);
 };
 
-// TODO: Rename to OutputStage or so?!
-class ConverterRGB24
+
+class Converter
 {
   SwsContext *context;
-  AVFrame *framergb;
+  AVFrame *frameout;
+  PixelFormat format_;
   
 public:
-  ConverterRGB24();
-  ~ConverterRGB24();
+  Converter(PixelFormat format = PixelFormat::RGB24);
+  ~Converter();
+
+  PixelFormat format() const { return format_; }
    
   /*  Returns, given a width and height, 
       how many bytes the frame buffer is going to need. */
   int predict_size(int w, int h);
-  /*  Given a decoded frame, convert it to RGB format and fill 
-out_rgb with the result. Returns a AVFrame structure holding 
-additional information about the RGB frame, such as the number of
-bytes in a row and so on. */
-  const AVFrame& convert(const AVFrame &frame, unsigned char* out_rgb);
+  /*  Given a decoded frame, convert it to the output format and fill 
+out with the result. Returns a AVFrame structure holding 
+additional information about the output frame, such as the number of
+bytes in a row and the plane pointers into out. */
+  const AVFrame& convert(const AVFrame &frame, unsigned char* out);
+};
+
+
+class ConverterRGB24 : public Converter
+{
+public:
+  ConverterRGB24() : Converter(PixelFormat::RGB24) {}
 };
 
 void disable_logging();
@@ -109,6 +150,18 @@ void disable_logging();
 /* Wrappers, so we don't have to include libav headers. */
 std::pair<int, int> width_height(const AVFrame&);
 int row_size(const AVFrame&);
+/* Start of the given plane, and the number of bytes between two of its
+rows. The row stride may be larger than the visible
+width because libav pads the rows of decoded frames. */
+const unsigned char* plane_data(const AVFrame&, int plane);
+int plane_row_size(const AVFrame&, int plane);
+/* True if the planes of the decoded frame are laid out as YUV420P, so
+they can be handed out without conversion. */
+bool is_yuv420p(const AVFrame&);
+/* New reference to the buffers of a decoded frame, which keeps them alive
+after the decoder moved on. Release with free_frame_ref. */
+AVFrame* frame_ref(const AVFrame&);
+void free_frame_ref(AVFrame*);
 
 /* all the documentation links
  * My version of libav on ubuntu 16 appears to be from the release/11 branch on github
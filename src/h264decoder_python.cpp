@@ -4,10 +4,16 @@
 #include <string>
 
 #include <pybind11/pybind11.h>
+#include <pybind11/numpy.h>
 #include <pybind11/eval.h>
 #include <iostream>
+#include <mutex>
+#include <vector>
 
 #include "h264decoder.hpp"
+#ifdef H264DECODER_WITH_OPUS
+#include "opusdecoder.hpp"
+#endif
 
 namespace py = pybind11;
 
@@ -54,6 +60,98 @@ private:
 };
 
 
+/* Output memory of decode_many. A buffer returns to the pool when the last numpy array
+ * viewing it is released, so a steady stream of frames keeps reusing the same few buffers
+ * instead of allocating one per frame. get() is safe to call with the GIL released. */
+class BufferPool : public std::enable_shared_from_this<BufferPool>
+{
+public:
+  struct Buffer
+  {
+    std::shared_ptr<BufferPool> pool;
+    std::vector<ubyte> data;
+    ~Buffer() { pool->put(std::move(data)); }
+  };
+
+  explicit BufferPool(size_t max_free = 8) : max_free_(max_free) {}
+
+  std::unique_ptr<Buffer> get(size_t size)
+  {
+    auto buffer = std::make_unique<Buffer>();
+    buffer->pool = shared_from_this();
+    {
+      std::lock_guard<std::mutex> lock(mutex_);
+      if (!free_.empty())
+      {
+        buffer->data = std::move(free_.back());
+        free_.pop_back();
+      }
+    }
+    buffer->data.resize(size);
+    return buffer;
+  }
+
+private:
+  void put(std::vector<ubyte> &&data)
+  {
+    std::lock_guard<std::mutex> lock(mutex_);
+    if (free_.size() < max_free_)
+      free_.push_back(std::move(data));
+  }
+
+  size_t max_free_;
+  std::mutex mutex_;
+  std::vector<std::vector<ubyte>> free_;
+};
+
+
+/* Capsules owning the memory behind the returned arrays. */
+static py::capsule buffer_owner(std::unique_ptr<BufferPool::Buffer> buffer)
+{
+  return py::capsule(buffer.release(), [](void *b) { delete static_cast<BufferPool::Buffer*>(b); });
+}
+
+static py::capsule frame_owner(AVFrame *ref)
+{
+  return py::capsule(ref, [](void *f) { free_frame_ref(static_cast<AVFrame*>(f)); });
+}
+
+
+/* Pins the memory of every bytes-like object of the batch, so it can be read without the GIL.
+ * The returned buffer_infos must be released with the GIL held. */
+static std::vector<py::buffer_info> request_buffers(const py::iterable &buffers)
+{
+  std::vector<py::buffer_info> inputs;
+  for (auto item : buffers)
+  {
+    if (!PyObject_CheckBuffer(item.ptr()))
+      throw py::type_error("decode_many() expects a sequence of bytes-like objects");
+    inputs.push_back(py::reinterpret_borrow<py::buffer>(item).request());
+  }
+  return inputs;
+}
+
+
+/* Plane pointers and row strides of an output frame, copied out of the AVFrame, which the
+ * converter overwrites with the next frame. */
+struct Planes
+{
+  const ubyte *data[3] = {nullptr, nullptr, nullptr};
+  int rowsize[3] = {0, 0, 0};
+};
+
+static Planes planes_of(const AVFrame &frame)
+{
+  Planes planes;
+  for (int i = 0; i < 3; ++i)
+  {
+    planes.data[i] = plane_data(frame, i);
+    planes.rowsize[i] = plane_row_size(frame, i);
+  }
+  return planes;
+}
+
+
 py::object create_named_tuple_return_type()
 {
   py::exec("import typing");
@@ -65,9 +163,25 @@ py::object create_named_tuple_return_type()
 class PyH264Decoder
 {
   H264Decoder decoder;
-  ConverterRGB24 converter;
+  Converter converter;
+  /* No pixel format was requested: hand out RGB24 frames as bytes, like before. */
+  bool legacy_bytes;
+  std::shared_ptr<BufferPool> pool = std::make_shared<BufferPool>();
 
-  py::object create_frame(py::bytes data, int w, int h, int rowsize);
+  /* A frame of a decode_many batch, converted without the GIL and waiting to be wrapped. */
+  struct DecodedFrame
+  {
+    int w = 0, h = 0;
+    Planes planes;
+    std::unique_ptr<BufferPool::Buffer> buffer;
+    std::unique_ptr<AVFrame, void(*)(AVFrame*)> ref{nullptr, free_frame_ref};
+  };
+  DecodedFrame keep_frame(const AVFrame &frame);
+
+  py::object create_frame(py::object data, int w, int h, int rowsize);
+  /* Converts a decoded frame (or nullptr) to the python frame tuple. Called with the GIL released,
+   * returns with the GIL held. */
+  py::object output_frame(const AVFrame *frame, GILScopedReverseLock &gilguard);
   /* Extract frames from input stream. Stops at frame boundaries and returns the number of consumed bytes
    * in num_consumed.
    * 
@@ -79,55 +193,139 @@ class PyH264Decoder
    */ 
   py::tuple decode_frame_impl(const ubyte *data, ssize_t len, ssize_t &num_consumed, bool &is_frame_available);
 public:
+  /* pixel_format None keeps the old output: RGB24 in a bytes object.
+   * Any PixelFormat returns numpy arrays with the strides of the frame buffer, i.e. (h, w, 3) for RGB24 and BGR24,
+   * (h, w) for GRAY8 and a tuple of the (h, w), (h/2, w/2), (h/2, w/2) planes for YUV420P. */
+  PyH264Decoder(int thread_count, int thread_type, py::object pixel_format);
   /* Decoding style analogous to c/c++ way. Stop at frame boundaries. 
    * Return tuple containing frame data as above as nested tuple, and an integer telling how many bytes were consumed.  */
   py::tuple decode_frame(const py::bytes &data_in_str);
   /* Process all the input data and return a list of all contained frames. */
   py::list  decode(const py::bytes &data_in_str);
+  /* Decode a batch of input chunks, e.g. everything received since the last call, and return the frames
+   * of all of them, like concatenating the results of decode(). The GIL is released once for the whole
+   * batch, parsing, decoding and conversion included. The frames are numpy arrays in pooled buffers, which
+   * get reused once the arrays are released. Without a pixel format they are RGB24 (h, w, 3) arrays. */
+  py::list  decode_many(const py::iterable &buffers);
 
   py::list flush();
+
+  void set_skip_nonref(bool skip) { decoder.set_skip_nonref(skip); }
 };
 
 
-py::object PyH264Decoder::create_frame(py::bytes data, int w, int h, int rowsize)
+PyH264Decoder::PyH264Decoder(int thread_count, int thread_type, py::object pixel_format)
+  : decoder(thread_count, thread_type),
+    converter(pixel_format.is_none() ? PixelFormat::RGB24 : pixel_format.cast<PixelFormat>()),
+    legacy_bytes(pixel_format.is_none())
+{
+}
+
+
+py::object PyH264Decoder::create_frame(py::object data, int w, int h, int rowsize)
 {
   static auto frame_type = py::module::import("h264decoder").attr("Frame");
   return frame_type(data, w, h, rowsize);
 }
 
 
-py::tuple PyH264Decoder::decode_frame_impl(const ubyte *data_in, ssize_t len, ssize_t &num_consumed_out, bool &is_frame_available)
+/* Views of the three planes of a YUV420P frame. base keeps the memory alive. */
+static py::tuple yuv_planes(const Planes &planes, int w, int h, py::handle base)
 {
-  GILScopedReverseLock gilguard;
-  
-  const auto [num_consumed, frame] = decoder.parse(data_in, len);
-  num_consumed_out = num_consumed;
-  is_frame_available = frame != nullptr;
+  auto plane = [&](int i, int pw, int ph) {
+    return py::array(py::dtype::of<ubyte>(), {ph, pw}, {planes.rowsize[i], 1}, planes.data[i], base);
+  };
+  int cw = (w + 1) / 2, ch = (h + 1) / 2;
+  return py::make_tuple(plane(0, w, h), plane(1, cw, ch), plane(2, cw, ch));
+}
+
 
-  if (frame)
+/* Numpy view of a converted frame in the given pixel format. base keeps the memory alive. */
+static py::object array_view(PixelFormat format, const Planes &planes, int w, int h, py::handle base)
+{
+  switch (format)
   {
-    int w, h; std::tie(w,h) = width_height(*frame);
-    Py_ssize_t out_size = converter.predict_size(w,h);
+    case PixelFormat::GRAY8:
+      return py::array(py::dtype::of<ubyte>(), {h, w}, {planes.rowsize[0], 1}, planes.data[0], base);
+    case PixelFormat::YUV420P:
+      return yuv_planes(planes, w, h, base);
+    default:
+      return py::array(py::dtype::of<ubyte>(), {h, w, 3}, {planes.rowsize[0], 3, 1}, planes.data[0], base);
+  }
+}
 
+
+/* The planes handed out without conversion are still referenced by the decoder. */
+static void set_read_only(py::tuple planes)
+{
+  for (auto plane : planes)
+    plane.attr("setflags")(py::arg("write") = false);
+}
+
+
+py::object PyH264Decoder::output_frame(const AVFrame *frame, GILScopedReverseLock &gilguard)
+{
+  if (!frame)
+  {
     gilguard.lock();
+    return create_frame(py::bytes(), 0, 0, 0);
+  }
 
-    // Allocate storage for the frame
-    // Pybind11 takes ownership over the created buffer.
-    py::bytes py_out_str = py::reinterpret_steal<py::bytes>(PyBytes_FromStringAndSize(nullptr, out_size));
-    char* out_buffer = PyBytes_AsString(py_out_str.ptr());
+  int w, h; std::tie(w,h) = width_height(*frame);
 
-    // Copy the final frame into the buffer
-    gilguard.unlock();
-    const auto &rgbframe = converter.convert(*frame, (ubyte*)out_buffer);
+  if (converter.format() == PixelFormat::YUV420P && is_yuv420p(*frame))
+  {
+    // No swscale at all. The planes are views into the decoder's own buffers, which
+    // stay alive through the frame reference owned by the capsule.
+    AVFrame *ref = frame_ref(*frame);
     gilguard.lock();
+    py::capsule owner = frame_owner(ref);
+    py::tuple planes = yuv_planes(planes_of(*ref), w, h, owner);
+    set_read_only(planes);
+    return create_frame(planes, w, h, plane_row_size(*ref, 0));
+  }
+
+  Py_ssize_t out_size = converter.predict_size(w,h);
 
-    return create_frame(py_out_str, w, h, row_size(rgbframe));
+  gilguard.lock();
+
+  // Allocate storage for the frame
+  // Pybind11 takes ownership over the created buffer.
+  py::object py_out;
+  ubyte* out_buffer;
+  if (legacy_bytes)
+  {
+    py_out = py::reinterpret_steal<py::bytes>(PyBytes_FromStringAndSize(nullptr, out_size));
+    out_buffer = reinterpret_cast<ubyte*>(PyBytes_AsString(py_out.ptr()));
   }
   else
   {
-    gilguard.lock();
-    return create_frame(py::bytes(), 0, 0, 0);
+    py::array_t<ubyte> py_out_array(out_size);
+    out_buffer = py_out_array.mutable_data();
+    py_out = py_out_array;
   }
+
+  // Copy the final frame into the buffer
+  gilguard.unlock();
+  const auto &outframe = converter.convert(*frame, out_buffer);
+  gilguard.lock();
+
+  int rowsize = row_size(outframe);
+  if (!legacy_bytes)
+    py_out = array_view(converter.format(), planes_of(outframe), w, h, py_out);
+  return create_frame(py_out, w, h, rowsize);
+}
+
+
+py::tuple PyH264Decoder::decode_frame_impl(const ubyte *data_in, ssize_t len, ssize_t &num_consumed_out, bool &is_frame_available)
+{
+  GILScopedReverseLock gilguard;
+  
+  const auto [num_consumed, frame] = decoder.parse(data_in, len);
+  num_consumed_out = num_consumed;
+  is_frame_available = frame != nullptr;
+
+  return output_frame(frame, gilguard);
 }
 
 
@@ -182,6 +380,68 @@ py::list PyH264Decoder::decode(const py::bytes &data_in_str)
 }
 
 
+PyH264Decoder::DecodedFrame PyH264Decoder::keep_frame(const AVFrame &frame)
+{
+  DecodedFrame out;
+  std::tie(out.w, out.h) = width_height(frame);
+  if (converter.format() == PixelFormat::YUV420P && is_yuv420p(frame))
+  {
+    out.ref.reset(frame_ref(frame));
+    out.planes = planes_of(*out.ref);
+    return out;
+  }
+  out.buffer = pool->get(converter.predict_size(out.w, out.h));
+  out.planes = planes_of(converter.convert(frame, out.buffer->data.data()));
+  return out;
+}
+
+
+py::list PyH264Decoder::decode_many(const py::iterable &buffers)
+{
+  auto inputs = request_buffers(buffers);
+  std::vector<DecodedFrame> decoded;
+  {
+    GILScopedReverseLock gilguard;
+    for (const auto &input : inputs)
+    {
+      auto data_in = static_cast<const ubyte*>(input.ptr);
+      ssize_t len = input.size * input.itemsize;
+      bool was_data_consumed = true;
+      while (len > 0)
+      {
+        const auto [num_consumed, frame] = decoder.parse(data_in, len);
+        if (frame)
+          decoded.push_back(keep_frame(*frame));
+        // Same stall detection as in decode().
+        if (!frame && num_consumed == 0 && !was_data_consumed)
+          throw H264DecodeFailure("Cannot decode any more data");
+        len -= num_consumed;
+        data_in += num_consumed;
+        was_data_consumed = num_consumed>0;
+      }
+    }
+  }
+
+  py::list out;
+  for (auto &frame : decoded)
+  {
+    py::object data;
+    if (frame.ref)
+    {
+      py::tuple planes = yuv_planes(frame.planes, frame.w, frame.h, frame_owner(frame.ref.release()));
+      set_read_only(planes);
+      data = planes;
+    }
+    else
+    {
+      data = array_view(converter.format(), frame.planes, frame.w, frame.h, buffer_owner(std::move(frame.buffer)));
+    }
+    out.append(create_frame(data, frame.w, frame.h, frame.planes.rowsize[0]));
+  }
+  return out;
+}
+
+
 py::list PyH264Decoder::flush()
 {
     bool is_frame_available = false;
@@ -196,23 +456,150 @@ py::list PyH264Decoder::flush()
       }
     } 
     while (is_frame_available);
+    // Collect the frames which the decoder still holds back, e.g. because of frame threading.
+    while (true)
+    {
+      GILScopedReverseLock gilguard;
+      const AVFrame *frame = decoder.drain();
+      if (!frame)
+        break;
+      out.append(output_frame(frame, gilguard));
+    }
     return out;
 }
 
 
+#ifdef H264DECODER_WITH_OPUS
+/* Opus counterpart of PyH264Decoder with the same decode/decode_many interface.
+ * Every input buffer is one Opus packet and yields one frame: a numpy int16 array of shape
+ * (samples,) for mono and (samples, channels) otherwise. A corrupt packet yields an empty frame,
+ * so the frames of a batch line up with its packets. */
+class PyOpusDecoder
+{
+  OpusStreamDecoder decoder;
+  std::shared_ptr<BufferPool> pool = std::make_shared<BufferPool>();
+
+  using DecodedFrame = std::pair<std::unique_ptr<BufferPool::Buffer>, int>;
+  /* Called without the GIL. */
+  DecodedFrame decode_packet(const ubyte *data, ssize_t len);
+  py::object wrap(DecodedFrame &frame);
+public:
+  PyOpusDecoder(int sample_rate, int channels, int max_frame_size);
+
+  py::object decode(const py::buffer &data);
+  /* Decode a batch of packets, releasing the GIL once for all of them. */
+  py::list decode_many(const py::iterable &buffers);
+
+  int sample_rate() const { return decoder.sample_rate(); }
+  int channels() const { return decoder.channels(); }
+};
+
+
+PyOpusDecoder::PyOpusDecoder(int sample_rate, int channels, int max_frame_size)
+  : decoder(sample_rate, channels, max_frame_size)
+{
+}
+
+
+PyOpusDecoder::DecodedFrame PyOpusDecoder::decode_packet(const ubyte *data, ssize_t len)
+{
+  auto buffer = pool->get(sizeof(int16_t) * decoder.max_frame_size() * decoder.channels());
+  int samples = 0;
+  try
+  {
+    samples = decoder.decode(data, len, reinterpret_cast<int16_t*>(buffer->data.data()));
+  }
+  catch (const OpusDecodeFailure &)
+  {
+    // Lost or damaged packets are common on the wire, skip them.
+  }
+  return DecodedFrame(std::move(buffer), samples);
+}
+
+
+py::object PyOpusDecoder::wrap(DecodedFrame &frame)
+{
+  auto data = reinterpret_cast<const int16_t*>(frame.first->data.data());
+  ssize_t samples = frame.second, channels = decoder.channels();
+  py::capsule owner = buffer_owner(std::move(frame.first));
+  if (channels == 1)
+    return py::array(py::dtype::of<int16_t>(), {samples}, {ssize_t(sizeof(int16_t))}, data, owner);
+  return py::array(py::dtype::of<int16_t>(), {samples, channels},
+                   {ssize_t(sizeof(int16_t)) * channels, ssize_t(sizeof(int16_t))}, data, owner);
+}
+
+
+py::object PyOpusDecoder::decode(const py::buffer &data)
+{
+  auto input = data.request();
+  DecodedFrame frame;
+  {
+    GILScopedReverseLock gilguard;
+    frame = decode_packet(static_cast<const ubyte*>(input.ptr), input.size * input.itemsize);
+  }
+  return wrap(frame);
+}
+
+
+py::list PyOpusDecoder::decode_many(const py::iterable &buffers)
+{
+  auto inputs = request_buffers(buffers);
+  std::vector<DecodedFrame> decoded;
+  decoded.reserve(inputs.size());
+  {
+    GILScopedReverseLock gilguard;
+    for (const auto &input : inputs)
+      decoded.push_back(decode_packet(static_cast<const ubyte*>(input.ptr), input.size * input.itemsize));
+  }
+
+  py::list out;
+  for (auto &frame : decoded)
+    out.append(wrap(frame));
+  return out;
+}
+#endif
+
+
 PYBIND11_MODULE(h264decoder, m)
 {
   PyEval_InitThreads(); // need for release of the GIL (http://stackoverflow.com/questions/8009613/boost-python-not-supporting-parallelism)
 
   m.attr("__setattr__")("Frame",create_named_tuple_return_type());
 
+  py::enum_<PixelFormat>(m, "PixelFormat")
+                            .value("RGB24", PixelFormat::RGB24)
+                            .value("BGR24", PixelFormat::BGR24)
+                            .value("GRAY8", PixelFormat::GRAY8)
+                            .value("YUV420P", PixelFormat::YUV420P);
+  m.attr("THREAD_FRAME") = static_cast<int>(THREAD_FRAME);
+  m.attr("THREAD_SLICE") = static_cast<int>(THREAD_SLICE);
+
   py::class_<PyH264Decoder>(m, "H264Decoder")
-                            .def(py::init<>())
+                            .def(py::init<int, int, py::object>(),
+                                 py::arg("thread_count") = 1,
+                                 py::arg("thread_type") = THREAD_FRAME | THREAD_SLICE,
+                                 py::arg("pixel_format") = py::none())
                             .def("decode_frame", &PyH264Decoder::decode_frame)
                             .def("decode", &PyH264Decoder::decode)
-                            .def("flush", &PyH264Decoder::flush);
+                            .def("decode_many", &PyH264Decoder::decode_many, py::arg("buffers"))
+                            .def("flush", &PyH264Decoder::flush)
+                            .def("set_skip_nonref", &PyH264Decoder::set_skip_nonref, py::arg("skip"));
   m.def("disable_logging", disable_logging);
   py::register_exception<H264Exception>(m, "H264Exception");
   py::register_exception<H264InitFailure>(m, "H264InitFailure");
   py::register_exception<H264DecodeFailure>(m, "H264DecodeFailure");
+
+#ifdef H264DECODER_WITH_OPUS
+  py::class_<PyOpusDecoder>(m, "OpusDecoder")
+                            .def(py::init<int, int, int>(),
+                                 py::arg("sample_rate") = 48000,
+                                 py::arg("channels") = 1,
+                                 py::arg("max_frame_size") = 5760)
+                            .def("decode", &PyOpusDecoder::decode, py::arg("input"))
+                            .def("decode_many", &PyOpusDecoder::decode_many, py::arg("buffers"))
+                            .def_property_readonly("sample_rate", &PyOpusDecoder::sample_rate)
+                            .def_property_readonly("channels", &PyOpusDecoder::channels);
+  py::register_exception<OpusException>(m, "OpusException");
+  py::register_exception<OpusInitFailure>(m, "OpusInitFailure");
+#endif
 }
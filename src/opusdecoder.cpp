@@ -0,0 +1,29 @@
+#include <opus/opus.h>
+
+#include "opusdecoder.hpp"
+
+
+OpusStreamDecoder::OpusStreamDecoder(int sample_rate, int channels, int max_frame_size)
+  : sample_rate_{sample_rate}, channels_{channels}, max_frame_size_{max_frame_size}
+{
+  int err = 0;
+  decoder = opus_decoder_create(sample_rate, channels, &err);
+  if (err < 0 || !decoder)
+    throw OpusInitFailure("cannot create opus decoder");
+}
+
+
+OpusStreamDecoder::~OpusStreamDecoder()
+{
+  opus_decoder_destroy(decoder);
+}
+
+
+int OpusStreamDecoder::decode(const unsigned char* in_data, std::ptrdiff_t in_size, int16_t* out)
+{
+  int samples = opus_decode(decoder, in_data, static_cast<opus_int32>(in_size),
+                            reinterpret_cast<opus_int16*>(out), max_frame_size_, 0);
+  if (samples < 0)
+    throw OpusDecodeFailure("cannot decode opus packet");
+  return samples;
+}
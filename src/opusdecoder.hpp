@@ -0,0 +1,59 @@
+#pragma once
+/*
+Thin wrapper around libopus, the audio counterpart of H264Decoder. The
+RoboMaster audio stream sends one Opus packet per message, so there is no
+parser: every call decodes exactly one packet into interleaved 16 bit PCM.
+
+Like the video decoder, errors are reported by exceptions which the
+python module forwards.
+*/
+
+#include <cstdint>
+#include <stdexcept>
+
+struct OpusDecoder;
+
+
+class OpusException : public std::runtime_error
+{
+public:
+  OpusException(const char* s) : std::runtime_error(s) {}
+};
+
+class OpusInitFailure : public OpusException
+{
+public:
+  OpusInitFailure(const char* s) : OpusException(s) {}
+};
+
+class OpusDecodeFailure : public OpusException
+{
+public:
+  OpusDecodeFailure(const char* s) : OpusException(s) {}
+};
+
+
+class OpusStreamDecoder
+{
+  OpusDecoder *decoder;
+  int sample_rate_;
+  int channels_;
+  int max_frame_size_;
+
+public:
+  /* max_frame_size is the largest number of samples per channel a single packet may
+decode to. 5760 covers the longest Opus packet (120 ms) at 48 kHz. */
+  OpusStreamDecoder(int sample_rate = 48000, int channels = 1, int max_frame_size = 5760);
+  ~OpusStreamDecoder();
+
+  OpusStreamDecoder(const OpusStreamDecoder &) = delete;
+  OpusStreamDecoder& operator=(const OpusStreamDecoder &) = delete;
+
+  int sample_rate() const { return sample_rate_; }
+  int channels() const { return channels_; }
+  int max_frame_size() const { return max_frame_size_; }
+
+  /* Decodes one packet into out, which must hold max_frame_size * channels samples.
+Returns the number of samples per channel. Throws OpusDecodeFailure on corrupt packets. */
+  int decode(const unsigned char* in_data, std::ptrdiff_t in_size, int16_t* out);
+};
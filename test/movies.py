@@ -37,7 +37,16 @@ def create_frames_short_movie() -> Tuple[np.ndarray,str]:
     return frames, 'twoframes.h264'
 
 
-def _write_frames_as_h264(frames : np.ndarray, filename):
+def create_frames_yuv420p() -> Tuple[np.ndarray,str]:
+    '''
+        The moving blob again, encoded with 4:2:0 chroma subsampling. movingdot.h264 is 4:4:4
+        because libx264 keeps the chroma resolution of the rgb input.
+    '''
+    frames, _ = create_frames()
+    return frames, 'movingdot420.h264'
+
+
+def _write_frames_as_h264(frames : np.ndarray, filename, pix_fmt=None):
     '''
         Writes frames to files, then converts to h264 raw stream using ffmpeg.
     '''
@@ -48,7 +57,8 @@ def _write_frames_as_h264(frames : np.ndarray, filename):
         for i,img in enumerate(frames):
             img = Image.fromarray(img, 'RGB')
             img.save(os.path.join(tmpdirname,f'frame{i:03d}.png'))
-        subprocess.check_call(['ffmpeg', '-y', '-i', os.path.join(tmpdirname,r'frame%3d.png'), '-c:v', 'libx264', '-f', 'h264', filename])
+        pix_fmt_args = ['-pix_fmt', pix_fmt] if pix_fmt else []
+        subprocess.check_call(['ffmpeg', '-y', '-i', os.path.join(tmpdirname,r'frame%3d.png'), '-c:v', 'libx264', *pix_fmt_args, '-f', 'h264', filename])
 
 
 if __name__ == '__main__':
@@ -56,4 +66,6 @@ if __name__ == '__main__':
     frames, filename = create_frames()
     _write_frames_as_h264(frames,filename)
     frames, filename = create_frames_short_movie()
-    _write_frames_as_h264(frames,filename)
\ No newline at end of file
+    _write_frames_as_h264(frames,filename)
+    frames, filename = create_frames_yuv420p()
+    _write_frames_as_h264(frames,filename,pix_fmt='yuv420p')
\ No newline at end of file
@@ -6,6 +6,7 @@ import itertools
 import threading
 import queue
 import io
+import pytest
 
 import h264decoder
 import movies
@@ -14,6 +15,10 @@ def test_module_definitions():
     assert hasattr(h264decoder, "H264Decoder")
     assert hasattr(h264decoder, "Frame")
     assert inspect.getdoc(h264decoder.Frame) != ''
+    assert hasattr(h264decoder, "PixelFormat")
+    assert hasattr(h264decoder, "THREAD_FRAME")
+    assert hasattr(h264decoder, "THREAD_SLICE")
+    assert hasattr(h264decoder.H264Decoder, "decode_many")
 
 
 def frame_to_numpy(frame : h264decoder.Frame):
@@ -129,6 +134,139 @@ def test_streaming_like():
     assert len(expected_frames)-MAX_FRAMES_LOST_TO_CORRUPTION-LATENCY_FRAMES <= len(decoded_frames) <= len(expected_frames)
 
 
+def _decode_movie_with(filename, **kwargs):
+    dir = Path(__file__).parent
+    with open(dir / filename,'rb') as f:
+        content = f.read()
+    decoder = h264decoder.H264Decoder(**kwargs)
+    return _feed_decoder(decoder, content, max_feed_length=None, do_flush=True)
+
+
+def test_pixel_formats():
+    '''
+    Frames of an explicit pixel format are numpy arrays which can be used without stripping any padding.
+    '''
+    expected_frames, filename = movies.create_frames()
+    H, W = expected_frames.shape[1:3]
+
+    reference = [ frame_to_numpy(f) for f in _decode_movie_with(filename) ]
+    assert reference
+
+    frames = _decode_movie_with(filename, pixel_format=h264decoder.PixelFormat.RGB24)
+    assert len(frames) == len(reference)
+    for frame, ref in zip(frames, reference):
+        assert isinstance(frame.data, np.ndarray) and frame.data.shape == (H, W, 3)
+        assert np.array_equal(frame.data, ref)
+
+    frames = _decode_movie_with(filename, pixel_format=h264decoder.PixelFormat.BGR24)
+    assert len(frames) == len(reference)
+    for frame, ref in zip(frames, reference):
+        assert np.array_equal(frame.data, ref[...,::-1])
+
+    frames = _decode_movie_with(filename, pixel_format=h264decoder.PixelFormat.GRAY8)
+    assert len(frames) == len(reference)
+    for frame, ref in zip(frames, reference):
+        assert frame.data.shape == (H, W)
+        # The movie is gray, so any channel will do.
+        assert np.allclose(np.int32(frame.data), np.int32(ref[...,0]), atol = 2)
+
+    frames = _decode_movie_with(filename, pixel_format=h264decoder.PixelFormat.YUV420P)
+    assert len(frames) == len(reference)
+    for frame, ref in zip(frames, reference):
+        y, u, v = frame.data
+        assert y.shape == (H, W) and u.shape == (H//2, W//2) and v.shape == (H//2, W//2)
+        assert y.strides[0] == frame.rowsize and y.strides[1] == 1
+        # Limited range luma, no chroma in a gray movie.
+        assert np.allclose(16 + np.int32(ref[...,0])*219/255, np.int32(y), atol = 3)
+        assert np.allclose(np.int32(u), 128, atol = 3) and np.allclose(np.int32(v), 128, atol = 3)
+        # The 4:4:4 movie goes through swscale, so the planes are our own copy.
+        assert y.flags.writeable
+
+
+def test_yuv420p_zero_copy():
+    '''
+    A 4:2:0 movie is handed out as views into the decoder's buffers, which stay valid while decoding goes on.
+    '''
+    expected_frames, filename = movies.create_frames_yuv420p()
+    H, W = expected_frames.shape[1:3]
+
+    reference = [ frame_to_numpy(f) for f in _decode_movie_with(filename) ]
+    assert reference
+
+    frames = _decode_movie_with(filename, pixel_format=h264decoder.PixelFormat.YUV420P)
+    assert len(frames) == len(reference)
+    for frame, ref in zip(frames, reference):
+        y, u, v = frame.data
+        assert y.shape == (H, W) and u.shape == (H//2, W//2) and v.shape == (H//2, W//2)
+        # Views, not copies, so they must not be written to.
+        assert not any(plane.flags.writeable or plane.flags.owndata for plane in (y, u, v))
+        assert y.strides[0] == frame.rowsize
+        # All frames are alive at once, so none of them may have been overwritten by a later one.
+        assert np.allclose(16 + np.int32(ref[...,0])*219/255, np.int32(y), atol = 3)
+        assert np.allclose(np.int32(u), 128, atol = 3) and np.allclose(np.int32(v), 128, atol = 3)
+
+    # The batch interface takes the same path.
+    with open(Path(__file__).parent / filename,'rb') as f:
+        content = f.read()
+    decoder = h264decoder.H264Decoder(pixel_format=h264decoder.PixelFormat.YUV420P)
+    frames = decoder.decode_many([content]) + decoder.flush()
+    assert len(frames) == len(reference)
+    for frame, ref in zip(frames, reference):
+        y = frame.data[0]
+        assert not y.flags.writeable
+        assert np.allclose(16 + np.int32(ref[...,0])*219/255, np.int32(y), atol = 3)
+
+
+def test_threading_options():
+    expected_frames, filename = movies.create_frames()
+    LATENCY_FRAMES=5
+    for thread_type in (h264decoder.THREAD_FRAME, h264decoder.THREAD_SLICE, h264decoder.THREAD_FRAME | h264decoder.THREAD_SLICE):
+        decoded_frames = _decode_movie_with(filename, thread_count=4, thread_type=thread_type)
+        # Flushing hands out the frames held back by frame threading.
+        assert len(expected_frames)-LATENCY_FRAMES <= len(decoded_frames) <= len(expected_frames), f"Number of decoded frames: {len(decoded_frames)} vs expected {len(expected_frames)}"
+        _compare_frames_eq(expected_frames[:len(decoded_frames)], decoded_frames)
+
+
+def test_decode_many():
+    '''
+    Decoding batches of chunks yields the same frames as feeding the chunks one by one.
+    '''
+    expected_frames, filename = movies.create_frames()
+    dir = Path(__file__).parent
+    with open(dir / filename,'rb') as f:
+        content = f.read()
+    chunks = [ chunk.tobytes() for chunk in np.array_split(np.frombuffer(content, dtype=np.uint8), len(content)//128) ]
+
+    reference = h264decoder.H264Decoder(pixel_format=h264decoder.PixelFormat.RGB24)
+    reference_frames = sum((reference.decode(chunk) for chunk in chunks), [])
+    assert reference_frames
+
+    decoder = h264decoder.H264Decoder(pixel_format=h264decoder.PixelFormat.RGB24)
+    half = len(chunks)//2
+    decoded_frames = decoder.decode_many(chunks[:half]) + decoder.decode_many(chunks[half:])
+    assert len(decoded_frames) == len(reference_frames)
+    for frame, ref in zip(decoded_frames, reference_frames):
+        assert np.array_equal(frame.data, ref.data)
+
+    # Without a pixel format the frames are RGB24 arrays as well, not bytes.
+    decoded_frames = h264decoder.H264Decoder().decode_many(chunks)
+    assert len(decoded_frames) == len(reference_frames)
+    assert all(isinstance(frame.data, np.ndarray) and frame.data.shape[2] == 3 for frame in decoded_frames)
+
+
+def test_opus_decoder():
+    if not hasattr(h264decoder, "OpusDecoder"):
+        pytest.skip("h264decoder is built without libopus")
+    decoder = h264decoder.OpusDecoder()
+    assert decoder.sample_rate == 48000 and decoder.channels == 1
+    # A single TOC byte for 20 ms of CELT is a valid, empty packet. Adding frame count code 3
+    # without the count byte makes it invalid, which gives an empty frame.
+    frames = decoder.decode_many([b'\xf8', b'\xfb', bytearray(b'\xf8')])
+    assert [ frame.shape for frame in frames ] == [ (960,), (0,), (960,) ]
+    assert all(frame.dtype == np.int16 for frame in frames)
+    assert decoder.decode(b'\xf8').shape == (960,)
+
+
 def test_multithreading():
     '''
     Running two decoders in parallel.
@@ -189,4 +327,9 @@ if __name__ == '__main__':
     test_module_definitions()
     test_short_movie()
     test_streaming_like()
+    test_pixel_formats()
+    test_yuv420p_zero_copy()
+    test_threading_options()
+    test_decode_many()
+    test_opus_decoder()
     test_multithreading()
@@ -0,0 +1,69 @@
+import sys
+from pathlib import Path
+
+# The sdk is imported straight from the source tree.
+sys.path.insert(0, str(Path(__file__).parent.parent / 'RoboMaster-SDK-master' / 'src'))
+
+from robomaster import conn
+
+# NAL units with a 4 byte start code, the byte after a slice NAL header has first_mb_in_slice == 0.
+SPS = b'\x00\x00\x00\x01\x67\x42\x00\x1f'
+PPS = b'\x00\x00\x00\x01\x68\xce\x3c\x80'
+IDR = b'\x00\x00\x00\x01\x65\x88\x84\x00\x33'
+# a second slice of the same picture, first_mb_in_slice != 0.
+IDR_SLICE = b'\x00\x00\x01\x65\x40\x11\x22'
+P = b'\x00\x00\x00\x01\x41\x9a\x02\x10'
+B = b'\x00\x00\x00\x01\x01\x9e\x04\x20'
+
+
+def _stream():
+    '''
+    Returns the access units of a short stream, as (data, is_idr, is_ref).
+    '''
+    return [
+        (SPS + PPS + IDR + IDR_SLICE, True, True),
+        (P, False, True),
+        (B, False, False),
+        (P, False, True),
+    ]
+
+
+def _split(data, chunk, size=conn.STREAM_RECV_BUF_SIZE):
+    splitter = conn.H264AccessUnitSplitter(size)
+    aus = []
+    for pos in range(0, len(data), chunk):
+        aus.extend(splitter.feed(data[pos:pos + chunk]))
+    return aus
+
+
+def test_access_units():
+    expected = _stream()
+    data = b''.join(au for au, _, _ in expected)
+    # the last access unit only ends with the start code of the next one.
+    data += SPS
+    aus = _split(data, len(data))
+    assert aus == expected
+
+
+def test_split_reads():
+    expected = _stream()
+    data = b''.join(au for au, _, _ in expected) + SPS
+    for chunk in (1, 2, 3, 4, 5, 7, 11):
+        assert _split(data, chunk) == expected, chunk
+
+
+def test_buffer_growth():
+    '''
+    The buffer is compacted and grown when an access unit does not fit.
+    '''
+    big = b'\x00\x00\x00\x01\x41\x9a' + bytes(range(1, 256)) * 40
+    expected = [(IDR, True, True), (big, False, True), (P, False, True)]
+    data = b''.join(au for au, _, _ in expected) + SPS
+    assert _split(data, 64, size=256) == expected
+    assert _split(data, 3000, size=256) == expected
+
+
+if __name__ == '__main__':
+    test_access_units()
+    test_split_reads()
+    test_buffer_growth()
@@ -0,0 +1,133 @@
+import sys
+import struct
+from pathlib import Path
+
+# The sdk is imported straight from the source tree.
+sys.path.insert(0, str(Path(__file__).parent.parent / 'RoboMaster-SDK-master' / 'src'))
+
+from robomaster import protocol
+
+
+def _frame(msg_id, values=(1.0, 2.0, 3.0)):
+    '''
+    Builds a complete v1 chassis position push frame.
+    '''
+    proto = protocol.ProtoPushPeriodMsg()
+    payload = bytes([3, msg_id]) + struct.pack('<fff', *values)
+    proto.pack_req = lambda: payload
+    return bytes(protocol.Msg(0x03, 0x09, proto).pack())
+
+
+def _msg_ids(msgs):
+    return [msg._buf[1] for msg in msgs]
+
+
+def test_whole_frames():
+    frames = [_frame(i) for i in range(1, 4)]
+    decoder = protocol.MsgDecoder()
+    msgs = decoder.feed(b''.join(frames))
+    assert _msg_ids(msgs) == [1, 2, 3]
+    for msg, frame in zip(msgs, frames):
+        assert bytes(msg._frame) == frame
+        assert msg._cmdset == 0x48 and msg._cmdid == 0x08
+        assert struct.unpack('<fff', bytes(msg._buf[2:])) == (1.0, 2.0, 3.0)
+    assert decoder.dropped == 0
+
+
+def test_split_frames():
+    data = b''.join(_frame(i) for i in range(1, 4))
+    for chunk in (1, 2, 3, 5, 7, 13, len(data) - 1):
+        decoder = protocol.MsgDecoder()
+        msgs = []
+        for pos in range(0, len(data), chunk):
+            msgs.extend(decoder.feed(data[pos:pos + chunk]))
+        assert _msg_ids(msgs) == [1, 2, 3], chunk
+        assert decoder.dropped == 0
+
+
+def test_bad_magic():
+    decoder = protocol.MsgDecoder()
+    garbage = b'\x00\x11\x22\x33\x44'
+    msgs = decoder.feed(garbage + _frame(1) + b'\xcc' + _frame(2))
+    assert _msg_ids(msgs) == [1, 2]
+    assert decoder.dropped == len(garbage) + 1
+
+
+def test_bad_crc8():
+    frame = bytearray(_frame(1))
+    frame[3] ^= 0xff
+    decoder = protocol.MsgDecoder()
+    msgs = decoder.feed(bytes(frame) + _frame(2))
+    assert _msg_ids(msgs) == [2]
+    # the broken frame is skipped byte by byte until the next magic.
+    assert decoder.dropped == len(frame)
+
+
+def test_bad_crc16():
+    frame = bytearray(_frame(1))
+    frame[-1] ^= 0xff
+    decoder = protocol.MsgDecoder()
+    msgs = decoder.feed(bytes(frame) + _frame(2))
+    assert _msg_ids(msgs) == [2]
+    assert decoder.dropped == len(frame)
+
+
+def test_bad_length():
+    # a header with a valid crc8 but a length shorter than the minimal frame.
+    header = bytearray([0x55, 4, 0x04])
+    header.append(protocol.algo.crc8_calc(bytes(header)))
+    decoder = protocol.MsgDecoder()
+    msgs = decoder.feed(bytes(header) + _frame(1))
+    assert _msg_ids(msgs) == [1]
+    assert decoder.dropped == len(header)
+
+
+def test_bad_frame_split():
+    # resync has to work the same way when the broken frame spans several reads.
+    frame = bytearray(_frame(1))
+    frame[-1] ^= 0xff
+    data = bytes(frame) + _frame(2) + _frame(3)
+    decoder = protocol.MsgDecoder()
+    msgs = []
+    for pos in range(0, len(data), 6):
+        msgs.extend(decoder.feed(data[pos:pos + 6]))
+    assert _msg_ids(msgs) == [2, 3]
+    assert decoder.dropped == len(frame)
+
+
+def test_view_lifetime():
+    '''
+    Decoded messages share memory with the input, later reads must not change them.
+    '''
+    first, second = _frame(1), _frame(2)
+    decoder = protocol.MsgDecoder()
+    buf = bytearray(first + second[:5])
+    msgs = decoder.feed(buf)
+    # a receive buffer is reused for the next read.
+    buf[:] = b'\x00' * len(buf)
+    tail = bytearray(second[5:])
+    msgs.extend(decoder.feed(memoryview(tail)))
+    tail[:] = b'\x00' * len(tail)
+    assert _msg_ids(msgs) == [1, 2]
+    assert bytes(msgs[0]._frame) == first
+    assert bytes(msgs[1]._frame) == second
+
+
+def test_reset():
+    decoder = protocol.MsgDecoder()
+    frame = _frame(1)
+    assert decoder.feed(frame[:7]) == []
+    decoder.reset()
+    assert _msg_ids(decoder.feed(frame)) == [1]
+
+
+if __name__ == '__main__':
+    test_whole_frames()
+    test_split_frames()
+    test_bad_magic()
+    test_bad_crc8()
+    test_bad_crc16()
+    test_bad_length()
+    test_bad_frame_split()
+    test_view_lifetime()
+    test_reset()
@@ -0,0 +1,130 @@
+import sys
+import time
+import struct
+import tempfile
+from pathlib import Path
+
+# The sdk is imported straight from the source tree.
+sys.path.insert(0, str(Path(__file__).parent.parent / 'RoboMaster-SDK-master' / 'src'))
+
+from robomaster import dds
+from robomaster import chassis
+from robomaster import protocol
+from robomaster import simulator
+from robomaster import telemetry
+
+
+class _Robot(object):
+    def __init__(self, client):
+        self.client = client
+
+
+def _record(path, unsub_before_close):
+    '''
+    Records the chassis position pushes of the simulator like examples/01_robot/11_telemetry_record.py.
+    '''
+    sim = simulator.RobotSimulator()
+    sim.start()
+    cli = sim.create_client()
+    cli.start()
+    sub = dds.Subscriber(_Robot(cli))
+    sub.start()
+    try:
+        recorder = telemetry.TelemetryRecorder(path)
+        recorder.attach(cli, sub)
+        subject = chassis.PositionSubject(1)
+        subject.freq = 50
+        assert sub.add_subject_info(subject, lambda *a: None, (), {})
+        time.sleep(0.5)
+        if unsub_before_close:
+            sub.del_subject_info(dds.DDS_POSITION)
+            recorder.close()
+        else:
+            recorder.close()
+            sub.del_subject_info(dds.DDS_POSITION)
+    finally:
+        sub.stop()
+        cli.stop()
+        sim.stop()
+
+
+def _replay(path):
+    reader = telemetry.TelemetryReader(path)
+    try:
+        pushes = sum(count for topic, count in reader.topics.items() if topic.startswith('72:8:'))
+        positions = []
+        player = telemetry.SubjectPlayer(reader.names)
+        player.add_subject(chassis.PositionSubject(1), lambda info: positions.append(info))
+        reader.replay(player, speed=None)
+        return reader, pushes, positions
+    finally:
+        reader.close()
+
+
+def test_record_replay():
+    '''
+    Every recorded position push is replayed, also when the subscription ended before the recorder was closed.
+    '''
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        for unsub_before_close in (True, False):
+            path = str(Path(tmpdirname) / 'chassis.rmtl')
+            _record(path, unsub_before_close)
+            reader, pushes, positions = _replay(path)
+            assert pushes > 0
+            assert dds.DDS_POSITION in reader.names.values()
+            assert len(positions) == pushes
+            assert all(len(info) == 3 for info in positions)
+
+
+def _push(msg_id, values):
+    proto = protocol.ProtoPushPeriodMsg()
+    payload = bytes([3, msg_id]) + struct.pack('<fff', *values)
+    proto.pack_req = lambda: payload
+    msg = protocol.Msg(0x03, 0x09, proto)
+    msg._frame = msg.pack()
+    return msg
+
+
+class _Routes(object):
+    '''
+    Stands in for the subscriber, only the msg_id routes are used by the recorder.
+    '''
+    def __init__(self):
+        self._period_routes = {}
+
+    def route(self, msg_id, subject):
+        self._period_routes = {msg_id: dds.SubHandler(self, subject, None)}
+
+
+def test_reused_msg_id():
+    '''
+    A msg_id reused by another subscription resolves to the subject that was subscribed when it was recorded.
+    '''
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        path = str(Path(tmpdirname) / 'reuse.rmtl')
+        routes = _Routes()
+        recorder = telemetry.TelemetryRecorder(path)
+        recorder._subscriber = routes
+        routes.route(20, chassis.PositionSubject(1))
+        for i in range(5):
+            recorder.record(_push(20, (i, 0, 0)), timestamp=i)
+        routes.route(20, chassis.AttiInfoSubject())
+        for i in range(5, 8):
+            recorder.record(_push(20, (i, 0, 0)), timestamp=i)
+        recorder.close()
+
+        reader = telemetry.TelemetryReader(path)
+        positions = []
+        attitudes = []
+        player = telemetry.SubjectPlayer()
+        player.add_subject(chassis.PositionSubject(1), lambda info: positions.append(info))
+        player.add_subject(chassis.AttiInfoSubject(), lambda info: attitudes.append(info))
+        assert reader.replay(player, speed=None) == 8
+        assert len(positions) == 5 and len(attitudes) == 3
+        assert len(list(reader.records(topics=[dds.DDS_POSITION]))) == 5
+        reader.close()
+
+
+if __name__ == '__main__':
+    test_record_replay()
+    test_reused_msg_id()